@@ -0,0 +1,521 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+ColumnarStore
+
+Chunked, compressed columnar store for time series on disk. Each column (and the index) is split into chunks of a fixed
+number of rows, which are compressed separately. New rows are appended to an uncompressed tail chunk, which is only
+compressed once it is full, so appending doesn't require rewriting the history. Each chunk records its first and last
+timestamp, so reads for a date range only decompress the chunks they need.
+
+Layout on disk
+
+    meta.json           - columns, dtypes, time zone and the start/finish/rows of each chunk
+    chunk_000000/       - sealed chunk, with index.bin and c0.bin, c1.bin... (one compressed file per column)
+    tail/               - open chunk, with index.raw, c0.raw... (uncompressed, appended to in place)
+
+Hot columns can be stored uncompressed in sealed chunks (as .npy files), so they can be memory mapped when reading.
+
+With the 'gorilla' codec, sealed chunks are encoded with TickCodec (delta-of-delta timestamps and XORed floats) instead,
+which is used by the 'tick' engine in IOEngine.
+
+"""
+
+import json
+import os
+import shutil
+import zlib
+
+import numpy
+import pandas
+
+try:
+    import blosc
+except: pass
+
+from findatapy.market.tickcodec import TickCodec
+from findatapy.util.dataconstants import DataConstants
+from findatapy.util.loggermanager import LoggerManager
+
+class ColumnarStore(object):
+    """Reads and writes time series to disk in a chunked columnar format, which supports cheap appends of new rows and
+    reading of date ranges. Used by IOEngine for the 'columnar' engine.
+
+    """
+
+    def __init__(self, chunk_size = None, mmap_fields = None, compression = None):
+        self.logger = LoggerManager().getLogger(__name__)
+
+        if chunk_size is None: chunk_size = DataConstants().columnar_chunk_size
+        if mmap_fields is None: mmap_fields = DataConstants().columnar_mmap_fields
+        if compression is None: compression = DataConstants().cache_compression['columnar']
+
+        self._chunk_size = chunk_size
+        self._mmap_fields = mmap_fields
+        self._compression = compression
+
+    def write(self, path, data_frame, append_data = False):
+        """Writes a DataFrame to disk in columnar format
+
+        Parameters
+        ----------
+        path : str
+            folder of columnar store
+        data_frame : DataFrame
+            data frame to be written (with a DatetimeIndex)
+        append_data : bool
+            False - write a fresh copy of the data
+            True - append data, replacing any stored rows which overlap with the data frame
+
+        Returns
+        -------
+        int, int
+            Number of rows written and number of stored rows replaced
+        """
+
+        data_frame = data_frame.sort_index()
+        data_frame.index = pandas.DatetimeIndex(data_frame.index)
+
+        meta = None
+
+        if append_data:
+            meta = self.read_meta(path)
+
+        if meta is not None and list(meta['columns']) != list(data_frame.columns):
+            self.logger.warning("Columns have changed, so rewriting " + path)
+
+            data_frame = self._combine(self.read(path), data_frame)
+            meta = None
+
+        rows_replaced = 0
+        rows_written = len(data_frame.index)
+
+        if meta is None:
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+
+            meta = self._create_meta(data_frame)
+        elif meta['rows'] > 0 and len(data_frame.index) > 0 \
+                and meta['finish'] >= self._to_int64(data_frame.index[0], meta['tz']):
+
+            # only need to rewrite the chunks which overlap with the new data (chunks are sorted by time)
+            first = self._to_int64(data_frame.index[0], meta['tz'])
+
+            chunks = [c for c in meta['chunks'] if c['finish'] >= first]
+
+            if meta['tail']['rows'] > 0:
+                chunks.append(None)
+
+            data_frame_old = self._read_chunks(path, meta, chunks)
+
+            rows_replaced = int(((data_frame_old.index >= data_frame.index[0])
+                                 & (data_frame_old.index <= data_frame.index[-1])).sum())
+
+            data_frame = self._combine(data_frame_old, data_frame)
+
+            for c in chunks:
+                if c is not None:
+                    shutil.rmtree(self._get_chunk_folder(path, c['id']), ignore_errors=True)
+                    meta['chunks'].remove(c)
+
+            shutil.rmtree(os.path.join(path, 'tail'), ignore_errors=True)
+            meta['tail'] = {'rows' : 0, 'start' : None, 'finish' : None}
+
+            self._update_meta_stats(meta)
+
+        self._append(path, meta, data_frame)
+
+        return rows_written, rows_replaced
+
+    def read(self, path, start_date = None, finish_date = None):
+        """Reads a DataFrame from disk in columnar format, only decompressing the chunks between the start and finish
+        dates
+
+        Parameters
+        ----------
+        path : str
+            folder of columnar store
+        start_date : str/datetime (optional)
+            start date
+        finish_date : str/datetime (optional)
+            finish date
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        meta = self.read_meta(path)
+
+        if meta is None: return None
+
+        start, finish = self._get_int64_range(meta, start_date, finish_date)
+
+        chunks = [c for c in meta['chunks'] if c['finish'] >= start and c['start'] <= finish]
+
+        if meta['tail']['rows'] > 0 and meta['tail']['finish'] >= start and meta['tail']['start'] <= finish:
+            chunks.append(None)
+
+        data_frame = self._read_chunks(path, meta, chunks)
+
+        if start_date is not None or finish_date is not None:
+            index = data_frame.index.asi8
+            data_frame = data_frame.iloc[numpy.searchsorted(index, start, side='left'):
+                                         numpy.searchsorted(index, finish, side='right')]
+
+        return data_frame
+
+    def read_column(self, path, column, start_date = None, finish_date = None):
+        """Reads a single column as a NumPy array. Hot columns which are stored uncompressed are memory mapped (and if
+        all the rows are in one chunk, no copy is made).
+
+        Parameters
+        ----------
+        path : str
+            folder of columnar store
+        column : str
+            column to be read
+        start_date : str/datetime (optional)
+            start date
+        finish_date : str/datetime (optional)
+            finish date
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            Index (as int64 nanoseconds since epoch in UTC) and values of the column
+        """
+
+        meta = self.read_meta(path)
+
+        if meta is None: return None, None
+
+        start, finish = self._get_int64_range(meta, start_date, finish_date)
+        col = list(meta['columns']).index(column)
+
+        chunks = [c for c in meta['chunks'] if c['finish'] >= start and c['start'] <= finish]
+
+        if meta['tail']['rows'] > 0 and meta['tail']['finish'] >= start and meta['tail']['start'] <= finish:
+            chunks.append(None)
+
+        index_list = []
+        values_list = []
+
+        for c in chunks:
+            index = self._read_chunk_array(path, meta, c, 'index', 'int64', False)
+            values = self._read_chunk_array(path, meta, c, 'c' + str(col), meta['dtypes'][col],
+                                            col in meta['mmap_columns'])
+
+            i_start = numpy.searchsorted(index, start, side='left')
+            i_finish = numpy.searchsorted(index, finish, side='right')
+
+            index_list.append(index[i_start:i_finish])
+            values_list.append(values[i_start:i_finish])
+
+        if len(chunks) == 1:
+            return index_list[0], values_list[0]
+        elif len(chunks) == 0:
+            return numpy.zeros(0, dtype='int64'), numpy.zeros(0, dtype=meta['dtypes'][col])
+
+        return numpy.concatenate(index_list), numpy.concatenate(values_list)
+
+    def remove(self, path):
+        """Deletes a columnar store from disk
+
+        Parameters
+        ----------
+        path : str
+            folder of columnar store
+        """
+        shutil.rmtree(path, ignore_errors=True)
+
+    def read_meta(self, path):
+        """Reads the metadata of a columnar store, which includes the columns, dtypes and the start/finish dates and
+        number of rows in each chunk
+
+        Parameters
+        ----------
+        path : str
+            folder of columnar store
+
+        Returns
+        -------
+        dict
+        """
+        meta_filename = os.path.join(path, 'meta.json')
+
+        if not(os.path.isfile(meta_filename)):
+            return None
+
+        with open(meta_filename, 'r') as f:
+            return json.load(f)
+
+    ### internal methods for writing
+    def _create_meta(self, data_frame):
+        for c in data_frame.columns:
+            if data_frame[c].dtype.kind not in 'biuf':
+                raise Exception('Columnar store only supports numeric columns: ' + str(c))
+
+        tz = None
+
+        if data_frame.index.tz is not None:
+            tz = str(data_frame.index.tz)
+
+        mmap_columns = [i for i, c in enumerate(data_frame.columns) if str(c).split('.')[-1] in self._mmap_fields]
+
+        return {'columns' : list(data_frame.columns),
+                'dtypes' : [data_frame[c].dtype.str for c in data_frame.columns],
+                'index_name' : data_frame.index.name,
+                'tz' : tz,
+                'chunk_size' : self._chunk_size,
+                'compression' : self._get_compression(),
+                'mmap_columns' : mmap_columns,
+                'next_chunk_id' : 0,
+                'chunks' : [],
+                'tail' : {'rows' : 0, 'start' : None, 'finish' : None},
+                'rows' : 0,
+                'start' : None,
+                'finish' : None}
+
+    def _append(self, path, meta, data_frame):
+        """Appends rows to the tail chunk, sealing (compressing) it whenever it is full. Assumes the rows are after
+        any stored rows.
+        """
+
+        index = self._index_to_int64(data_frame.index)
+        values = [numpy.ascontiguousarray(data_frame[c].values, dtype=meta['dtypes'][i])
+                  for i, c in enumerate(meta['columns'])]
+
+        tail_folder = os.path.join(path, 'tail')
+
+        pos = 0
+
+        while pos < len(index):
+            if not(os.path.isdir(tail_folder)):
+                os.makedirs(tail_folder)
+
+            tail = meta['tail']
+            take = min(meta['chunk_size'] - tail['rows'], len(index) - pos)
+
+            self._append_raw(os.path.join(tail_folder, 'index.raw'), index[pos:pos + take], tail['rows'])
+
+            for i in range(0, len(values)):
+                self._append_raw(os.path.join(tail_folder, 'c' + str(i) + '.raw'), values[i][pos:pos + take],
+                                 tail['rows'])
+
+            if tail['rows'] == 0: tail['start'] = int(index[pos])
+
+            tail['finish'] = int(index[pos + take - 1])
+            tail['rows'] = tail['rows'] + take
+
+            pos = pos + take
+
+            if tail['rows'] == meta['chunk_size']:
+                self._seal_tail(path, meta)
+
+        self._update_meta_stats(meta)
+        self._write_meta(path, meta)
+
+    def _append_raw(self, filename, arr, rows):
+        # write at the position given by the metadata (truncating anything after, eg. from an interrupted write)
+        if os.path.isfile(filename):
+            mode = 'r+b'
+        else:
+            mode = 'wb'
+
+        with open(filename, mode) as f:
+            f.seek(rows * arr.dtype.itemsize)
+            f.write(arr.tobytes())
+            f.truncate()
+
+    def _seal_tail(self, path, meta):
+        tail = meta['tail']
+        chunk = {'id' : meta['next_chunk_id'], 'rows' : tail['rows'], 'start' : tail['start'], 'finish' : tail['finish']}
+
+        chunk_folder = self._get_chunk_folder(path, chunk['id'])
+        os.makedirs(chunk_folder)
+
+        index = self._read_chunk_array(path, meta, None, 'index', 'int64', False)
+        self._write_compressed(os.path.join(chunk_folder, 'index.bin'), index, meta['compression'])
+
+        for i in range(0, len(meta['columns'])):
+            values = self._read_chunk_array(path, meta, None, 'c' + str(i), meta['dtypes'][i], False)
+
+            if i in meta['mmap_columns']:
+                numpy.save(os.path.join(chunk_folder, 'c' + str(i) + '.npy'), values)
+            else:
+                self._write_compressed(os.path.join(chunk_folder, 'c' + str(i) + '.bin'), values, meta['compression'])
+
+        shutil.rmtree(os.path.join(path, 'tail'), ignore_errors=True)
+
+        meta['chunks'].append(chunk)
+        meta['next_chunk_id'] = meta['next_chunk_id'] + 1
+        meta['tail'] = {'rows' : 0, 'start' : None, 'finish' : None}
+
+    def _update_meta_stats(self, meta):
+        chunks = meta['chunks'] + [meta['tail']]
+        chunks = [c for c in chunks if c['rows'] > 0]
+
+        meta['rows'] = sum(c['rows'] for c in chunks)
+
+        if chunks == []:
+            meta['start'] = None
+            meta['finish'] = None
+        else:
+            meta['start'] = chunks[0]['start']
+            meta['finish'] = chunks[-1]['finish']
+
+    def _write_meta(self, path, meta):
+        meta_filename = os.path.join(path, 'meta.json')
+
+        # write to temporary file first, so we never have a half written meta file
+        with open(meta_filename + '.temp', 'w') as f:
+            json.dump(meta, f)
+
+        os.replace(meta_filename + '.temp', meta_filename)
+
+    def _write_compressed(self, filename, arr, compression):
+        with open(filename, 'wb') as f:
+            f.write(self._compress(arr, compression))
+
+    def _get_compression(self):
+        compression = {'codec' : 'zlib', 'level' : 5, 'shuffle' : None}
+        compression.update(self._compression)
+
+        # fall back to zlib if blosc isn't installed
+        if 'blosc' in compression['codec']:
+            try:
+                blosc.__version__
+            except:
+                compression['codec'] = 'zlib'
+
+        if compression['level'] is None: compression['level'] = 5
+
+        return compression
+
+    def _compress(self, arr, compression):
+        codec = compression['codec']
+
+        if codec == 'gorilla':
+            return TickCodec().encode(arr)
+
+        if 'blosc' in codec:
+            cname = 'blosclz'
+
+            if ':' in codec: cname = codec.split(':')[1]
+
+            shuffle = {'byte' : blosc.SHUFFLE, 'bit' : blosc.BITSHUFFLE}.get(compression['shuffle'], blosc.NOSHUFFLE)
+
+            return blosc.compress(arr.tobytes(), typesize=arr.dtype.itemsize, clevel=compression['level'],
+                                  shuffle=shuffle, cname=cname)
+
+        return zlib.compress(arr.tobytes(), compression['level'])
+
+    def _decompress(self, buf, compression, dtype):
+        if compression['codec'] == 'gorilla':
+            return TickCodec().decode(buf, dtype)
+
+        if 'blosc' in compression['codec']:
+            return numpy.frombuffer(blosc.decompress(buf), dtype=dtype)
+
+        return numpy.frombuffer(zlib.decompress(buf), dtype=dtype)
+
+    ### internal methods for reading
+    def _get_chunk_folder(self, path, chunk_id):
+        return os.path.join(path, 'chunk_' + str(chunk_id).zfill(6))
+
+    def _read_chunk_array(self, path, meta, chunk, name, dtype, mmap):
+        # None refers to the (uncompressed) tail chunk
+        if chunk is None:
+            filename = os.path.join(path, 'tail', name + '.raw')
+
+            if mmap:
+                return numpy.memmap(filename, dtype=dtype, mode='r', shape=(meta['tail']['rows'],))
+
+            return numpy.fromfile(filename, dtype=dtype, count=meta['tail']['rows'])
+
+        chunk_folder = self._get_chunk_folder(path, chunk['id'])
+
+        if mmap:
+            return numpy.load(os.path.join(chunk_folder, name + '.npy'), mmap_mode='r')
+
+        with open(os.path.join(chunk_folder, name + '.bin'), 'rb') as f:
+            return self._decompress(f.read(), meta['compression'], dtype)
+
+    def _read_chunks(self, path, meta, chunks):
+        index_list = []
+        values_list = [[] for c in meta['columns']]
+
+        for c in chunks:
+            index_list.append(self._read_chunk_array(path, meta, c, 'index', 'int64', False))
+
+            for i in range(0, len(meta['columns'])):
+                values_list[i].append(self._read_chunk_array(path, meta, c, 'c' + str(i), meta['dtypes'][i],
+                                                             i in meta['mmap_columns']))
+
+        if index_list == []:
+            index = numpy.zeros(0, dtype='int64')
+            values = [numpy.zeros(0, dtype=d) for d in meta['dtypes']]
+        else:
+            index = numpy.concatenate(index_list)
+            values = [numpy.concatenate(v) for v in values_list]
+
+        data_frame = pandas.DataFrame(dict(zip(range(0, len(values)), values)), index=self._int64_to_index(index, meta))
+        data_frame.columns = meta['columns']
+
+        return data_frame
+
+    def _combine(self, data_frame_old, data_frame):
+        # keep old rows outside the dates of the new data frame
+        data_frame_old = data_frame_old.loc[(data_frame_old.index < data_frame.index[0])
+                                            | (data_frame_old.index > data_frame.index[-1])]
+
+        return pandas.concat([data_frame_old, data_frame]).sort_index()
+
+    ### conversion of dates
+    def _index_to_int64(self, index):
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+
+        return numpy.ascontiguousarray(index.values.astype('datetime64[ns]').view('int64'))
+
+    def _int64_to_index(self, index, meta):
+        index = pandas.DatetimeIndex(index.astype('datetime64[ns]'), name=meta['index_name'])
+
+        if meta['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['tz'])
+
+        return index
+
+    def _to_int64(self, date, tz):
+        date = pandas.Timestamp(date)
+
+        # assume naive dates are in the same time zone as the stored data
+        if date.tz is None and tz is not None:
+            date = date.tz_localize(tz)
+
+        if date.tz is not None:
+            date = date.tz_convert('UTC').tz_localize(None)
+
+        return int(numpy.datetime64(date.to_datetime64(), 'ns').astype('int64'))
+
+    def _get_int64_range(self, meta, start_date, finish_date):
+        start = numpy.iinfo('int64').min
+        finish = numpy.iinfo('int64').max
+
+        if start_date is not None: start = self._to_int64(start_date, meta['tz'])
+        if finish_date is not None: finish = self._to_int64(finish_date, meta['tz'])
+
+        return start, finish
@@ -0,0 +1,197 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+import pandas
+
+from findatapy.market.ioengine import IOEngine
+from findatapy.util.loggermanager import LoggerManager
+
+class CompressionBenchmark(object):
+    """Measures write throughput, read throughput and compression ratio for different compression settings (codec, level
+    and shuffle filter) on our own cached data, and recommends a setting, which can be used in
+    DataConstants.cache_compression (or DataConstants.cache_compression_categories).
+
+    """
+
+    def __init__(self):
+        self.logger = LoggerManager().getLogger(__name__)
+        self.io_engine = IOEngine()
+
+    def get_candidates(self, codecs = ['blosc:lz4', 'blosc:zstd', 'blosc:blosclz', 'zlib'], levels = [1, 5, 9],
+                       shuffles = ['byte'], engine = None):
+        """Creates a list of compression settings to test, from every combination of codec, level and shuffle filter
+
+        Parameters
+        ----------
+        codecs : str (list)
+            codecs eg. 'blosc:lz4', 'zlib'
+        levels : int (list)
+            compression levels (0-9)
+        shuffles : str (list)
+            shuffle filters, 'byte', 'bit' or None
+        engine : str (optional)
+            engine to benchmark, for 'columnar' and 'tick' we also test the 'gorilla' codec (which has no level or
+            shuffle filter)
+
+        Returns
+        -------
+        list(dict)
+        """
+        candidates = [{'codec' : c, 'level' : l, 'shuffle' : s} for c, l, s in itertools.product(codecs, levels, shuffles)]
+
+        if engine in ['columnar', 'tick'] and 'gorilla' not in codecs:
+            candidates.append({'codec' : 'gorilla', 'level' : None, 'shuffle' : None})
+
+        return candidates
+
+    def benchmark_cache(self, fname, read_engine = 'hdf5', engine = 'hdf5_fixed', candidates = None, repeats = 3,
+                        start_date = None, finish_date = None):
+        """Benchmarks compression settings on a time series we have already cached
+
+        Parameters
+        ----------
+        fname : str
+            cache to be read
+        read_engine : str
+            engine the cache is stored in
+        engine : str
+            engine to benchmark eg. 'hdf5_fixed', 'hdf5_table', 'columnar' or 'tick'
+        candidates : list(dict) (optional)
+            compression settings to test (default: get_candidates() for the engine)
+        repeats : int
+            number of times to repeat each read/write (we take the quickest)
+        start_date : str/datetime (optional)
+            start date of cached data to use
+        finish_date : str/datetime (optional)
+            finish date of cached data to use
+
+        Returns
+        -------
+        DataFrame
+        """
+        data_frame = self.io_engine.read_time_series_cache_from_disk(fname, engine=read_engine, start_date=start_date,
+                                                                     finish_date=finish_date)
+
+        if data_frame is None:
+            self.logger.warning("No cached data to benchmark in " + fname)
+
+            return None
+
+        return self.benchmark(data_frame, engine=engine, candidates=candidates, repeats=repeats)
+
+    def benchmark(self, data_frame, engine = 'hdf5_fixed', candidates = None, repeats = 3):
+        """Benchmarks compression settings for writing and reading a DataFrame. Note that the columnar and tick engines
+        only compress sealed chunks, so data_frame should be larger than DataConstants.columnar_chunk_size
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            time series to write/read
+        engine : str
+            engine to benchmark eg. 'hdf5_fixed', 'hdf5_table', 'columnar' or 'tick'
+        candidates : list(dict) (optional)
+            compression settings to test (default: get_candidates() for the engine)
+        repeats : int
+            number of times to repeat each read/write (we take the quickest)
+
+        Returns
+        -------
+        DataFrame
+            Write and read throughput (in MB/s of uncompressed data), compression ratio and size on disk for each setting
+        """
+
+        if candidates is None: candidates = self.get_candidates(engine=engine)
+
+        raw_mb = data_frame.memory_usage(index=True).sum() / 1e6
+
+        temp_folder = tempfile.mkdtemp()
+        fname = os.path.join(temp_folder, 'benchmark')
+
+        results = []
+
+        try:
+            for compression in candidates:
+                write_time = float('inf')
+                read_time = float('inf')
+
+                for i in range(0, repeats):
+                    self.io_engine.remove_time_series_cache_on_disk(fname, engine=engine)
+
+                    start = time.time()
+                    self.io_engine.write_time_series_cache_to_disk(fname, data_frame.copy(), engine=engine,
+                                                                   compression=compression)
+                    write_time = min(write_time, time.time() - start)
+
+                for i in range(0, repeats):
+                    start = time.time()
+                    self.io_engine.read_time_series_cache_from_disk(fname, engine=engine)
+                    read_time = min(read_time, time.time() - start)
+
+                size_mb = self._get_size_on_disk(fname, engine) / 1e6
+
+                results.append([compression['codec'], compression['level'], compression['shuffle'],
+                                raw_mb / write_time, raw_mb / read_time, raw_mb / size_mb, size_mb])
+
+                self.logger.info("Benchmarked " + str(compression))
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+        return pandas.DataFrame(results, columns=['codec', 'level', 'shuffle', 'write_mb_per_s', 'read_mb_per_s',
+                                                  'ratio', 'size_mb'])
+
+    def recommend(self, results, min_ratio = 0.9, write_weight = 0.5):
+        """Recommends a compression setting from benchmark results. We only consider those settings which compress
+        almost as well as the best one, and then pick the quickest, using a weighted harmonic mean of the write and read
+        throughput (ie. the throughput for a mix of reads and writes).
+
+        Parameters
+        ----------
+        results : DataFrame
+            output of benchmark
+        min_ratio : float
+            fraction of the best compression ratio a setting needs to be considered (default 0.9)
+        write_weight : float
+            weight of writes vs. reads, between 0 and 1 (default 0.5)
+
+        Returns
+        -------
+        dict
+        """
+
+        results = results[results['ratio'] >= min_ratio * results['ratio'].max()]
+
+        throughput = 1.0 / (write_weight / results['write_mb_per_s'] + (1.0 - write_weight) / results['read_mb_per_s'])
+
+        best = results.loc[throughput.idxmax()]
+
+        # some codecs (eg. 'gorilla') have no level or shuffle filter
+        return {'codec' : best['codec'], 'level' : None if pandas.isnull(best['level']) else int(best['level']),
+                'shuffle' : None if pandas.isnull(best['shuffle']) else best['shuffle']}
+
+    def _get_size_on_disk(self, fname, engine):
+        if engine in ['columnar', 'tick']:
+            if engine == 'columnar':
+                path = self.io_engine.get_columnar_filename(fname)
+            else:
+                path = self.io_engine.get_tick_filename(fname)
+
+            return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+
+        return os.path.getsize(self.io_engine.get_h5_filename(fname))
@@ -1,7 +1,7 @@
-from findatapy.timeseries import Calculations
 from findatapy.util import LoggerManager
 from findatapy.market import MarketDataRequest
 
+import numpy
 import pandas
 
 #######################################################################################################################
@@ -12,7 +12,6 @@ class FXCLSVolume(object):
 
         self.cache = {}
 
-        self.calculations = Calculations()
         self.market_data_generator = market_data_generator
 
         return
@@ -67,29 +66,25 @@ class FXCLSVolume(object):
         data_frame.index.name = 'Date'
         data_frame.index = pandas.DatetimeIndex(data_frame.index)
 
-        df_list = []
+        hours = numpy.arange(0, 24)
 
-        for t in currency_pairs:
+        # reshape (date x pair x hour) into (date x hour, pair), with timestamps of date + hour
+        fields = [t + "." + str(i) + 'h' for t in currency_pairs for i in hours]
 
-            df = None
-            for i in range(0, 24):
-                txt = str(i)
+        values = data_frame[fields].values.reshape(len(data_frame.index), len(currency_pairs), len(hours))
+        values = values.transpose(0, 2, 1).reshape(-1, len(currency_pairs))
 
-                df1 = pandas.DataFrame(data_frame[t + "." + txt + 'h'].copy())
+        index = data_frame.index.values[:, numpy.newaxis] \
+                + hours.astype('timedelta64[h]')[numpy.newaxis, :]
 
-                df1.columns = [t + '.volume']
-                df1.index = df1.index + pandas.DateOffset(hours=i)
+        data_frame_new = pandas.DataFrame(values, index=pandas.DatetimeIndex(index.ravel()),
+                                          columns=[t + '.volume' for t in currency_pairs])
+        data_frame_new.index.name = 'Date'
 
-                if df is None:
-                    df = df1
-                else:
-                    df = df.append(df1)
+        if not(data_frame_new.index.is_monotonic_increasing):
+            data_frame_new = data_frame_new.sort_index()
 
-            df = df.sort_index()
-            df_list.append(df)
-
-        data_frame_new = Calculations().pandas_outer_join(df_list)
         import pytz
 
         data_frame_new = data_frame_new.tz_localize(pytz.utc)
-        return data_frame_new
\ No newline at end of file
+        return data_frame_new
@@ -20,6 +20,7 @@ denomination and construct indices from forwards series.
 
 """
 
+import numpy
 import pandas
 
 class IndicesFX:
@@ -60,47 +61,32 @@ class IndicesFX:
         if not(isinstance(cross_fx, list)):
             cross_fx = [cross_fx]
 
-        total_return_index_agg = None
+        # build an aligned panel of spot, base deposits and terms deposits (one column for each cross)
+        spot = spot_df[[cross + ".close" for cross in cross_fx]]
 
-        for cross in cross_fx:
-            # get the spot series, base deposit
-            spot = spot_df[cross + ".close"].to_frame()
-            base_deposit = deposit_df[cross[0:3] + tenor + ".close"].to_frame()
-            terms_deposit = deposit_df[cross[3:6] + tenor + ".close"].to_frame()
-            carry = base_deposit.join(terms_deposit, how='inner')
+        base_fields = [cross[0:3] + tenor + ".close" for cross in cross_fx]
+        terms_fields = [cross[3:6] + tenor + ".close" for cross in cross_fx]
 
+        # align the base & terms deposits series to spot
+        deposit = deposit_df[list(set(base_fields + terms_fields))].reindex(spot.index).ffill() / 100.0
 
-            base_daycount = self.get_day_count_conv(cross[0:3])
-            terms_daycount = self.get_day_count_conv(cross[4:6])
+        base_deposit = deposit[base_fields].values
+        terms_deposit = deposit[terms_fields].values
 
-            # align the base & terms deposits series to spot
-            spot, carry = spot.align(carry, join='left', axis = 0)
-            carry = carry.fillna(method = 'ffill') / 100.0
-            spot = spot[cross + ".close"].to_frame()
-            base_deposit = carry[base_deposit.columns]
-            terms_deposit = carry[terms_deposit.columns]
+        base_daycount = numpy.array([self.get_day_count_conv(cross[0:3]) for cross in cross_fx])
+        terms_daycount = numpy.array([self.get_day_count_conv(cross[3:6]) for cross in cross_fx])
 
-            # calculate the time difference between each data point
-            spot['index_col'] = spot.index
-            time = spot['index_col'].diff()
-            spot = spot.drop('index_col', 1)
+        # calculate the time difference between each data point (in days)
+        time_diff = numpy.diff(spot.index.values.astype('datetime64[ns]').astype('int64')) / 86400000000000.0
+        time_diff = time_diff[:, numpy.newaxis]
 
-            total_return_index = pandas.DataFrame(index = spot.index, columns = spot.columns)
-            total_return_index.iloc[0] = 100
+        spot = spot.values.astype(numpy.float64)
 
-            for i in range(1, len(total_return_index.index)):
-                time_diff = time.values[i].astype(float) / 86400000000000.0 # get time difference in days
+        # growth of total return index is change in spot and carry accrued on the base deposit, less carry paid on terms
+        growth = numpy.ones(spot.shape)
 
-                # TODO vectorise this formulae
-                # calculate total return index as product of yesterday, changes in spot and carry accrued
-                total_return_index.values[i] = total_return_index.values[i-1] * \
-                                        (1 + (1 + base_deposit.values[i] * time_diff/base_daycount)*
-                                              (spot.values[i]/spot.values[i-1]) \
-                                        - (1+ terms_deposit.values[i]*time_diff/terms_daycount))
+        growth[1:] = 1 + (1 + base_deposit[1:] * time_diff / base_daycount) * (spot[1:] / spot[:-1]) \
+                     - (1 + terms_deposit[1:] * time_diff / terms_daycount)
 
-            if total_return_index_agg is None:
-                total_return_index_agg = total_return_index
-            else:
-                total_return_index_agg = total_return_index_agg.join(total_return_index, how = 'outer')
-
-        return total_return_index_agg
\ No newline at end of file
+        return pandas.DataFrame(100.0 * numpy.cumprod(growth, axis=0), index=spot_df.index,
+                                columns=[cross + ".close" for cross in cross_fx])
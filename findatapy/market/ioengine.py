@@ -13,8 +13,10 @@ __author__ = 'saeedamen' # Saeed Amen
 #
 
 import pandas
+import numpy
 import codecs
 import datetime
+import json
 from dateutil.parser import parse
 import shutil
 
@@ -25,10 +27,12 @@ except: pass
 from openpyxl import load_workbook
 import os.path
 
+from findatapy.market.columnarstore import ColumnarStore
 from findatapy.util.dataconstants import DataConstants
 from findatapy.util.loggermanager import LoggerManager
+from findatapy.util.swimpool import SwimPool
 
-# NOTE: BCOLZ support is alpha!
+# NOTE: BCOLZ support is alpha! (and bcolz is no longer maintained, use the 'columnar' engine instead)
 _replace_chars = ['_a_',
                   '_d_',
                   '_h_',
@@ -55,7 +59,11 @@ class IOEngine(object):
 
     Can be used to save down output of finmarketpy backtests and also to cache market data locally.
 
-    Also supports BColz (but not currently stable). Planning to add other interfaces such as SQL etc.
+    Also has a chunked columnar format on disk, which supports cheap appends and reading date ranges (the older BColz
+    support is not stable). Planning to add other interfaces such as SQL etc.
+
+    Caches can also be split into year/month partitions on disk (eg. for intraday data with a long history), so we only
+    need to read the partitions overlapping with the dates we want.
 
     """
 
@@ -138,12 +146,19 @@ class IOEngine(object):
     def remove_time_series_cache_on_disk(self, fname, engine = 'hdf5_fixed', db_server = '127.0.0.1', db_port='6379', timeout = 10, username = None,
                                          password = None):
 
+        if self._get_partition_engine(engine) is not None:
+            return self.remove_time_series_cache_on_disk_partitioned(fname)
+
         if 'hdf5' in engine:
             engine = 'hdf5'
 
         if (engine == 'bcolz'):
             # convert invalid characters to substitutes (which Bcolz can't deal with)
             pass
+        elif (engine == 'columnar'):
+            ColumnarStore().remove(self.get_columnar_filename(fname))
+        elif (engine == 'tick'):
+            ColumnarStore().remove(self.get_tick_filename(fname))
         elif (engine == 'redis'):
             import redis
 
@@ -205,7 +220,7 @@ class IOEngine(object):
     def write_time_series_cache_to_disk(self, fname, data_frame,
                                         engine = 'hdf5_fixed', append_data = False, db_server = DataConstants().db_server,
                                         db_port = None, username = None, password = None,
-                                        filter_out_matching = None, timeout = 10):
+                                        filter_out_matching = None, timeout = 10, compression = None):
         """Writes Pandas data frame to disk as HDF5 format or bcolz format or in Arctic
 
         Parmeters
@@ -219,6 +234,11 @@ class IOEngine(object):
             'hdf5_table' - use HDF5 table format, slower but can append to
             'arctic' - use Arctic/MongoDB database
             'redis' - use Redis
+            'columnar' - use chunked columnar format, can append to cheaply
+            'tick' - use chunked columnar format with Gorilla style encoding (delta-of-delta timestamps and XORed
+            floats), much smaller for tick data, can append to cheaply
+            'partitioned' - split into year/month partitions each stored in HDF5 fixed format, or eg.
+            'partitioned_columnar' for partitions in another engine (appends only rewrite the overlapping partitions)
         append_data : bool
             False - write a fresh copy of data on disk each time
             True - append data to disk
@@ -226,8 +246,26 @@ class IOEngine(object):
             Database server for arctic (default: '127.0.0.1')
         timeout : int
             Number of seconds to do timeout
+        compression : dict (optional)
+            Codec, level and shuffle filter to use eg. {'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : 'byte'}
+            (by default uses the settings for the engine/category in DataConstants)
+
+        Returns
+        -------
+        int, int
+            For HDF5 appends and the columnar engine, the number of rows written and the number of stored rows replaced
+            (for partitioned caches, the list of partitions written, otherwise None)
         """
 
+        partition_engine = self._get_partition_engine(engine)
+
+        if partition_engine is not None:
+            if not(append_data):
+                self.remove_time_series_cache_on_disk_partitioned(fname)
+
+            return self.write_time_series_cache_to_disk_partitioned(fname, data_frame, engine=partition_engine,
+                                                                    compression=compression)
+
         # default HDF5 format
         hdf5_format = 'fixed'
 
@@ -235,6 +273,9 @@ class IOEngine(object):
             hdf5_format = engine.split('_')[1]
             engine = 'hdf5'
 
+        if compression is None:
+            compression = self.get_compression(engine, fname)
+
         if (engine == 'bcolz'):
             # convert invalid characters to substitutes (which Bcolz can't deal with)
             data_frame.columns = self.find_replace_chars(data_frame.columns, _invalid_chars, _replace_chars)
@@ -245,6 +286,29 @@ class IOEngine(object):
             bcolzpath = self.get_bcolz_filename(fname)
             shutil.rmtree(bcolzpath, ignore_errors=True)
             zlens = bcolz.ctable.fromdataframe(data_frame, rootdir=bcolzpath)
+        elif (engine == 'columnar'):
+            columnar_filename = self.get_columnar_filename(fname)
+
+            if ('intraday' in fname):
+                data_frame = data_frame.astype('float32')
+
+            rows_written, rows_replaced = ColumnarStore(compression=compression).write(columnar_filename, data_frame,
+                                                                                     append_data=append_data)
+
+            self.logger.info("Written " + str(rows_written) + " rows to " + columnar_filename + ", replacing "
+                             + str(rows_replaced) + " overlapping rows")
+
+            return rows_written, rows_replaced
+        elif (engine == 'tick'):
+            tick_filename = self.get_tick_filename(fname)
+
+            rows_written, rows_replaced = ColumnarStore(compression=compression).write(tick_filename, data_frame,
+                                                                                     append_data=append_data)
+
+            self.logger.info("Written " + str(rows_written) + " rows to " + tick_filename + ", replacing "
+                             + str(rows_replaced) + " overlapping rows")
+
+            return rows_written, rows_replaced
         elif (engine == 'redis'):
             import redis
 
@@ -253,7 +317,7 @@ class IOEngine(object):
             try:
                 r = redis.StrictRedis(host=db_server, port=db_port, db=0, socket_timeout=timeout,
                  socket_connect_timeout=timeout)
-                r.set(fname, data_frame.to_msgpack(compress='blosc'))
+                r.set(fname, data_frame.to_msgpack(compress=compression['codec'].split(':')[0]))
                 self.logger.info("Pushed " + fname + " to Redis")
             except Exception as e:
                 self.logger.warning("Couldn't push " + fname + " to Redis: " + str(e))
@@ -319,31 +383,20 @@ class IOEngine(object):
             h5_filename = self.get_h5_filename(fname)
 
             # append data only works for HDF5 stored as tables (but this is much slower than fixed format)
-            # removes duplicated entries at the end
+            # does an upsert, replacing any stored rows which overlap with the incoming time series
             if append_data:
-                store = pandas.HDFStore(h5_filename, format=hdf5_format, complib="blosc", complevel=9)
+                store = self._open_hdf5_store(h5_filename, compression)
 
                 if ('intraday' in fname):
                     data_frame = data_frame.astype('float32')
 
-                # get last row which matches and remove everything after that (because append
-                # function doesn't check for duplicated rows
-                nrows = len(store['data'].index)
-                last_point = data_frame.index[-1]
-
-                i = nrows - 1
-
-                while(i > 0):
-                    read_index = store.select('data', start=i, stop=nrows).index[0]
-
-                    if (read_index <= last_point): break
+                rows_written, rows_replaced = self.upsert_hdf5_table(store, data_frame)
+                store.close()
 
-                    i = i - 1
+                self.logger.info("Written " + str(rows_written) + " rows to " + h5_filename + ", replacing "
+                                 + str(rows_replaced) + " overlapping rows")
 
-                # remove rows at the end, which are duplicates of the incoming time series
-                store.remove(key='data', start=i, stop=nrows)
-                store.put(key='data', value=data_frame, format=hdf5_format, append=True)
-                store.close()
+                return rows_written, rows_replaced
             else:
                 h5_filename_temp = self.get_h5_filename(fname + ".temp")
 
@@ -352,12 +405,13 @@ class IOEngine(object):
                     os.remove(h5_filename_temp)
                 except: pass
 
-                store = pandas.HDFStore(h5_filename_temp, format=hdf5_format, complib="blosc", complevel=9)
+                store = self._open_hdf5_store(h5_filename_temp, compression)
 
                 if ('intraday' in fname):
                     data_frame = data_frame.astype('float32')
 
                 store.put(key='data', value=data_frame, format=hdf5_format)
+                self._set_hdf5_max_date(store, data_frame)
                 store.close()
 
                 # delete the old copy
@@ -368,6 +422,137 @@ class IOEngine(object):
                 # once written to disk rename
                 os.rename(h5_filename_temp, h5_filename)
 
+    def get_compression(self, engine, fname = None):
+        """Gets the compression settings (codec, level and shuffle filter) for an engine, which are defined in
+        DataConstants, and can be overridden for particular categories (taken from the cache filename, which is of the
+        form environment.category.data_source.freq.cut.ticker)
+
+        Parameters
+        ----------
+        engine : str
+            'hdf5', 'columnar', 'tick' or 'redis'
+        fname : str (optional)
+            cache filename
+
+        Returns
+        -------
+        dict
+        """
+
+        if 'hdf5' in engine: engine = 'hdf5'
+
+        compression = {'codec' : 'blosc', 'level' : 9, 'shuffle' : 'byte'}
+        compression.update(DataConstants().cache_compression.get(engine, {}))
+
+        category = self._get_category_from_filename(fname)
+
+        if category in DataConstants().cache_compression_categories:
+            compression.update(DataConstants().cache_compression_categories[category].get(engine, {}))
+
+        return compression
+
+    def _get_category_from_filename(self, fname):
+        if fname is None: return None
+
+        # for partitioned caches, the key is a folder further up the path
+        for f in reversed(fname.replace('\\', '/').split('/')):
+            f = f.split('.')
+
+            if len(f) >= 5: return f[1]
+
+        return None
+
+    def _open_hdf5_store(self, h5_filename, compression):
+        codec = compression['codec']
+        level = compression['level']
+
+        if level is None: level = 9
+
+        store = pandas.HDFStore(h5_filename, complib=codec, complevel=level)
+
+        # PyTables uses the byte shuffle filter by default, but pandas doesn't let us choose another one, so in that case
+        # replace the filters pandas uses for new tables/arrays
+        if compression['shuffle'] != 'byte':
+            try:
+                import tables
+
+                if not(hasattr(store, '_filters')):
+                    raise AttributeError("HDFStore has no _filters attribute")
+
+                store._filters = tables.Filters(complevel=level, complib=codec,
+                                                shuffle=False, bitshuffle=compression['shuffle'] == 'bit')
+            except (ImportError, AttributeError, TypeError, ValueError) as e:
+                self.logger.warning("Couldn't set " + str(compression['shuffle']) + " shuffle filter for "
+                                    + h5_filename + ", using byte shuffle instead: " + str(e))
+
+        return store
+
+    def upsert_hdf5_table(self, store, data_frame):
+        """Upserts a DataFrame into the 'data' table of an open HDFStore, replacing any stored rows which overlap with
+        the incoming time series. The maximum stored timestamp is kept in the table metadata, so pure appends don't need
+        to touch the stored data at all. Otherwise we read only the index column and binary search it for the overlap,
+        rather than selecting the table row by row.
+
+        Parameters
+        ----------
+        store : HDFStore
+            HDF5 store (opened in table format)
+        data_frame : DataFrame
+            data frame to be upserted
+
+        Returns
+        -------
+        int, int
+            Number of rows written and number of stored rows replaced
+        """
+
+        if data_frame.empty:
+            return 0, 0
+
+        data_frame = data_frame.sort_index()
+
+        if 'data' not in store:
+            store.append(key='data', value=data_frame)
+            self._set_hdf5_max_date(store, data_frame)
+
+            return len(data_frame.index), 0
+
+        nrows = store.get_storer('data').nrows
+        max_date = self._get_hdf5_max_date(store)
+
+        start = nrows
+        stop = nrows
+
+        # only search for the overlap if the incoming time series starts before the end of the stored data (or if we
+        # don't know the stored max timestamp, eg. for files written before we kept it in the metadata)
+        if max_date is None or max_date >= data_frame.index[0]:
+            stored_index = pandas.Index(store.select_column('data', 'index'))
+
+            start = stored_index.searchsorted(data_frame.index[0], side='left')
+            stop = stored_index.searchsorted(data_frame.index[-1], side='right')
+
+            # keep any stored rows after the incoming time series, so the table stays sorted once we append
+            if stop < nrows:
+                data_frame = pandas.concat([data_frame, store.select('data', start=stop, stop=nrows)])
+
+            if start < nrows:
+                store.remove(key='data', start=start, stop=nrows)
+
+        store.append(key='data', value=data_frame)
+        self._set_hdf5_max_date(store, data_frame)
+
+        return int(len(data_frame.index) - (nrows - stop)), int(stop - start)
+
+    def _get_hdf5_max_date(self, store):
+        try:
+            return store.get_storer('data').attrs.max_date
+        except:
+            return None
+
+    def _set_hdf5_max_date(self, store, data_frame):
+        if not(data_frame.empty):
+            store.get_storer('data').attrs.max_date = data_frame.index.max()
+
     def get_h5_filename(self, fname):
         """Strips h5 off filename returning first portion of filename
 
@@ -402,6 +587,40 @@ class IOEngine(object):
 
         return fname + ".bcolz"
 
+    def get_columnar_filename(self, fname):
+        """Strips columnar off filename returning first portion of filename
+
+        Parameters
+        ----------
+        fname : str
+            columnar filename to strip
+
+        Returns
+        -------
+        str
+        """
+        if fname[-9:] == '.columnar':
+            return fname
+
+        return fname + ".columnar"
+
+    def get_tick_filename(self, fname):
+        """Strips tick off filename returning first portion of filename
+
+        Parameters
+        ----------
+        fname : str
+            tick filename to strip
+
+        Returns
+        -------
+        str
+        """
+        if fname[-5:] == '.tick':
+            return fname
+
+        return fname + ".tick"
+
     def write_r_compatible_hdf_dataframe(self, data_frame, fname, fields = None):
         """Write a DataFrame to disk in as an R compatible HDF5 file.
 
@@ -443,7 +662,7 @@ class IOEngine(object):
     def read_time_series_cache_from_disk(self, fname, engine = 'hdf5', start_date = None, finish_date = None,
                                          db_server = DataConstants().db_server,
                                          db_port = None, username = None, password = None):
-        """Reads time series cache from disk in either HDF5 or bcolz
+        """Reads time series cache from disk in either HDF5, columnar or bcolz
 
         Parameters
         ----------
@@ -452,7 +671,12 @@ class IOEngine(object):
         engine : str (optional)
             'hd5' - reads HDF5 files (default)
             'arctic' - reads from Arctic/MongoDB database
+            'columnar' - reads from chunked columnar format (only decompressing chunks between start/finish dates)
+            'tick' - reads from chunked columnar format with Gorilla style encoding (only decoding chunks between
+            start/finish dates)
             'bcolz' = reads from bcolz file (not fully implemented)
+            'partitioned' (or eg. 'partitioned_columnar') - reads from a partitioned cache (only loading partitions
+            between start/finish dates)
         start_date : str/datetime (optional)
             Start date
         finish_date : str/datetime (optional)
@@ -465,6 +689,10 @@ class IOEngine(object):
         DataFrame
         """
 
+        if self._get_partition_engine(engine) is not None:
+            return self.read_time_series_cache_from_disk_partitioned(fname, start_date=start_date,
+                                                                     finish_date=finish_date)
+
         if (engine == 'bcolz'):
             try:
                 name = self.get_bcolz_filename(fname)
@@ -482,6 +710,16 @@ class IOEngine(object):
                 return data_frame
             except:
                 return None
+        elif(engine == 'columnar'):
+            data_frame = ColumnarStore().read(self.get_columnar_filename(fname), start_date=start_date,
+                                              finish_date=finish_date)
+
+            if data_frame is not None and ('intraday' in fname):
+                data_frame = data_frame.astype('float32')
+
+            return data_frame
+        elif(engine == 'tick'):
+            return ColumnarStore().read(self.get_tick_filename(fname), start_date=start_date, finish_date=finish_date)
         elif(engine == 'redis'):
             import redis
 
@@ -555,6 +793,241 @@ class IOEngine(object):
 
         return None
 
+    ### functions to handle time partitioned caches on disk (eg. ticker/year/month for intraday data)
+    def write_time_series_cache_to_disk_partitioned(self, fname, data_frame, engine = 'hdf5_fixed', compression = None):
+        """Writes Pandas data frame to disk split into year/month partitions, which is useful for intraday data where we
+        have one cache per ticker with a long history. Only the partitions which overlap with the data frame are
+        rewritten (keeping any rows already in those partitions outside the dates of the data frame). A small manifest
+        records the dates and number of rows in each partition.
+
+        Parameters
+        ----------
+        fname : str
+            path of the partitioned cache (typically one per ticker)
+        data_frame : DataFrame
+            data frame to be written to disk
+        engine : str
+            'hdf5_fixed' - each partition is an HDF5 file in fixed format
+            'hdf5_table' - each partition is an HDF5 file in table format
+            'columnar' - each partition is stored in chunked columnar format
+        compression : dict (optional)
+            Codec, level and shuffle filter to use for each partition (by default uses the settings for the
+            engine/category in DataConstants)
+
+        Returns
+        -------
+        list(str)
+            Partitions which have been written
+        """
+
+        if data_frame is None or data_frame.empty:
+            return []
+
+        data_frame = data_frame.sort_index()
+        manifest = self.read_partition_manifest(fname)
+
+        # index is sorted, so each year/month partition is a contiguous block of rows
+        partition_keys = numpy.asarray(data_frame.index.year * 100 + data_frame.index.month)
+        boundaries = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(partition_keys)) + 1, [len(partition_keys)]))
+
+        job_args = []
+
+        for i in range(0, len(boundaries) - 1):
+            data_frame_partition = data_frame.iloc[boundaries[i]:boundaries[i + 1]]
+            partition = self._get_partition_name(data_frame_partition.index[0])
+
+            job_args.append((fname, partition, data_frame_partition, engine, manifest['partitions'].get(partition),
+                             compression))
+
+        for partition, entry in self._map_partitions(self._write_partition_helper, job_args, [engine]):
+            manifest['partitions'][partition] = entry
+
+        self._write_partition_manifest(fname, manifest)
+
+        self.logger.info("Written " + str(len(job_args)) + " partitions to " + fname)
+
+        return [x[1] for x in job_args]
+
+    def read_time_series_cache_from_disk_partitioned(self, fname, start_date = None, finish_date = None):
+        """Reads time series from a partitioned cache on disk, only loading those partitions which overlap with the
+        start and finish dates (in parallel)
+
+        Parameters
+        ----------
+        fname : str
+            path of the partitioned cache
+        start_date : str/datetime (optional)
+            Start date
+        finish_date : str/datetime (optional)
+            Finish date
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        manifest = self.read_partition_manifest(fname)
+
+        job_args = []
+
+        for partition in sorted(manifest['partitions'].keys()):
+            entry = manifest['partitions'][partition]
+
+            partition_start = pandas.Timestamp(entry['start'])
+            partition_finish = pandas.Timestamp(entry['finish'])
+
+            if start_date is not None and partition_finish < self._align_timestamp(start_date, partition_finish.tz):
+                continue
+
+            if finish_date is not None and partition_start > self._align_timestamp(finish_date, partition_start.tz):
+                continue
+
+            job_args.append((fname, partition, entry))
+
+        if job_args == []:
+            return None
+
+        self.logger.info("Reading " + str(len(job_args)) + " partitions from " + fname)
+
+        data_frame = pandas.concat(self._map_partitions(self._read_partition_helper, job_args,
+                                                            [x[2]['engine'] for x in job_args]))
+
+        if start_date is not None:
+            data_frame = data_frame.loc[data_frame.index >= self._align_timestamp(start_date, data_frame.index.tz)]
+
+        if finish_date is not None:
+            data_frame = data_frame.loc[data_frame.index <= self._align_timestamp(finish_date, data_frame.index.tz)]
+
+        return data_frame
+
+    def remove_time_series_cache_on_disk_partitioned(self, fname):
+        """Deletes a partitioned cache from disk (including the manifest)
+
+        Parameters
+        ----------
+        fname : str
+            path of the partitioned cache
+        """
+        shutil.rmtree(fname, ignore_errors=True)
+
+    def read_partition_manifest(self, fname):
+        """Reads the manifest of a partitioned cache, which lists each partition with its start/finish dates, number of
+        rows and the engine used to store it
+
+        Parameters
+        ----------
+        fname : str
+            path of the partitioned cache
+
+        Returns
+        -------
+        dict
+        """
+        manifest_filename = os.path.join(fname, 'manifest.json')
+
+        if not(os.path.isfile(manifest_filename)):
+            return {'partitions' : {}}
+
+        with open(manifest_filename, 'r') as f:
+            return json.load(f)
+
+    def _write_partition_manifest(self, fname, manifest):
+        manifest_filename = os.path.join(fname, 'manifest.json')
+
+        # write to temporary file first, so we never have a half written manifest
+        with open(manifest_filename + '.temp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+        os.replace(manifest_filename + '.temp', manifest_filename)
+
+    def _get_partition_engine(self, engine):
+        # engine for each partition of a partitioned cache eg. 'partitioned_columnar' (or None if not partitioned)
+        if not(engine.startswith('partitioned')):
+            return None
+
+        partition_engine = engine[len('partitioned_'):]
+
+        if partition_engine == '':
+            return 'hdf5_fixed'
+
+        if partition_engine.startswith('partitioned'):
+            raise Exception("Partitions of a partitioned cache can't themselves be partitioned")
+
+        return partition_engine
+
+    def _get_partition_name(self, date):
+        return str(date.year) + '/' + str(date.month).zfill(2)
+
+    def _get_partition_filename(self, fname, partition):
+        return os.path.join(fname, *partition.split('/'))
+
+    def _write_partition_helper(self, args):
+        return self._write_partition(*args)
+
+    def _write_partition(self, fname, partition, data_frame, engine, entry, compression):
+        partition_fname = self._get_partition_filename(fname, partition)
+
+        if not(os.path.isdir(os.path.dirname(partition_fname))):
+            os.makedirs(os.path.dirname(partition_fname), exist_ok=True)
+
+        # combine with any existing rows in the partition outside the dates we are writing
+        if entry is not None:
+            data_frame_old = self.read_time_series_cache_from_disk(partition_fname, engine=entry['engine'])
+
+            if entry['engine'] != engine:
+                self.remove_time_series_cache_on_disk(partition_fname, engine=entry['engine'])
+
+            if data_frame_old is not None:
+                data_frame_old = data_frame_old.loc[(data_frame_old.index < data_frame.index[0])
+                                                    | (data_frame_old.index > data_frame.index[-1])]
+
+                if not(data_frame_old.empty):
+                    data_frame = pandas.concat([data_frame_old, data_frame]).sort_index()
+
+        self.write_time_series_cache_to_disk(partition_fname, data_frame, engine=engine, compression=compression)
+
+        return partition, {'start' : data_frame.index[0].isoformat(), 'finish' : data_frame.index[-1].isoformat(),
+                           'rows' : len(data_frame.index), 'engine' : engine}
+
+    def _read_partition_helper(self, args):
+        return self._read_partition(*args)
+
+    def _read_partition(self, fname, partition, entry):
+        return self.read_time_series_cache_from_disk(self._get_partition_filename(fname, partition),
+                                                     engine=entry['engine'])
+
+    def _map_partitions(self, func, job_args, engines):
+        thread_no = DataConstants().io_thread_no
+        thread_technique = DataConstants().io_thread_technique
+
+        # fudge, issue with multithreading and accessing HDF5 files (PyTables isn't thread safe), so HDF5 partitions are
+        # only read/written in parallel with multiprocessing
+        if thread_technique == 'thread' and any('hdf5' in e for e in engines):
+            thread_no = 0
+
+        if thread_no > 1 and len(job_args) > 1:
+            pool = SwimPool().create_pool(thread_technique=thread_technique, thread_no=min(thread_no, len(job_args)))
+
+            result = pool.map_async(func, job_args).get()
+
+            pool.close()
+            pool.join()
+
+            return result
+
+        return [func(x) for x in job_args]
+
+    def _align_timestamp(self, date, tz):
+        # assume naive dates are in the same time zone as the data (typically UTC)
+        date = pandas.Timestamp(date)
+
+        if tz is not None and date.tz is None:
+            return date.tz_localize(tz)
+        elif tz is None and date.tz is not None:
+            return date.tz_convert(None)
+
+        return date
+
     ### functions for CSV reading and writing
     def write_time_series_to_csv(self, csv_path, data_frame):
         data_frame.to_csv(csv_path)
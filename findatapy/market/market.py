@@ -12,7 +12,7 @@ __author__ = 'saeedamen' # Saeed Amen
 # See the License for the specific language governing permissions and limitations under the License.
 #
 
-from findatapy.util import DataConstants
+from findatapy.util import DataConstants, SwimPool
 from findatapy.market.ioengine import SpeedCache
 # from deco import *
 
@@ -129,37 +129,7 @@ class Market(object):
             # which includes FX spot, volatility surface, forward points, deposit rates
             if(md_request.category == 'fx-vol-market'):
                 if md_request.tickers is not None:
-                    df = []
-
-                    fxcf = FXCrossFactory(market_data_generator=self.market_data_generator)
-                    fxvf = FXVolFactory(market_data_generator=self.market_data_generator)
-                    rates = RatesFactory(market_data_generator=self.market_data_generator)
-
-                    # for each FX cross fetch the spot, vol and forward points
-                    for t in md_request.tickers:
-                        if len(t) == 6:
-                            df.append(fxcf.get_fx_cross(start=md_request.start_date, end=md_request.finish_date, cross=t,
-                                                        cut=md_request.cut, data_source=md_request.data_source, freq=md_request.freq,
-                                                        cache_algo=md_request.cache_algo, type='spot', environment=md_request.environment,
-                                                        fields=['close']))
-
-                            df.append(fxvf.get_fx_implied_vol(md_request.start_date, md_request.finish_date, t, fxvf.tenor,
-                                                              cut=md_request.cut, data_source=md_request.data_source,
-                                                              part=fxvf.part,
-                                                              cache_algo=md_request.cache_algo))
-
-                            df.append(rates.get_fx_forward_points(md_request.start_date, md_request.finish_date, t, fxvf.tenor,
-                                                              cut=md_request.cut, data_source=md_request.data_source,
-                                                              cache_algo=md_request.cache_algo))
-
-                    # lastly fetch the base depos
-                    df.append(rates.get_base_depos(md_request.start_date, md_request.finish_date, ["USD", "EUR", "CHF", "GBP"], fxvf.tenor,
-                                                   cut=md_request.cut, data_source=md_request.data_source,
-                                                   cache_algo=md_request.cache_algo
-                                                   ))
-
-                    if df != []:
-                        data_frame = Calculations().pandas_outer_join(df)
+                    data_frame = self._fetch_fx_vol_market(md_request)
 
             if md_request.abstract_curve is not None:
                 data_frame = md_request.abstract_curve.fetch_continuous_time_series\
@@ -181,6 +151,90 @@ class Market(object):
 
         return data_frame
 
+    def _fetch_fx_vol_market(self, md_request):
+        """Fetches all the market data necessary for pricing FX options for every cross, ie. FX spot, volatility surface,
+        forward points and deposit rates. Rather than downloading each of these for each cross, we combine the tickers of
+        all the crosses into one request for each type of data and run these requests concurrently.
+        """
+
+        crosses = [t for t in md_request.tickers if len(t) == 6]
+
+        if crosses == []:
+            return None
+
+        fxcf = FXCrossFactory(market_data_generator=self.market_data_generator)
+        fxvf = FXVolFactory(market_data_generator=self.market_data_generator)
+        rates = RatesFactory(market_data_generator=self.market_data_generator)
+
+        # deposits for the currencies in the crosses, as well as the major currencies
+        currencies = ["USD", "EUR", "CHF", "GBP"]
+
+        for t in crosses:
+            for c in [t[0:3], t[3:6]]:
+                if c not in currencies: currencies.append(c)
+
+        start = md_request.start_date; finish = md_request.finish_date
+
+        tasks = [(fxcf.get_fx_cross, [start, finish, crosses],
+                  {'cut' : md_request.cut, 'data_source' : md_request.data_source, 'freq' : md_request.freq,
+                   'cache_algo' : md_request.cache_algo, 'type' : 'spot', 'environment' : md_request.environment,
+                   'fields' : ['close']}),
+                 (fxvf.get_fx_implied_vol, [start, finish, crosses, fxvf.tenor],
+                  {'cut' : md_request.cut, 'data_source' : md_request.data_source, 'part' : fxvf.part,
+                   'cache_algo' : md_request.cache_algo}),
+                 (rates.get_fx_forward_points, [start, finish, crosses, fxvf.tenor],
+                  {'cut' : md_request.cut, 'data_source' : md_request.data_source, 'cache_algo' : md_request.cache_algo}),
+                 (rates.get_base_depos, [start, finish, currencies, fxvf.tenor],
+                  {'cut' : md_request.cut, 'data_source' : md_request.data_source, 'cache_algo' : md_request.cache_algo})]
+
+        thread_no = DataConstants().market_thread_no['other']
+
+        if md_request.data_source in DataConstants().market_thread_no:
+            thread_no = DataConstants().market_thread_no[md_request.data_source]
+
+        thread_no = min(thread_no, len(tasks))
+
+        # fudge, issue with multithreading and accessing HDF5 files, so only use threads when downloading from the data
+        # vendor (MarketDataGenerator itself doesn't read/write the disk cache)
+        if not(self._is_thread_safe_fetch(md_request)):
+            thread_no = 0
+
+        if thread_no > 0:
+            # most of the time is spent waiting for the data vendor, so use threads
+            pool = SwimPool().create_pool(thread_technique='thread', thread_no=thread_no)
+
+            df = pool.map_async(self._run_task, tasks).get()
+
+            pool.close()
+            pool.join()
+        else:
+            df = [self._run_task(task) for task in tasks]
+
+        df = [x for x in df if x is not None]
+
+        if df == []:
+            return None
+
+        return Calculations().pandas_outer_join(df)
+
+    def _is_thread_safe_fetch(self, md_request):
+        """Checks whether market data requests can be run in threads, ie. they are downloaded from the data vendor, rather
+        than being read from a cache on disk (HDF5 is not safe to access across threads)
+        """
+
+        if 'internet_load' not in md_request.cache_algo:
+            return False
+
+        if self.market_data_generator.__class__.__name__ == 'CachedMarketDataGenerator':
+            return False
+
+        return True
+
+    def _run_task(self, task):
+        func, args, kwargs = task
+
+        return func(*args, **kwargs)
+
 ########################################################################################################################
 
 from findatapy.util.fxconv import FXConv
@@ -265,12 +319,14 @@ class FXCrossFactory(object):
         if isinstance(cross, str):
             cross = [cross]
 
-        market_data_request_list = []
-        freq_list = []
-        type_list = []
+        if type[0:3] == 'tot' and freq == 'intraday':
+            self.logger.info('Total calculated returns for intraday not implemented yet')
+            return None
 
-        for cr in cross:
-            market_data_request = MarketDataRequest(freq_mult=1,
+        # find all the USD legs we need for every cross, so each is only downloaded once (in a single request)
+        legs = self._plan_usd_legs(cross, type)
+
+        market_data_request = MarketDataRequest(freq_mult=1,
                                                 cut=cut,
                                                 fields=['close'],
                                                 freq=freq,
@@ -278,59 +334,23 @@ class FXCrossFactory(object):
                                                 start_date=start,
                                                 finish_date=end,
                                                 data_source=data_source,
-                                                environment=environment)
-
-            market_data_request.type = type
-            market_data_request.cross = cr
-
-            if freq == 'intraday':
-                market_data_request.gran_freq = "minute"                # intraday
+                                                environment=environment,
+                                                tickers=legs)
 
-            elif freq == 'daily':
-                market_data_request.gran_freq = "daily"                 # daily
+        if freq == 'intraday':
+            market_data_request.gran_freq = "minute"                # intraday
 
-            market_data_request_list.append(market_data_request)
+        elif freq == 'daily':
+            market_data_request.gran_freq = "daily"                 # daily
 
-        data_frame_agg = []
-
-        # depends on the nature of operation as to whether we should use threading or multiprocessing library
-        if DataConstants().market_thread_technique is "thread":
-            from multiprocessing.dummy import Pool
+        if type == 'spot':
+            market_data_request.category = 'fx'
         else:
-            # most of the time is spend waiting for Bloomberg to return, so can use threads rather than multiprocessing
-            # must use the multiprocessing_on_dill library otherwise can't pickle objects correctly
-            # note: currently not very stable
-            from multiprocessing_on_dill import Pool
-
-        thread_no = DataConstants().market_thread_no['other']
-
-        if market_data_request_list[0].data_source in DataConstants().market_thread_no:
-            thread_no = DataConstants().market_thread_no[market_data_request_list[0].data_source]
-
-        # fudge, issue with multithreading and accessing HDF5 files
-        # if self.market_data_generator.__class__.__name__ == 'CachedMarketDataGenerator':
-        #    thread_no = 0
-        thread_no = 0
-
-        if (thread_no > 0):
-            pool = Pool(thread_no)
+            market_data_request.category = 'fx-tot'
 
-            # open the market data downloads in their own threads and return the results
-            df_list = pool.map_async(self._get_individual_fx_cross, market_data_request_list).get()
+        legs_df = self.market_data_generator.fetch_market_data(market_data_request)
 
-            data_frame_agg = self.calculations.iterative_outer_join(df_list)
-
-            # data_frame_agg = self.calculations.pandas_outer_join(result.get())
-
-            try:
-                pool.close()
-                pool.join()
-            except: pass
-        else:
-            for md_request in market_data_request_list:
-                data_frame_agg.append(self._get_individual_fx_cross(md_request))
-
-            data_frame_agg = self.calculations.pandas_outer_join(data_frame_agg)
+        data_frame_agg = self._derive_fx_crosses(cross, type, freq, legs, legs_df)
 
         # strip the nan elements
         data_frame_agg = data_frame_agg.dropna(how='all')
@@ -339,126 +359,105 @@ class FXCrossFactory(object):
 
         return data_frame_agg
 
-    def _get_individual_fx_cross(self, market_data_request):
-        cr = market_data_request.cross
-        type = market_data_request.type
-        freq = market_data_request.freq
+    def _plan_usd_legs(self, cross, type):
+        """Finds the minimal set of USD crosses we need to construct every cross (eg. EURJPY and GBPJPY need EURUSD,
+        GBPUSD and USDJPY spot, or EURUSD, GBPUSD and JPYUSD total return indices)
+        """
 
-        base = cr[0:3]
-        terms = cr[3:6]
+        legs = []
 
-        if (type == 'spot'):
-            # non-USD crosses
-            if base != 'USD' and terms != 'USD':
-                base_USD = self.fxconv.correct_notation('USD' + base)
-                terms_USD = self.fxconv.correct_notation('USD' + terms)
+        for cr in cross:
+            if cr[0:3] + cr[3:6] == 'USDUSD':
+                currencies = ['USD']
+            else:
+                currencies = [c for c in [cr[0:3], cr[3:6]] if c != 'USD']
 
-                # TODO check if the cross exists in the database
+            for c in currencies:
+                if type == 'spot':
+                    leg = self.fxconv.correct_notation('USD' + c)
+                else:
+                    leg = c + 'USD'
 
-                # download base USD cross
-                market_data_request.tickers = base_USD
-                market_data_request.category = 'fx'
+                if leg not in legs:
+                    legs.append(leg)
 
-                base_vals = self.market_data_generator.fetch_market_data(market_data_request)
+        return legs
 
-                # download terms USD cross
-                market_data_request.tickers = terms_USD
-                market_data_request.category = 'fx'
+    def _derive_fx_crosses(self, cross, type, freq, legs, legs_df):
+        """Constructs the crosses from the aligned panel of USD legs, by dividing spot (or subtracting the returns of
+        total return indices) of the base and terms legs for all the crosses at once
+        """
 
-                terms_vals = self.market_data_generator.fetch_market_data(market_data_request)
+        legs_df = legs_df[[leg + '.close' for leg in legs]]
 
-                # if quoted USD/base flip to get USD terms
-                if (base_USD[0:3] == 'USD'):
-                    base_vals = 1 / base_vals
+        # spot/returns of each currency against USD, with an extra column for USD itself (USDUSD is only downloaded for
+        # its dates)
+        currencies = [leg[3:6] if leg[0:3] == 'USD' else leg[0:3] for leg in legs]
+        currencies = [None if leg == 'USDUSD' else c for leg, c in zip(legs, currencies)]
+        currencies.append('USD')
 
-                # if quoted USD/terms flip to get USD terms
-                if (terms_USD[0:3] == 'USD'):
-                    terms_vals = 1 / terms_vals
+        values = legs_df.values.astype(numpy.float64)
 
-                base_vals.columns = ['temp'];
-                terms_vals.columns = ['temp']
+        if type == 'spot':
+            usd = numpy.ones((values.shape[0], 1))
 
-                cross_vals = base_vals.div(terms_vals, axis='index')
-                cross_vals.columns = [cr + '.close']
+            # if quoted USD/currency flip to get currency/USD
+            flip = numpy.array([leg[0:3] == 'USD' for leg in legs])
+            values[:, flip] = 1 / values[:, flip]
+        else:
+            usd = numpy.zeros((values.shape[0], 1))
+            missing = numpy.isnan(values)
 
-                base_vals.columns = [base_USD + '.close']
-                terms_vals.columns = [terms_USD + '.close']
-            else:
-                # if base == 'USD': non_USD = terms
-                # if terms == 'USD': non_USD = base
+            # calculate returns over each leg's own points
+            values = numpy.array(legs_df.ffill().values, dtype=numpy.float64)
+            values[1:] = values[1:] / values[:-1] - 1
 
-                correct_cr = self.fxconv.correct_notation(cr)
+            # first returns of a time series will by NaN, given we don't know previous point
+            values[0] = 0
+            values[numpy.isnan(values)] = 0
+            values[missing] = numpy.nan
 
-                market_data_request.tickers = correct_cr
-                market_data_request.category = 'fx'
+        values = numpy.hstack([values, usd])
 
-                cross_vals = self.market_data_generator.fetch_market_data(market_data_request)
+        base = numpy.array([currencies.index(cr[0:3]) for cr in cross])
+        terms = numpy.array([currencies.index(cr[3:6]) for cr in cross])
 
-                # special case for USDUSD!
-                if base + terms == 'USDUSD':
-                    if freq == 'daily':
-                        cross_vals = pandas.DataFrame(1, index= cross_vals.index, columns=cross_vals.columns)
-                        filter = Filter()
-                        cross_vals = filter.filter_time_series_by_holidays(cross_vals, cal = 'WEEKDAY')
-                else:
-                    # flip if not convention
-                    if (correct_cr != cr):
-                        cross_vals = 1 / cross_vals
+        # special case for USDUSD! only on the dates we have for USDUSD (and weekdays for daily spot)
+        usd_usd = numpy.array([cr[0:3] + cr[3:6] == 'USDUSD' for cr in cross])
 
-                # cross_vals = self.market_data_generator.harvest_time_series(market_data_request)
-                cross_vals.columns = [cr + '.close']
+        if usd_usd.any():
+            usd_usd_missing = numpy.isnan(values[:, legs.index('USDUSD')])
 
-        elif type[0:3] == "tot":
-            if freq == 'daily':
-                # download base USD cross
-                market_data_request.tickers = base + 'USD'
-                market_data_request.category = 'fx-tot'
+            if type == 'spot' and freq == 'daily':
+                usd_usd_missing = usd_usd_missing | (legs_df.index.dayofweek > 4)
 
-                if type == "tot":
-                    base_vals = self.market_data_generator.fetch_market_data(market_data_request)
-                else:
-                    x = 0
+        if type == 'spot':
+            cross_vals = values[:, base] / values[:, terms]
 
-                # download terms USD cross
-                market_data_request.tickers = terms + 'USD'
-                market_data_request.category = 'fx-tot'
+            if usd_usd.any(): cross_vals[numpy.ix_(usd_usd_missing, usd_usd)] = numpy.nan
 
-                if type == "tot":
-                    terms_vals = self.market_data_generator.fetch_market_data(market_data_request)
-                else:
-                    pass
-
-                # base_rets = self.calculations.calculate_returns(base_vals)
-                # terms_rets = self.calculations.calculate_returns(terms_vals)
-
-                # special case for USDUSD case (and if base or terms USD are USDUSD
-                if base + terms == 'USDUSD':
-                    base_rets = self.calculations.calculate_returns(base_vals)
-                    cross_rets = pandas.DataFrame(0, index = base_rets.index, columns=base_rets.columns)
-                elif base + 'USD' == 'USDUSD':
-                    cross_rets = -self.calculations.calculate_returns(terms_vals)
-                elif terms + 'USD' == 'USDUSD':
-                    cross_rets = self.calculations.calculate_returns(base_vals)
-                else:
-                    base_rets = self.calculations.calculate_returns(base_vals)
-                    terms_rets = self.calculations.calculate_returns(terms_vals)
+            return pandas.DataFrame(cross_vals, index=legs_df.index, columns=[cr + '.close' for cr in cross])
+
+        cross_rets = values[:, base] - values[:, terms]
+
+        if usd_usd.any(): cross_rets[numpy.ix_(usd_usd_missing, usd_usd)] = numpy.nan
 
-                    cross_rets = base_rets.sub(terms_rets.iloc[:, 0], axis=0)
+        # only keep the index on points where we have the legs, starting at 100 on the first point where we have both
+        missing = numpy.isnan(cross_rets)
 
-                # first returns of a time series will by NaN, given we don't know previous point
-                cross_rets.iloc[0] = 0
+        start = numpy.argmax(~missing, axis=0)
+        started = ~missing[start, numpy.arange(len(cross))]
 
-                cross_vals = self.calculations.create_mult_index(cross_rets)
-                cross_vals.columns = [cr + '-tot.close']
+        cross_rets[start[started], numpy.arange(len(cross))[started]] = 0
 
-            elif freq == 'intraday':
-                self.logger.info('Total calculated returns for intraday not implemented yet')
-                return None
+        cross_vals = 100.0 * numpy.cumprod(1 + numpy.nan_to_num(cross_rets), axis=0)
+        cross_vals[missing] = numpy.nan
 
-        return cross_vals
+        return pandas.DataFrame(cross_vals, index=legs_df.index, columns=[cr + '-tot.close' for cr in cross])
 
 #######################################################################################################################
 
+import numpy
 import pandas
 
 from findatapy.market.marketdatarequest import MarketDataRequest
@@ -551,15 +550,55 @@ class FXVolFactory(object):
         return tickers
 
     def extract_vol_surface_for_date(self, df, cross, date_index):
+        """Extracts the vol surface (strikes x tenors) for a single date
 
-        # assume we have a matrix of the form
-        # eg. EURUSDVON.close ...
+        Parameters
+        ----------
+        df : DataFrame
+            vol surface quotes, with columns of the form eg. EURUSDVON.close
+        cross : str
+            FX cross
+        date_index : int/datetime
+            position or date of the vol surface
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        if isinstance(date_index, (int, numpy.integer)):
+            df = df.iloc[[date_index]]
+        else:
+            df = df.loc[[date_index]]
+
+        cube, strikes, tenor = self.extract_vol_surface_cube(df, cross)
+
+        return pandas.DataFrame(cube[0], index=strikes, columns=tenor)
+
+    def extract_vol_surface_cube(self, df, cross, tenor=None):
+        """Extracts the vol surfaces for every date into a (date x strike x tenor) cube, calculating the 10 delta and 25
+        delta puts and calls from the ATM vol, risk reversals and butterflies. Vol surface for each date is a view
+        cube[i] (for df.index[i])
+
+        Parameters
+        ----------
+        df : DataFrame
+            vol surface quotes, with columns of the form eg. EURUSDVON.close (missing quotes are NaN)
+        cross : str
+            FX cross
+        tenor : str (list)
+            tenors to extract (default: all the tenors on our vol surface)
+
+        Returns
+        -------
+        numpy.ndarray, list(str), list(str)
+            cube of vols, strikes and tenors
+        """
 
         # types of quotation on vol surface
         # self.part = ["V", "25R", "10R", "25B", "10B"]
 
-        # all the tenors on our vol surface
-        # self.tenor = ["ON", "1W", "2W", "3W", "1M", "2M", "3M", "6M", "9M", "1Y", "2Y", "5Y"]
+        if tenor is None: tenor = self.tenor
 
         strikes = ["10DP",
                    "25DP",
@@ -567,30 +606,25 @@ class FXVolFactory(object):
                    "25DC",
                    "10DC"]
 
-        tenor = self.tenor
+        part = ["V", "25R", "10R", "25B", "10B"]
 
-        df_surf = pandas.DataFrame(index=strikes, columns=tenor)
+        # reshape the quotes into (date x part x tenor) in one go
+        columns = [cross + pt + tn + ".close" for pt in part for tn in tenor]
 
-        for ten in tenor:
-            df_surf.ix["10DP", ten] = df.ix[date_index, cross + "V" + ten + ".close"] \
-                                      - (df.ix[date_index, cross + "10R" + ten + ".close"] / 2.0) \
-                                      + (df.ix[date_index, cross + "10B" + ten + ".close"])
+        quotes = df.reindex(columns=columns).values.astype(numpy.float64).reshape(len(df.index), len(part), len(tenor))
 
-            df_surf.ix["10DC", ten] = df.ix[date_index, cross + "V" + ten + ".close"] \
-                                      + (df.ix[date_index, cross + "10R" + ten + ".close"] / 2.0) \
-                                      + (df.ix[date_index, cross + "10B" + ten + ".close"])
+        atm = quotes[:, 0:1, :]
 
-            df_surf.ix["25DP", ten] = df.ix[date_index, cross + "V" + ten + ".close"] \
-                                      - (df.ix[date_index, cross + "25R" + ten + ".close"] / 2.0) \
-                                      + (df.ix[date_index, cross + "25B" + ten + ".close"])
+        # wings are ATM -/+ half the risk reversal, plus the butterfly (for puts, calls)
+        sign = numpy.array([-0.5, 0.5])[numpy.newaxis, :, numpy.newaxis]
 
-            df_surf.ix["25DC", ten] = df.ix[date_index, cross + "V" + ten + ".close"] \
-                                      + (df.ix[date_index, cross + "25R" + ten + ".close"] / 2.0) \
-                                      + (df.ix[date_index, cross + "25B" + ten + ".close"])
+        cube = numpy.empty((len(df.index), len(strikes), len(tenor)))
 
-            df_surf.ix["ATM", ten] = df.ix[date_index, cross + "V" + ten + ".close"]
+        cube[:, [0, 4], :] = atm + sign * quotes[:, 2:3, :] + quotes[:, 4:5, :]
+        cube[:, [1, 3], :] = atm + sign * quotes[:, 1:2, :] + quotes[:, 3:4, :]
+        cube[:, 2, :] = quotes[:, 0, :]
 
-        return df_surf
+        return cube, strikes, list(tenor)
 
 #######################################################################################################################
 
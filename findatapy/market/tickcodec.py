@@ -0,0 +1,250 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+TickCodec
+
+Gorilla style encoding for tick data, which is used by the 'tick' engine in IOEngine (via ColumnarStore).
+
+Timestamps (and other integer columns) are stored as delta-of-deltas, which are zero or small for tick data. Floats are
+XORed with the previous value, which is zero when the price hasn't changed and otherwise usually only has a few bits set
+in the middle of the mantissa.
+
+Values are split into blocks, and each block header records the trailing zero bits shared by all values in the block and
+the bit width of the remaining bits. Each value has a flag bit (0 for a zero delta/XOR), and non-zero values are bit
+packed with the block's width. Unlike Gorilla, which uses a variable length code for each value, everything is encoded
+and decoded with vectorised NumPy operations.
+
+Layout of encoded buffer
+
+    header              - int64 array: rows, block size, first value (as bits), bytes of flags, bytes of payload
+    trail               - uint8 for each block: trailing zero bits dropped
+    width               - uint8 for each block: bit width of values
+    flags               - 1 bit for each value (after the first), 1 if non-zero
+    payload             - bit packed non-zero values (grouped by bit width)
+
+"""
+
+import numpy
+
+from findatapy.util.dataconstants import DataConstants
+
+_header_size = 5
+
+class TickCodec(object):
+    """Encodes and decodes NumPy arrays of timestamps/integers (with delta-of-delta encoding) and floats (with XOR
+    encoding) into compact bit packed buffers
+
+    """
+
+    def __init__(self, block_size = None):
+        if block_size is None: block_size = DataConstants().tick_codec_block_size
+
+        self._block_size = block_size
+
+    def encode(self, arr):
+        """Encodes an array, using delta-of-delta encoding for integers (eg. timestamps as int64) and XOR encoding for
+        floats
+
+        Parameters
+        ----------
+        arr : numpy.ndarray
+            1-D array to be encoded
+
+        Returns
+        -------
+        bytes
+        """
+
+        arr = numpy.ascontiguousarray(arr)
+
+        if len(arr) == 0:
+            return numpy.zeros(_header_size, dtype='int64').tobytes()
+
+        if arr.dtype.kind == 'f':
+            bits = self._float_to_bits(arr)
+
+            first = bits[0]
+            values = bits[1:] ^ bits[:-1]
+
+            return self._encode_values(first, values, False)
+
+        arr = arr.astype('int64')
+
+        # first delta, followed by the delta-of-deltas (with wraparound for overflow, which decoding reverses)
+        deltas = numpy.diff(arr)
+        values = numpy.diff(deltas, prepend=numpy.int64(0))
+
+        return self._encode_values(arr[0].view('uint64'), values.view('uint64'), True)
+
+    def decode(self, buf, dtype):
+        """Decodes a buffer created by encode
+
+        Parameters
+        ----------
+        buf : bytes
+            encoded buffer
+        dtype : str
+            dtype of the original array
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+
+        dtype = numpy.dtype(dtype)
+
+        header = numpy.frombuffer(buf, dtype='int64', count=_header_size)
+
+        rows, block_size, first, flags_bytes, payload_bytes = [int(x) for x in header]
+
+        if rows == 0:
+            return numpy.zeros(0, dtype=dtype)
+
+        n = rows - 1
+        blocks = (n + block_size - 1) // block_size
+
+        pos = _header_size * 8
+        trail = numpy.frombuffer(buf, dtype='uint8', count=blocks, offset=pos).astype('uint64'); pos = pos + blocks
+        width = numpy.frombuffer(buf, dtype='uint8', count=blocks, offset=pos).astype('int64'); pos = pos + blocks
+        flags = numpy.unpackbits(numpy.frombuffer(buf, dtype='uint8', count=flags_bytes, offset=pos), count=n)
+        pos = pos + flags_bytes
+
+        block = numpy.arange(n) // block_size
+
+        values = self._unpack_bits(numpy.frombuffer(buf, dtype='uint8', count=payload_bytes, offset=pos),
+                                   flags * width[block])
+
+        first = numpy.array([first], dtype='int64').view('uint64')
+
+        if dtype.kind == 'f':
+            values = values << trail[block]
+
+            bits = numpy.bitwise_xor.accumulate(numpy.concatenate([first, values]))
+
+            return self._bits_to_float(bits, dtype)
+
+        # undo zigzag encoding and restore the dropped trailing zeros
+        values = (values >> numpy.uint64(1)).view('int64') ^ -(values & numpy.uint64(1)).view('int64')
+        values = values << trail[block].view('int64')
+
+        deltas = numpy.cumsum(values)
+
+        return numpy.concatenate([first.view('int64'), first.view('int64') + numpy.cumsum(deltas)]).astype(dtype)
+
+    ### internal methods
+    def _encode_values(self, first, values, signed):
+        n = len(values)
+        block_size = self._block_size
+
+        header = numpy.array([n + 1, block_size, 0, 0, 0], dtype='int64')
+        header[2] = numpy.array([first], dtype='uint64').view('int64')[0]
+
+        if n == 0:
+            return header.tobytes()
+
+        block = numpy.arange(n) // block_size
+        block_start = numpy.arange(0, n, block_size)
+
+        # trailing zero bits shared by all the values in each block (same for negative integers in two's complement)
+        trail = self._trailing_zeros(numpy.bitwise_or.reduceat(values, block_start))
+
+        if signed:
+            values = values.view('int64') >> trail[block].astype('int64')
+
+            # zigzag encode, so small negative numbers have few bits
+            values = ((values << numpy.int64(1)) ^ (values >> numpy.int64(63))).view('uint64')
+        else:
+            values = values >> trail[block].astype('uint64')
+
+        width = self._bit_length(numpy.bitwise_or.reduceat(values, block_start))
+
+        flags = values != 0
+
+        flags_buf = numpy.packbits(flags).tobytes()
+        payload_buf = self._pack_bits(values, flags * width[block])
+
+        header[3] = len(flags_buf)
+        header[4] = len(payload_buf)
+
+        return b''.join([header.tobytes(), trail.astype('uint8').tobytes(), width.astype('uint8').tobytes(),
+                         flags_buf, payload_buf])
+
+    def _pack_bits(self, values, widths):
+        # write the lowest widths[i] bits of each value, grouping values with the same width, so we can work on the bits
+        # of each group as a 2-D array (there are at most 64 groups)
+        bits = []
+
+        for w in numpy.unique(widths[widths > 0]):
+            matrix = numpy.unpackbits(values[widths == w].astype('>u8').view('uint8').reshape(-1, 8), axis=1)
+
+            bits.append(matrix[:, 64 - w:].ravel())
+
+        if bits == []: return b''
+
+        return numpy.packbits(numpy.concatenate(bits)).tobytes()
+
+    def _unpack_bits(self, buf, widths):
+        values = numpy.zeros(len(widths), dtype='uint64')
+
+        total = int(widths.sum())
+
+        if total == 0: return values
+
+        bits = numpy.unpackbits(buf, count=total)
+
+        pos = 0
+
+        for w in numpy.unique(widths[widths > 0]):
+            group = widths == w
+            rows = int(group.sum())
+
+            matrix = numpy.zeros((rows, 64), dtype='uint8')
+            matrix[:, 64 - w:] = bits[pos:pos + rows * w].reshape(rows, w)
+
+            values[group] = numpy.packbits(matrix, axis=1).view('>u8').ravel()
+
+            pos = pos + rows * w
+
+        return values
+
+    def _bit_length(self, x):
+        x = x.copy()
+        length = numpy.zeros(len(x), dtype='int64')
+
+        for s in [32, 16, 8, 4, 2, 1]:
+            large = x >= (numpy.uint64(1) << numpy.uint64(s))
+
+            length[large] = length[large] + s
+            x[large] = x[large] >> numpy.uint64(s)
+
+        return length + (x > 0)
+
+    def _trailing_zeros(self, x):
+        # isolate the lowest set bit (zero for zero)
+        lowest = x & (~x + numpy.uint64(1))
+
+        return numpy.maximum(self._bit_length(lowest) - 1, 0)
+
+    def _float_to_bits(self, arr):
+        if arr.dtype.itemsize == 4:
+            return arr.view('uint32').astype('uint64')
+
+        return arr.astype('float64').view('uint64')
+
+    def _bits_to_float(self, bits, dtype):
+        if dtype.itemsize == 4:
+            return bits.astype('uint32').view(dtype)
+
+        return bits.view('float64').astype(dtype)
@@ -5,4 +5,6 @@ from findatapy.timeseries.filter import Calendar
 from findatapy.timeseries.filter import Filter
 from findatapy.timeseries.calculations import Calculations
 from findatapy.timeseries.dataquality import DataQuality
-from findatapy.timeseries.retstats import RetStats
\ No newline at end of file
+from findatapy.timeseries.retstats import RetStats
+from findatapy.timeseries.cutsnapshot import CutSnapshot
+from findatapy.timeseries.seasonality import Seasonality
\ No newline at end of file
@@ -13,6 +13,7 @@ __author__ = 'saeedamen' # Saeed Amen
 #the License for the specific language governing permissions and limitations under the License.
 #
 
+import collections
 import datetime
 import functools
 import math
@@ -30,9 +31,18 @@ except:
 
 from findatapy.timeseries.filter import Filter
 from findatapy.timeseries.filter import Calendar
+from findatapy.timeseries.seasonality import Seasonality
+from findatapy.timeseries.calculations_numba import rolling_sum_numba, rolling_count_numba, rolling_mean_numba, \
+    rolling_sparse_average_numba, rolling_std_numba, rolling_moments_numba, rolling_z_score_numba, ewma_numba, \
+    rolling_quantile_numba, rolling_cov_corr_numba, risk_stop_numba, risk_stop_parallel_numba
 
 from pandas import compat
 
+# same attributes as the output of pandas.stats.api.ols (which has been removed), so strip_linear_regression_output can
+# read them
+OLSCoefficients = collections.namedtuple('OLSCoefficients', ['x', 'intercept'])
+OLSResults = collections.namedtuple('OLSResults', ['beta', 't_stat', 'r2', 'r2_adj', 'nobs'])
+
 class Calculations(object):
     """Calculations on time series, such as calculating strategy returns and various wrappers on pandas for rolling sums etc.
 
@@ -122,33 +132,34 @@ class Calculations(object):
         # signal_data_frame_pushed = signal_data_frame.shift(1)
 
         # find all the trade points
-        trade_points = ((signal_data_frame - signal_data_frame.shift(1)).abs())
+        signal = signal_data_frame.values.astype(numpy.float64)
+
+        trade_points = numpy.zeros(signal.shape, dtype=bool)
+        trade_points[1:] = numpy.abs(signal[1:] - signal[:-1]) > 0
+
         cumulative = self.create_mult_index(strategy_returns_data_frame)
+        cumulative_values = cumulative.values
 
-        indices = trade_points > 0
-        indices.columns = cumulative.columns
+        trade_points = trade_points & ~numpy.isnan(cumulative_values)
 
-        # get P&L for every trade (from the end point - start point)
-        trade_returns = numpy.nan * cumulative
-        trade_points_cumulative = cumulative[indices]
+        # get P&L for every trade (from the end point - start point), for all columns at once, by finding the previous
+        # trade point for each trade point (other points are NaN)
+        rows = numpy.arange(len(signal))[:, numpy.newaxis]
 
-        # for each set of signals/returns, calculate the trade returns - where there isn't a trade
-        # assign a NaN
-        # TODO do in one vectorised step without for loop
-        for col_name in trade_points_cumulative:
-            col = trade_points_cumulative[col_name]
-            col = col.dropna()
-            col = col / col.shift(1) - 1
+        last_trade = numpy.maximum.accumulate(numpy.where(trade_points, rows, -1), axis=0)
 
-            # TODO experiment with quicker ways of writing below?
-            # for val in col.index:
-                # trade_returns.set_value(val, col_name, col[val])
-                # trade_returns.ix[val, col_name] = col[val]
+        previous_trade = numpy.full(signal.shape, -1)
+        previous_trade[1:] = last_trade[:-1]
 
-            date_indices = trade_returns.index.searchsorted(col.index)
-            trade_returns.ix[date_indices, col_name] = col
+        trade_points = trade_points & (previous_trade >= 0)
 
-        return trade_returns
+        with numpy.errstate(all='ignore'):
+            trade_returns = cumulative_values / numpy.take_along_axis(cumulative_values,
+                                                                      numpy.maximum(previous_trade, 0), axis=0) - 1
+
+        trade_returns[~trade_points] = numpy.nan
+
+        return pandas.DataFrame(trade_returns, index=cumulative.index, columns=cumulative.columns)
 
     def calculate_cum_rets_trades(self, signal_data_frame, strategy_returns_data_frame):
         """Calculates cumulative returns resetting at each new trade
@@ -159,34 +170,17 @@ class Calculations(object):
             trading signals
         strategy_returns_data_frame: DataFrame
             returns of strategy to be tested
-        period_shift : int
-            number of periods to shift signal
 
         Returns
         -------
         DataFrame
         """
 
-        # signal need to be aligned to NEXT period for returns
-        signal_data_frame_pushed = signal_data_frame.shift(1)
-
-        # find all the trade points
-        reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
-
-        reset_points = reset_points.cumsum()
+        # assume same ordering for columns of signals and returns
+        valid, start = self._calculate_trade_segments(signal_data_frame)
 
-        # make sure they have the same column names (otherwise issues around pandas calc - assume same ordering for cols)
-        old_cols = strategy_returns_data_frame.columnsii
-        strategy_returns_data_frame.columns = signal_data_frame_pushed.columns
-
-        for c in reset_points.columns:
-            strategy_returns_data_frame[c + 'cumsum'] = reset_points[c]
-            strategy_returns_data_frame[c] = strategy_returns_data_frame.groupby([c + 'cumsum'])[c].cumsum()
-            strategy_returns_data_frame = strategy_returns_data_frame.drop([c + 'cumsum'], axis=1)
-
-        strategy_returns_data_frame.columns = old_cols
-
-        return strategy_returns_data_frame
+        return pandas.DataFrame(self._segmented_cumsum(strategy_returns_data_frame.values, valid, start),
+                                index=strategy_returns_data_frame.index, columns=strategy_returns_data_frame.columns)
 
     def calculate_trade_no(self, signal_data_frame):
 
@@ -199,46 +193,22 @@ class Calculations(object):
         return signal_data_frame
 
     def calculate_trade_duration(self, signal_data_frame):
-        """Calculates cumulative trade durations
+        """Calculates cumulative trade durations (number of periods since the start of each trade)
 
         Parameters
         ----------
         signal_data_frame : DataFrame
             trading signals
-        strategy_returns_data_frame: DataFrame
-            returns of strategy to be tested
-        period_shift : int
-            number of periods to shift signal
 
         Returns
         -------
         DataFrame
         """
 
-        # TODO
-        # # signal need to be aligned to NEXT period for returns
-        # signal_data_frame_pushed = signal_data_frame.shift(1)
-        #
-        # # find all the trade points
-        # reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
-        #
-        # reset_points = reset_points.cumsum()
-        #
-        # time_data_frame = pandas.DataFrame(index = signal_data_frame.index, columns = signal_data_frame.columns,
-        #                                    data=numpy.ones([len(signal_data_frame.index), len(signal_data_frame.columns)]))
-        #
-        # # make sure they have the same column names (otherwise issues around pandas calc - assume same ordering for cols)
-        # old_cols = time_data_frame.columns
-        # time_data_frame.columns = signal_data_frame_pushed.columns
-        #
-        # for c in reset_points.columns:
-        #     time_data_frame[c + 'cumperiods'] = reset_points[c]
-        #     time_data_frame[c] = time_data_frame.groupby([c + 'cumperiods'])[c].cumsum()
-        #     time_data_frame = time_data_frame.drop([c + 'cumperiods'], axis=1)
-        #
-        # time_data_frame.columns = old_cols
-        #
-        # return time_data_frame
+        valid, start = self._calculate_trade_segments(signal_data_frame)
+
+        return pandas.DataFrame(self._segmented_cumsum(numpy.ones(valid.shape), valid, start),
+                                index=signal_data_frame.index, columns=signal_data_frame.columns)
 
     def calculate_final_trade_duration(self, signal_data_frame):
         """Calculates cumulative trade durations
@@ -247,40 +217,56 @@ class Calculations(object):
         ----------
         signal_data_frame : DataFrame
             trading signals
-        strategy_returns_data_frame: DataFrame
-            returns of strategy to be tested
-        period_shift : int
-            number of periods to shift signal
 
         Returns
         -------
         DataFrame
         """
 
-        # signal need to be aligned to NEXT period for returns
-        signal_data_frame_pushed = signal_data_frame.shift(1)
+        return self.calculate_trade_duration(signal_data_frame)
 
-        # find all the trade points
-        reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
+    def _calculate_trade_segments(self, signal_data_frame):
+        """Finds the trades in every column of a signal at once. Signal is aligned to the NEXT period for returns and a
+        new trade starts whenever the signal changes.
+
+        Returns
+        -------
+        numpy.ndarray (bool), numpy.ndarray (bool)
+            Points which are in a trade (ie. not NaN) and points where each trade starts
+        """
+
+        signal = signal_data_frame.values.astype(numpy.float64)
+
+        # signal_data_frame.shift(1) - signal_data_frame.shift(2)
+        trade_points = numpy.full(signal.shape, numpy.nan)
+        trade_points[2:] = numpy.abs(signal[1:-1] - signal[:-2])
+
+        valid = ~numpy.isnan(trade_points)
+
+        # first point of each column where we have a signal, also starts a trade
+        start = valid & ((trade_points > 0) | (numpy.cumsum(valid, axis=0) == 1))
+
+        return valid, start
 
-        reset_points = reset_points.cumsum()
+    def _segmented_cumsum(self, values, valid, start):
+        """Cumulative sum of values (ignoring NaNs), which resets at every start point (in every column at once)
+        """
+
+        values = values.astype(numpy.float64)
 
-        time_data_frame = pandas.DataFrame(index=signal_data_frame.index, columns=signal_data_frame.columns,
-                                           data=numpy.ones(
-                                               [len(signal_data_frame.index), len(signal_data_frame.columns)]))
+        is_value = valid & ~numpy.isnan(values)
 
-        # make sure they have the same column names (otherwise issues around pandas calc - assume same ordering for cols)
-        old_cols = time_data_frame.columns
-        time_data_frame.columns = signal_data_frame_pushed.columns
+        values = numpy.where(is_value, values, 0.0)
+        cum_values = numpy.cumsum(values, axis=0)
 
-        for c in reset_points.columns:
-            time_data_frame[c + 'cumperiods'] = reset_points[c]
-            time_data_frame[c] = time_data_frame.groupby([c + 'cumperiods'])[c].cumsum()
-            time_data_frame = time_data_frame.drop([c + 'cumperiods'], axis=1)
+        # for each point, find where the current segment started and subtract the cumulative sum before it
+        rows = numpy.arange(len(values))[:, numpy.newaxis]
+        segment_start = numpy.maximum.accumulate(numpy.where(start, rows, 0), axis=0)
 
-        time_data_frame.columns = old_cols
+        cum_values = cum_values - numpy.take_along_axis(cum_values - values, segment_start, axis=0)
+        cum_values[~is_value] = numpy.nan
 
-        return time_data_frame
+        return cum_values
 
     def calculate_risk_stop_signals(self, signal_data_frame, cum_rets_trades, stop_loss, take_profit):
         """
@@ -304,23 +290,8 @@ class Calculations(object):
         DataFrame containing amended signals that take into account stops and take profits
 
         """
-        
-        signal_data_frame_pushed = signal_data_frame # signal_data_frame.shift(1)
-        reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
-
-        ind = (cum_rets_trades > take_profit) | (cum_rets_trades < stop_loss)
 
-        # to allow indexing, need to match column names
-        ind.columns = signal_data_frame.columns
-        signal_data_frame[ind] = 0
-
-        reset_points[ind] = 1
-
-        signal_data_frame[reset_points == 0] = numpy.nan
-        signal_data_frame = signal_data_frame.ffill()
-        # signal_data_frame = signal_data_frame.shift(-1)
-
-        return signal_data_frame
+        return self._calculate_risk_stop(signal_data_frame, cum_rets_trades, stop_loss, take_profit, mode=2)
 
     def calculate_risk_stop_dynamic_signals(self, signal_data_frame, asset_data_frame, stop_loss_df, take_profit_df):
         """
@@ -331,10 +302,10 @@ class Calculations(object):
             Contains all the trade signals (typically mix of 0, +1 and +1
 
         stop_loss_df : DataFrame
-            Continuous stop losses in the asset (in price amounts eg +2, +2.5, +2.6 USD - as opposed to percentages)
+            Continuous stop losses in the asset (in price amounts eg -2, -2.1, -2.5 USD - as opposed to percentages)
 
         take_profit_df : DataFrame
-            Continuous take profits in the asset (in price amounts eg -2, -2.1, -2.5 USD - as opposed to percentages)
+            Continuous take profits in the asset (in price amounts eg +2, +2.5, +2.6 USD - as opposed to percentages)
 
         Returns
         -------
@@ -342,68 +313,52 @@ class Calculations(object):
 
         """
 
-        signal_data_frame_pushed = signal_data_frame  # signal_data_frame.shift(1)
-        reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
-
-        # ensure all the inputs are pandas DataFrames (rather than mixture of Series and DataFrames)
-        asset_data_frame = pandas.DataFrame(asset_data_frame)
-        signal_data_frame = pandas.DataFrame(signal_data_frame)
-        stop_loss_df = pandas.DataFrame(stop_loss_df)
-        take_profit_df = pandas.DataFrame(take_profit_df)
-
-        non_trades = reset_points == 0
-
-        # need to temporarily change column names to allow indexing (ASSUMES: columns in same order!)
-        non_trades.columns = take_profit_df.columns
+        # stop losses/take profits are those at the start of each trade
+        return self._calculate_risk_stop(signal_data_frame, asset_data_frame, stop_loss_df, take_profit_df, mode=0)
 
-        # where we don't have a trade fill with NaNs
-        take_profit_df[non_trades] = numpy.nan
+    def calculate_risk_stop_path_signals(self, signal_data_frame, asset_data_frame, stop_loss, take_profit,
+                                         percentage = True, trailing = False, parallel = False):
+        """Amends signals for stop losses and take profits, walking through the prices of each trade (in compiled code),
+        so after being stopped out/taking profit, we only reenter when the signal changes
 
-        non_trades.columns = stop_loss_df.columns
-        stop_loss_df[non_trades] = numpy.nan
-
-        asset_df_copy = asset_data_frame.copy(deep=True)
-
-        non_trades.columns = asset_df_copy.columns
-        asset_df_copy[non_trades] = numpy.nan
-
-        take_profit_df = take_profit_df.ffill()
-        stop_loss_df = stop_loss_df.ffill()
-        asset_df_copy = asset_df_copy.ffill()
-
-        # take profit for buys
-        ind1 = (asset_data_frame.values > (asset_df_copy.values + take_profit_df.values)) & (signal_data_frame.values > 0)
-
-        # take profit for sells
-        ind2 = (asset_data_frame.values < (asset_df_copy.values - take_profit_df.values)) & (signal_data_frame.values < 0)
+        Parameters
+        ----------
+        signal_data_frame : DataFrame
+            Contains all the trade signals (typically mix of 0, +1 and +1
 
-        # stop loss for buys
-        ind3 = (asset_data_frame.values < (asset_df_copy.values + stop_loss_df.values)) & (signal_data_frame.values > 0)
+        asset_data_frame : DataFrame
+            Asset prices (same order of columns as signals)
 
-        # stop loss for sells
-        ind4 = (asset_data_frame.values > (asset_df_copy.values - stop_loss_df.values)) & (signal_data_frame.values < 0)
+        stop_loss : float (or DataFrame)
+            Stop loss level eg. -0.02 (taken at the start of each trade)
 
-        # when has there been a stop loss or take profit? assign those as being flat points
-        ind = ind1 | ind2 | ind3 | ind4
+        take_profit : float (or DataFrame)
+            Take profit level eg. +0.03 (taken at the start of each trade)
 
-        ind = pandas.DataFrame(data= ind, columns = signal_data_frame.columns, index = signal_data_frame.index)
+        percentage : bool
+            True - stop loss/take profit are percentage returns
+            False - stop loss/take profit are price amounts
 
-        # for debugging
-        # sum_ind = (ind == True).sum(); print(sum_ind)
+        trailing : bool
+            True - stop loss is from the best price during the trade
+            False - stop loss is from the entry price
 
-        signal_data_frame[ind] = 0
+        parallel : bool
+            Calculate columns in parallel
 
-        # those places where we have been stopped out/taken profit are additional trade "reset points", which we need to define
-        # (already have ordinary buy/sell trades defined)
-        reset_points[ind] = 1
+        Returns
+        -------
+        DataFrame containing amended signals that take into account stops and take profits
+        """
 
-        # where we don't have trade make these NaN and then fill down
-        signal_data_frame[reset_points == 0] = numpy.nan
-        signal_data_frame = signal_data_frame.ffill()
+        if percentage:
+            mode = 1
+        else:
+            mode = 0
 
-        return signal_data_frame
+        return self._calculate_risk_stop(signal_data_frame, asset_data_frame, stop_loss, take_profit, mode=mode,
+                                         trailing=trailing, parallel=parallel)
 
-    # TODO
     def calculate_risk_stop_defined_signals(self, signal_data_frame, stops_data_frame):
         """
 
@@ -421,21 +376,38 @@ class Calculations(object):
 
         """
 
-        signal_data_frame_pushed = signal_data_frame # signal_data_frame.shift(1)
-        reset_points = ((signal_data_frame_pushed - signal_data_frame_pushed.shift(1)).abs())
+        exit_points = numpy.abs(pandas.DataFrame(stops_data_frame).values) >= 1
 
-        stops_data_frame = stops_data_frame.abs()
-        ind = stops_data_frame >= 1
+        return self._calculate_risk_stop(signal_data_frame, numpy.zeros(exit_points.shape), numpy.nan, numpy.nan,
+                                         mode=2, exit_points=exit_points)
 
-        ind.columns = signal_data_frame.columns
-        signal_data_frame[ind] = 0
+    def _calculate_risk_stop(self, signal_data_frame, level, stop_loss, take_profit, mode, trailing = False,
+                             exit_points = None, parallel = False):
+        """Calls the stop loss/take profit kernel, converting all the inputs to arrays of the same shape (assumes columns
+        are in the same order)
+        """
 
-        reset_points[ind] = 1
+        signal_data_frame = pandas.DataFrame(signal_data_frame)
 
-        signal_data_frame[reset_points == 0] = numpy.nan
-        signal_data_frame = signal_data_frame.ffill()
+        signal = numpy.asfortranarray(signal_data_frame.values, dtype=numpy.float64)
 
-        return signal_data_frame
+        def to_array(x):
+            if isinstance(x, (pandas.DataFrame, pandas.Series)): x = pandas.DataFrame(x).values
+
+            return numpy.asfortranarray(numpy.broadcast_to(numpy.asarray(x, dtype=numpy.float64), signal.shape))
+
+        if exit_points is None:
+            exit_points = numpy.zeros(signal.shape, dtype=bool)
+
+        if parallel:
+            func = risk_stop_parallel_numba
+        else:
+            func = risk_stop_numba
+
+        output = func(signal, to_array(level), to_array(stop_loss), to_array(take_profit),
+                      numpy.asfortranarray(exit_points), mode, trailing)
+
+        return pandas.DataFrame(output, index=signal_data_frame.index, columns=signal_data_frame.columns)
 
     def calculate_signal_returns_matrix(self, signal_data_frame, returns_data_frame, period_shift = 1):
         """Calculates the trading strategy returns for given signal and asset
@@ -502,6 +474,97 @@ class Calculations(object):
         return pandas.DataFrame(
             signal_data_frame.shift(period_shift).values * returns_data_frame.values - tc_costs, index = returns_data_frame.index)
 
+    def calculate_signal_returns_with_tc_batch(self, signal_tensor, returns_data_frame, tc, period_shift = 1,
+                                               ann_factor = 252, variant_names = None, chunk_size = None,
+                                               return_returns = False):
+        """Calculates the trading strategy returns (including transaction costs) and their summary statistics for many
+        variants of a signal at once (eg. with different lookbacks), processing the variants in chunks to bound memory
+
+        Parameters
+        ----------
+        signal_tensor : numpy.ndarray (or list(DataFrame))
+            trading signals as (variant x time x asset), with assets in the same order as returns
+        returns_data_frame: DataFrame
+            returns of assets to be traded
+        tc : float
+            transaction costs
+        period_shift : int
+            number of periods to shift signal
+        ann_factor : int
+            annualisation factor for return statistics
+        variant_names : list(str) (optional)
+            names of each variant (default: 0, 1, 2...)
+        chunk_size : int (optional)
+            number of variants in each chunk (default: around 10 million elements in each chunk)
+        return_returns : bool
+            also return strategy returns as a (variant x time x asset) array
+
+        Returns
+        -------
+        dict
+            DataFrames of 'ann_returns', 'ann_vol', 'inforatio' and 'max_drawdown' (variant x asset), and if
+            return_returns is set, 'returns'
+        """
+
+        if isinstance(signal_tensor, list):
+            signal_tensor = numpy.stack([pandas.DataFrame(x).values for x in signal_tensor])
+
+        returns = returns_data_frame.values.astype(numpy.float64)
+
+        variants, rows, cols = signal_tensor.shape
+
+        if chunk_size is None: chunk_size = max(1, int(10000000 / max(rows * cols, 1)))
+        if variant_names is None: variant_names = list(range(0, variants))
+
+        stats = {}
+
+        for k in ['ann_returns', 'ann_vol', 'inforatio', 'max_drawdown']:
+            stats[k] = numpy.empty((variants, cols))
+
+        if return_returns:
+            all_returns = numpy.empty((variants, rows, cols))
+
+        for start in range(0, variants, chunk_size):
+            finish = min(start + chunk_size, variants)
+
+            signal = signal_tensor[start:finish].astype(numpy.float64)
+
+            # same as signal_data_frame.shift(period_shift)
+            signal_shifted = numpy.full(signal.shape, numpy.nan)
+
+            if period_shift > 0:
+                signal_shifted[:, period_shift:] = signal[:, :rows - period_shift]
+            elif period_shift < 0:
+                signal_shifted[:, :rows + period_shift] = signal[:, -period_shift:]
+            else:
+                signal_shifted[:] = signal
+
+            strategy_returns = signal_shifted * returns[numpy.newaxis] - numpy.abs(signal_shifted - signal) * tc
+
+            if return_returns:
+                all_returns[start:finish] = strategy_returns
+
+            with numpy.errstate(all='ignore'):
+                stats['ann_returns'][start:finish] = numpy.nanmean(strategy_returns, axis=1) * ann_factor
+                stats['ann_vol'][start:finish] = numpy.nanstd(strategy_returns, axis=1, ddof=1) * math.sqrt(ann_factor)
+
+                # NaNs leave the index unchanged, like cumprod in pandas
+                index = numpy.nancumprod(1.0 + strategy_returns, axis=1)
+
+                stats['max_drawdown'][start:finish] = numpy.min(index / numpy.maximum.accumulate(index, axis=1) - 1,
+                                                                axis=1)
+
+        with numpy.errstate(all='ignore'):
+            stats['inforatio'] = stats['ann_returns'] / stats['ann_vol']
+
+        for k in stats.keys():
+            stats[k] = pandas.DataFrame(stats[k], index=variant_names, columns=returns_data_frame.columns)
+
+        if return_returns:
+            stats['returns'] = all_returns
+
+        return stats
+
     def calculate_returns(self, data_frame, period_shift = 1):
         """Calculates the simple returns for an asset
 
@@ -616,7 +679,7 @@ class Calculations(object):
         -------
         DataFrame
         """
-        return (data_frame - data_frame.rolling(center=False, window = periods).mean()) / data_frame.rolling(center=False, window = periods).std()
+        return self._apply_numba(rolling_z_score_numba, data_frame, periods)
 
     def rolling_volatility(self, data_frame, periods, obs_in_year = 252):
         """
@@ -635,7 +698,45 @@ class Calculations(object):
         """
 
         # return pandas.rolling_std(data_frame, periods) * math.sqrt(obs_in_year)
-        return data_frame.rolling(window=periods,center=False).std() * math.sqrt(obs_in_year)
+        return self._apply_numba(rolling_std_numba, data_frame, periods, periods, 1) * math.sqrt(obs_in_year)
+
+    def rolling_moments(self, data_frame, periods, obs_in_year = 252):
+        """Calculates the rolling mean, standard deviation, z score and annualised volatility together, in a single pass
+        over the time series (all the outputs share one buffer)
+
+        Parameters
+        ----------
+        data_frame : DataFrame (or Series)
+            contains time series
+        periods : int
+            rolling window
+        obs_in_year : int
+            number of observation in the year (for annualising volatility)
+
+        Returns
+        -------
+        dict
+            DataFrames (or Series) with keys 'mean', 'std', 'z_score' and 'vol'
+        """
+
+        is_series = isinstance(data_frame, pandas.Series)
+
+        if is_series:
+            data_frame = data_frame.to_frame()
+
+        values = numpy.asfortranarray(data_frame.values, dtype=numpy.float64)
+
+        output = rolling_moments_numba(values, periods, periods, 1, math.sqrt(obs_in_year))
+
+        moments = {}
+
+        for i, key in enumerate(['mean', 'std', 'z_score', 'vol']):
+            moments[key] = pandas.DataFrame(output[i], index=data_frame.index, columns=data_frame.columns, copy=False)
+
+            if is_series:
+                moments[key] = moments[key][data_frame.columns[0]]
+
+        return moments
 
     def rolling_mean(self, data_frame, periods):
         return self.rolling_average(data_frame, periods)
@@ -654,7 +755,7 @@ class Calculations(object):
         -------
         DataFrame
         """
-        return pandas.rolling_mean(data_frame, periods)
+        return self._apply_numba(rolling_mean_numba, data_frame, periods, periods)
 
     def rolling_sparse_average(self, data_frame, periods):
         """Calculates the rolling moving average of a sparse time series
@@ -674,17 +775,7 @@ class Calculations(object):
         # 1. calculate rolling sum (ignore NaNs)
         # 2. count number of non-NaNs
         # 3. average of non-NaNs
-        foo = lambda z: z[pandas.notnull(z)].sum()
-
-        # rolling_sum = pandas.rolling_apply(data_frame, periods, foo, min_periods=1)
-        # rolling_non_nans = pandas.stats.moments.rolling_count(data_frame, periods, freq=None, center=False, how=None) \
-        rolling_sum = data_frame.rolling(center=False, window=periods, min_periods=1).apply(func=foo)
-        rolling_non_nans = data_frame.rolling(window=periods,center=False).count()
-
-        # For pandas 0.18 onwards (TODO)
-        # rolling_non_nans = data_frame.rolling(span=periods, freq=None, center=False, how=None).count()
-
-        return rolling_sum / rolling_non_nans
+        return self._apply_numba(rolling_sparse_average_numba, data_frame, periods)
 
     def rolling_sparse_sum(self, data_frame, periods):
         """Calculates the rolling moving sum of a sparse time series
@@ -701,17 +792,11 @@ class Calculations(object):
         DataFrame
         """
 
-        # 1. calculate rolling sum (ignore NaNs)
-        # 2. count number of non-NaNs
-        # 3. average of non-NaNs
-        foo = lambda z: z[pandas.notnull(z)].sum()
-
-        rolling_sum = pandas.rolling_apply(data_frame, periods, foo, min_periods=1)
-
-        return rolling_sum
+        # calculate rolling sum (ignore NaNs)
+        return self._apply_numba(rolling_sum_numba, data_frame, periods, 1)
 
     def rolling_median(self, data_frame, periods):
-        """Calculates the rolling moving average
+        """Calculates the rolling median
 
         Parameters
         ----------
@@ -724,7 +809,31 @@ class Calculations(object):
         -------
         DataFrame
         """
-        return pandas.rolling_median(data_frame, periods)
+        return self.rolling_quantile(data_frame, periods, 0.5)
+
+    def rolling_quantile(self, data_frame, periods, quantile, min_periods = None):
+        """Calculates the rolling quantile (ignoring NaNs and interpolating linearly between observations), using an
+        indexable skiplist, so each update is O(log periods)
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            contains time series
+        periods : int
+            number of periods in the quantile
+        quantile : float
+            quantile between 0 and 1 (eg. 0.5 for median)
+        min_periods : int (optional)
+            minimum number of non-NaN observations needed (default: periods)
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        if min_periods is None: min_periods = periods
+
+        return self._apply_numba(rolling_quantile_numba, data_frame, periods, min_periods, float(quantile))
 
     def rolling_sum(self, data_frame, periods):
         """Calculates the rolling sum
@@ -740,7 +849,23 @@ class Calculations(object):
         -------
         DataFrame
         """
-        return pandas.rolling_sum(data_frame, periods)
+        return self._apply_numba(rolling_sum_numba, data_frame, periods, periods)
+
+    def rolling_count(self, data_frame, periods):
+        """Calculates the rolling number of non-NaN observations
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            contains time series
+        periods : int
+            period for rolling count
+
+        Returns
+        -------
+        DataFrame
+        """
+        return self._apply_numba(rolling_count_numba, data_frame, periods)
 
     def cum_sum(self, data_frame):
         """Calculates the cumulative sum
@@ -773,11 +898,31 @@ class Calculations(object):
 
         # span = 2 / (1 + periods)
 
-        return pandas.ewma(data_frame, span=periods)
+        return self._apply_numba(ewma_numba, data_frame, periods, 0)
+
+    def _apply_numba(self, func, data_frame, *args):
+        """Calls a numba kernel on the values of a DataFrame (or Series) and returns the output with the same index and
+        columns
+        """
+
+        is_series = isinstance(data_frame, pandas.Series)
+
+        if is_series:
+            data_frame = data_frame.to_frame()
+
+        # kernels loop over each column in turn
+        values = numpy.asfortranarray(data_frame.values, dtype=numpy.float64)
+
+        data_frame = pandas.DataFrame(func(values, *args), index=data_frame.index, columns=data_frame.columns)
+
+        if is_series:
+            return data_frame[data_frame.columns[0]]
+
+        return data_frame
 
     ##### correlation methods
     def rolling_corr(self, data_frame1, periods, data_frame2 = None, pairwise = False, flatten_labels = True):
-        """Calculates rolling correlation wrapping around pandas functions
+        """Calculates rolling correlation (using rolling_corr_matrix)
 
         Parameters
         ----------
@@ -789,54 +934,92 @@ class Calculations(object):
             contains times series to run correlation against
         pairwise : boolean
             should we do pairwise correlations only?
+        flatten_labels : boolean
+            True - columns labelled as "a v b"
+            False - columns are a MultiIndex
 
         Returns
         -------
         DataFrame
         """
 
-        # this is the new bit of code here
-        if pandas.__version__ < '0.17':
-            if pairwise:
-                panel = pandas.rolling_corr_pairwise(data_frame1.join(data_frame2), periods)
-            else:
-                panel = pandas.rolling_corr(data_frame1, data_frame2, periods)
-        else:
-            # panel = pandas.rolling_corr(data_frame1, data_frame2, periods, pairwise = pairwise)
-            panel = data_frame1.rolling(window=periods).corr(other=data_frame2, pairwise=True)
+        if isinstance(data_frame1, pandas.Series): data_frame1 = data_frame1.to_frame()
+        if isinstance(data_frame2, pandas.Series): data_frame2 = data_frame2.to_frame()
 
-        try:
-            df = panel.to_frame(filter_observations=False).transpose()
+        if pairwise:
+            # correlations between every pair of columns
+            if data_frame2 is not None:
+                data_frame1 = data_frame1.join(data_frame2)
 
-        except:
-            df = panel
+            data_frame2 = None
 
-        if flatten_labels:
-            if pairwise:
-                series1 = df.columns.get_level_values(0)
-                series2 = df.columns.get_level_values(1)
-                new_labels = []
+        corr, labels = self.rolling_corr_matrix(data_frame1, periods, data_frame2=data_frame2,
+                                                flatten_labels=flatten_labels)
 
-                for i in range(len(series1)):
-                    new_labels.append(series1[i] + " v " + series2[i])
+        return pandas.DataFrame(corr.reshape(corr.shape[0], -1), index=data_frame1.index, columns=labels)
 
-            else:
-                new_labels = []
+    def rolling_corr_matrix(self, data_frame1, periods, data_frame2 = None, min_periods = None, cov = False,
+                            upper_triangle = False, flatten_labels = True):
+        """Calculates rolling correlation (or covariance) matrices, keeping running sums for every pair of columns, which
+        are updated incrementally as the window moves (NaNs are ignored pairwise)
+
+        Parameters
+        ----------
+        data_frame1 : DataFrame
+            contains time series to run correlations on
+        periods : int
+            period of rolling correlations
+        data_frame2 : DataFrame (optional)
+            contains time series to run correlations against (default: data_frame1)
+        min_periods : int (optional)
+            minimum number of observations needed (default: periods)
+        cov : bool
+            True - calculate covariance rather than correlation
+        upper_triangle : bool
+            True - only return the pairs above the diagonal (only when data_frame2 is not specified)
+        flatten_labels : bool
+            True - labels are "a v b"
+            False - labels are a MultiIndex
 
-                try:
-                    series1 = data_frame1.columns
-                except:
-                    series1 = [data_frame1.name]
+        Returns
+        -------
+        numpy.ndarray, list/MultiIndex
+            Array of (time x columns1 x columns2) or, for upper_triangle, (time x pairs) and the labels of each pair
+            (in the same order as the array flattened)
+        """
 
-                series2 = data_frame2.columns
+        if min_periods is None: min_periods = periods
 
-                for i in range(len(series1)):
-                    for j in range(len(series2)):
-                        new_labels.append(series1[i] + " v " + series2[j])
+        symmetric = data_frame2 is None
 
-            df.columns = new_labels
+        if symmetric: data_frame2 = data_frame1
 
-        return df
+        x = data_frame1.values.astype(numpy.float64)
+        y = data_frame2.values.astype(numpy.float64)
+
+        # subtract the mean of each column first, so the running sums don't lose precision (eg. for prices)
+        with numpy.errstate(all='ignore'):
+            x = numpy.ascontiguousarray(x - numpy.nan_to_num(numpy.nanmean(x, axis=0)))
+            y = numpy.ascontiguousarray(y - numpy.nan_to_num(numpy.nanmean(y, axis=0)))
+
+        output = rolling_cov_corr_numba(x, y, periods, min_periods, symmetric, not(cov))
+
+        columns1 = numpy.array([str(c) for c in data_frame1.columns], dtype=object)
+        columns2 = numpy.array([str(c) for c in data_frame2.columns], dtype=object)
+
+        if upper_triangle and symmetric:
+            row, col = numpy.triu_indices(len(columns1), k=1)
+
+            output = output[:, row, col]
+        else:
+            row, col = numpy.divmod(numpy.arange(len(columns1) * len(columns2)), len(columns2))
+
+        if flatten_labels:
+            labels = list(columns1[row] + " v " + columns2[col])
+        else:
+            labels = pandas.MultiIndex.from_arrays([data_frame1.columns[row], data_frame2.columns[col]])
+
+        return output, labels
 
     def rolling_autocorr(self, data_frame, period, lag):
         """Calculates rolling auto-correlation wrapping around pandas functions by column
@@ -886,14 +1069,112 @@ class Calculations(object):
         # say our right series is a signal
         # say our left series is an asset to be traded
 
-        # first do an outer join then fill down our right signal
-        df_left_1, df_right = df_left.align(df_right, join='outer', axis=0)
-        df_right = df_right.fillna(method='ffill')
+        # take the last value of our right signal at or before each point of the left (without building the union of
+        # the indices)
+        return self.join_left_fill_right_asof(df_left, df_right)
+
+    def join_left_fill_right_asof(self, df_left, df_right, tolerance = None, column_tolerance = None):
+        """As-of join, which for each time in the left DataFrame, takes the last non-NaN value of each column of the right
+        DataFrame at or before that time (eg. to align daily signals with tick data), using a binary search on the
+        indices
+
+        Parameters
+        ----------
+        df_left : DataFrame
+            time series (eg. asset prices), the index doesn't need to be sorted
+        df_right : DataFrame
+            time series to align to the left (eg. signals)
+        tolerance : str/Timedelta (optional)
+            maximum age of any value from the right, older values are NaN (default: no limit)
+        column_tolerance : dict (optional)
+            maximum age for particular columns of the right, eg. {'EURUSD.signal' : '1D'}
+
+        Returns
+        -------
+        DataFrame, DataFrame
+            left and the right aligned to the left's index
+        """
+
+        if not(df_right.index.is_monotonic_increasing):
+            df_right = df_right.sort_index(kind='stable')
+
+        left_times = pandas.DatetimeIndex(df_left.index).values.astype('datetime64[ns]').astype(numpy.int64)
+        right_times = pandas.DatetimeIndex(df_right.index).values.astype('datetime64[ns]').astype(numpy.int64)
+
+        if len(right_times) == 0:
+            return df_left, pandas.DataFrame(numpy.nan, index=df_left.index, columns=df_right.columns)
 
-        # now realign back to days when we trade
-        # df_left.to_csv('left.csv'); df_right.to_csv('right.csv')
+        # last non-NaN row of each column of the right (so NaNs in one column don't hide older values), which is cheap
+        # as the right is typically much shorter than the left
+        last_valid = numpy.where(df_right.notnull().values, numpy.arange(len(right_times))[:, numpy.newaxis], -1)
+        last_valid = numpy.maximum.accumulate(last_valid, axis=0)
 
-        df_left, df_right = df_left.align(df_right, join='left', axis=0)
+        # last row at or before each time of the left
+        pos = numpy.searchsorted(right_times, left_times, side='right') - 1
+
+        # values which are older than the maximum age of each column
+        stale = None
+
+        if tolerance is not None or column_tolerance is not None:
+            max_age = numpy.full(len(df_right.columns), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+
+            if tolerance is not None:
+                max_age[:] = pandas.Timedelta(tolerance).value
+
+            if column_tolerance is not None:
+                for c in column_tolerance.keys():
+                    max_age[df_right.columns.get_loc(c)] = pandas.Timedelta(column_tolerance[c]).value
+
+            value_times = numpy.ascontiguousarray(right_times[numpy.maximum(last_valid, 0)].T)
+
+            age = left_times[numpy.newaxis, :] - value_times.take(numpy.maximum(pos, 0), axis=1)
+            stale = age > max_age[:, numpy.newaxis]
+
+        dtypes = list(df_right.dtypes)
+        output = {}
+
+        # gather floats a block at a time, column by column (the layout of the DataFrame's blocks), so pandas doesn't
+        # need to copy the output
+        for dtype in set([d for d in dtypes if d.kind == 'f']):
+            block = [j for j in range(0, len(dtypes)) if dtypes[j] == dtype]
+
+            filled = df_right.iloc[:, block].to_numpy(dtype=dtype)
+            filled = filled[numpy.maximum(last_valid[:, block], 0), numpy.arange(len(block))[numpy.newaxis, :]]
+            filled[last_valid[:, block] < 0] = numpy.nan
+
+            # add a row of NaNs for times before the start of the right
+            filled = numpy.vstack([filled, numpy.full((1, len(block)), numpy.nan, dtype=dtype)])
+
+            block_output = numpy.ascontiguousarray(filled.T).take(pos, axis=1)
+
+            if stale is not None: block_output[stale[block]] = numpy.nan
+
+            if len(block) == len(dtypes):
+                return df_left, pandas.DataFrame(block_output.T, index=df_left.index, columns=df_right.columns,
+                                                 copy=False)
+
+            for k in range(0, len(block)):
+                output[block[k]] = block_output[k]
+
+        # other columns (eg. int, bool or str) are gathered one at a time, with missing values as if we'd reindexed
+        # onto the union of the indices (eg. int becomes float if the left has times which aren't in the right)
+        in_union = len(output) < len(dtypes) and \
+                   ((pos < 0) | (right_times[numpy.maximum(pos, 0)] != left_times)).any()
+
+        for j in range(0, len(dtypes)):
+            if j in output: continue
+
+            rows = numpy.append(last_valid[:, j], -1).take(pos)
+
+            if stale is not None: rows[stale[j]] = -1
+
+            if in_union:
+                output[j] = df_right.iloc[:, j].reset_index(drop=True).reindex(numpy.append(rows, -1)).array[:-1]
+            else:
+                output[j] = df_right.iloc[:, j].reset_index(drop=True).reindex(rows).array
+
+        df_right = pandas.DataFrame({j : output[j] for j in range(0, len(dtypes))}, index=df_left.index) \
+            .set_axis(df_right.columns, axis=1)
 
         return df_left, df_right
 
@@ -982,7 +1263,8 @@ class Calculations(object):
         x_vars : str (list)
             Which x variables should we regress
         use_stats_models : bool (default: True)
-            Should we use statsmodels library directly or pandas.stats.api.ols wrapper (warning: deprecated)
+            Should we use statsmodels library for each pair, or closed form OLS for all pairs at once (which can be read
+            by strip_linear_regression_output), which is much quicker for many pairs
 
         Returns
         -------
@@ -990,6 +1272,23 @@ class Calculations(object):
 
         """
 
+        if not(use_stats_models):
+            df = self.linear_regression_batch(df_y, df_x, y_vars, x_vars)
+
+            stats = []
+
+            for i in range(0, len(df.index)):
+                row = df.iloc[i]
+
+                if numpy.isnan(row['beta']):
+                    stats.append(None)
+                else:
+                    stats.append(OLSResults(beta=OLSCoefficients(row['beta'], row['beta_intercept']),
+                                            t_stat=OLSCoefficients(row['t_stat'], row['t_stat_intercept']),
+                                            r2=row['r2'], r2_adj=row['r2_adj'], nobs=int(row['nobs'])))
+
+            return stats
+
         stats = []
 
         for i in range(0, len(y_vars)):
@@ -997,23 +1296,17 @@ class Calculations(object):
             x = df_x[x_vars[i]]
 
             try:
-                if pandas.__version__ < '0.17' or not(use_stats_models):
-                    out = pandas.stats.api.ols(y = y, x = x)
-                else:
-                    # pandas.stats.api is now being depreciated, recommended replacement package
-                    # http://www.statsmodels.org/stable/regression.html
+                # http://www.statsmodels.org/stable/regression.html
+                # we follow the example from there - Fit and summarize OLS model
+                import statsmodels.api as sm
+                import statsmodels
 
-                    # we follow the example from there - Fit and summarize OLS model
+                # to remove NaN values (otherwise regression is undefined)
+                (y, x, a, b, c, d) = self._filter_data(y, x)
 
-                    import statsmodels.api as sm
-                    import statsmodels
-
-                    # to remove NaN values (otherwise regression is undefined)
-                    (y, x, a, b, c, d) = self._filter_data(y, x)
-
-                    # assumes we have a constant (remove add_constant wrapper to have no intercept reported)
-                    mod = sm.OLS(y.get_values(), statsmodels.tools.add_constant(x.get_values()))
-                    out = mod.fit()
+                # assumes we have a constant (remove add_constant wrapper to have no intercept reported)
+                mod = sm.OLS(y.values, statsmodels.tools.add_constant(x.values))
+                out = mod.fit()
             except:
                 out = None
 
@@ -1021,9 +1314,165 @@ class Calculations(object):
 
         return stats
 
+    def linear_regression_batch(self, df_y, df_x, y_vars = None, x_vars = None):
+        """Does a linear regression (with intercept) of many y and x variable pairs at once in closed form, ignoring
+        points where either variable is NaN
+
+        Parameters
+        ----------
+        df_y : DataFrame
+            y variables to regress
+        df_x : DataFrame
+            x variables to regress
+        y_vars : str (list) (optional)
+            Which y variables should we regress (default: all columns of df_y)
+        x_vars : str (list) (optional)
+            Which x variables should we regress (default: all columns of df_x, or if there is only one, that column for
+            every y variable)
+
+        Returns
+        -------
+        DataFrame
+            'beta', 'beta_intercept', 't_stat', 't_stat_intercept', 'r2', 'r2_adj' and 'nobs' for each pair (labelled
+            "y v x")
+        """
+
+        y, x, y_vars, x_vars = self._get_regression_pairs(df_y, df_x, y_vars, x_vars)
+
+        shift_y, shift_x, x, y = self._demean_regression_pairs(x, y)
+
+        n = numpy.sum(~numpy.isnan(x), axis=0)
+
+        sums = [numpy.nansum(z, axis=0) for z in [x, y, x * x, y * y, x * y]]
+
+        stats = self._ols_from_sums(n, *sums, shift_x=shift_x, shift_y=shift_y)
+
+        return pandas.DataFrame(stats, index=[str(a) + ' v ' + str(b) for a, b in zip(y_vars, x_vars)])
+
+    def rolling_linear_regression(self, df_y, df_x, periods = None, min_periods = None):
+        """Does rolling (or expanding) linear regressions (with intercept) of each column of df_y against the same column
+        of df_x (or against a single column of df_x), using running sums, ignoring points where either variable is NaN
+
+        Parameters
+        ----------
+        df_y : DataFrame
+            y variables to regress
+        df_x : DataFrame
+            x variables to regress (same columns as df_y or a single column)
+        periods : int (optional)
+            rolling window (default: None, for expanding regressions)
+        min_periods : int (optional)
+            minimum number of observations (default: periods, or 3 for expanding regressions)
+
+        Returns
+        -------
+        dict
+            DataFrames of 'beta', 'beta_intercept', 't_stat', 't_stat_intercept', 'r2', 'r2_adj' and 'nobs', with the
+            same index as df_y and columns of df_y
+        """
+
+        df_y = pandas.DataFrame(df_y); df_x = pandas.DataFrame(df_x)
+
+        y, x, y_vars, x_vars = self._get_regression_pairs(df_y, df_x, None, None)
+
+        if periods is None: periods = len(df_y.index)
+
+        if min_periods is None:
+            if periods == len(df_y.index):
+                min_periods = 3
+            else:
+                min_periods = periods
+
+        shift_y, shift_x, x, y = self._demean_regression_pairs(x, y)
+
+        pairs = x.shape[1]
+
+        # rolling sums of x, y, x^2, y^2 and xy in one call
+        sums = rolling_sum_numba(numpy.asfortranarray(numpy.hstack([x, y, x * x, y * y, x * y])), periods, min_periods)
+        n = rolling_count_numba(numpy.asfortranarray(x), periods)
+
+        with numpy.errstate(all='ignore'):
+            n = numpy.where(n >= min_periods, n, numpy.nan)
+
+        stats = self._ols_from_sums(n, *[sums[:, i * pairs:(i + 1) * pairs] for i in range(0, 5)], shift_x=shift_x,
+                                    shift_y=shift_y)
+
+        for k in stats.keys():
+            stats[k] = pandas.DataFrame(stats[k], index=df_y.index, columns=y_vars)
+
+        return stats
+
+    def _get_regression_pairs(self, df_y, df_x, y_vars, x_vars):
+        if y_vars is None: y_vars = list(df_y.columns)
+        if x_vars is None: x_vars = list(df_x.columns)
+
+        if not(isinstance(y_vars, list)): y_vars = [y_vars]
+        if not(isinstance(x_vars, list)): x_vars = [x_vars]
+
+        if len(x_vars) == 1: x_vars = x_vars * len(y_vars)
+
+        # align on dates, then only use points where both x and y are defined
+        df_y, df_x = df_y[y_vars].align(df_x[list(set(x_vars))], join='inner', axis=0)
+
+        y = df_y.values.astype(numpy.float64)
+        x = df_x[x_vars].values.astype(numpy.float64)
+
+        nan = numpy.isnan(x) | numpy.isnan(y)
+
+        y[nan] = numpy.nan
+        x[nan] = numpy.nan
+
+        return y, x, y_vars, x_vars
+
+    def _demean_regression_pairs(self, x, y):
+        # regressions are invariant to shifting x and y (apart from the intercept), so subtract the mean of each column
+        # first to avoid losing precision in the sums
+        with numpy.errstate(all='ignore'):
+            shift_x = numpy.nan_to_num(numpy.nanmean(x, axis=0))
+            shift_y = numpy.nan_to_num(numpy.nanmean(y, axis=0))
+
+        return shift_y, shift_x, x - shift_x, y - shift_y
+
+    def _ols_from_sums(self, n, sum_x, sum_y, sum_xx, sum_yy, sum_xy, shift_x = 0, shift_y = 0):
+        """Calculates OLS statistics (with intercept) from the sums of x, y, x^2, y^2 and xy (which can be arrays)
+        """
+
+        with numpy.errstate(all='ignore'):
+            n = n.astype(numpy.float64)
+            n = numpy.where(n > 0, n, numpy.nan)
+
+            mean_x = sum_x / n
+            mean_y = sum_y / n
+
+            s_xx = sum_xx - sum_x * mean_x
+            s_yy = sum_yy - sum_y * mean_y
+            s_xy = sum_xy - sum_x * mean_y
+
+            s_xx = numpy.where(s_xx > 0, s_xx, numpy.nan)
+
+            beta = s_xy / s_xx
+
+            # undo the shift for the intercept
+            mean_x = mean_x + shift_x
+            mean_y = mean_y + shift_y
+
+            beta_intercept = mean_y - beta * mean_x
+
+            ssr = numpy.maximum(s_yy - beta * s_xy, 0)
+            sigma2 = ssr / numpy.where(n > 2, n - 2, numpy.nan)
+
+            r2 = 1 - ssr / s_yy
+            r2_adj = 1 - (1 - r2) * (n - 1) / (n - 2)
+
+            t_stat = beta / numpy.sqrt(sigma2 / s_xx)
+            t_stat_intercept = beta_intercept / numpy.sqrt(sigma2 * (1.0 / n + mean_x * mean_x / s_xx))
+
+        return {'beta' : beta, 'beta_intercept' : beta_intercept, 't_stat' : t_stat,
+                't_stat_intercept' : t_stat_intercept, 'r2' : r2, 'r2_adj' : r2_adj, 'nobs' : numpy.nan_to_num(n)}
+
     def strip_linear_regression_output(self, indices, ols_list, var):
 
-        # TODO deal with output from statsmodel as opposed to pandas.stats.ols
+        # reads output from linear_regression_single_vars (with use_stats_models = False)
         if not(isinstance(var, list)):
             var = [var]
 
@@ -1061,41 +1510,29 @@ class Calculations(object):
             groupby(columns).mean()
 
     def average_by_hour_min_of_day(self, data_frame):
-        return data_frame.\
-            groupby([data_frame.index.hour, data_frame.index.minute]).mean()
+        return self._average_by_seasonality(data_frame, ['hour', 'minute'])
 
     def average_by_hour_min_of_day_pretty_output(self, data_frame):
-        data_frame = data_frame.\
-            groupby([data_frame.index.hour, data_frame.index.minute]).mean()
+        data_frame = self._average_by_seasonality(data_frame, ['hour', 'minute'])
 
         data_frame.index = data_frame.index.map(lambda t: datetime.time(*t))
 
         return data_frame
 
     def all_by_hour_min_of_day_pretty_output(self, data_frame):
+        # one column for each day, with the time of day as the index
+        date_index = pandas.DatetimeIndex(data_frame.index)
 
-        df_new = []
+        series = pandas.Series(data_frame.iloc[:, 0].values,
+                               index=pandas.MultiIndex.from_arrays([date_index.time, date_index.date]))
 
-        for group in data_frame.groupby(data_frame.index.date):
-            df_temp = group[1]
-            df_temp.index = df_temp.index.time
-            df_temp.columns = [group[0]]
-            df_new.append(df_temp)
+        data_frame = series.unstack(1)
+        data_frame.columns = list(data_frame.columns)
 
-        return pandas.concat(df_new, axis=1)
+        return data_frame
 
     def average_by_year_hour_min_of_day_pretty_output(self, data_frame):
-        # years = range(data_frame.index[0].year, data_frame.index[-1].year)
-        #
-        # time_of_day = []
-        #
-        # for year in years:
-        #     temp = data_frame.ix[data_frame.index.year == year]
-        #     time_of_day.append(temp.groupby(temp.index.time).mean())
-        #
-        # data_frame = pandas.concat(time_of_day, axis=1, keys = years)
-        data_frame = data_frame.\
-            groupby([data_frame.index.year, data_frame.index.hour, data_frame.index.minute]).mean()
+        data_frame = self._average_by_seasonality(data_frame, ['year', 'hour', 'minute'])
 
         data_frame = data_frame.unstack(0)
 
@@ -1104,48 +1541,25 @@ class Calculations(object):
         return data_frame
 
     def average_by_annualised_year(self, data_frame, obs_in_year = 252):
-        data_frame = data_frame.\
-            groupby([data_frame.index.year]).mean() * obs_in_year
-
-        return data_frame
+        return self._average_by_seasonality(data_frame, ['year']) * obs_in_year
 
     def average_by_month(self, data_frame):
-        data_frame = data_frame.\
-            groupby([data_frame.index.month]).mean()
-
-        return data_frame
+        return self._average_by_seasonality(data_frame, ['month'])
 
     def average_by_bus_day(self, data_frame, cal = "FX"):
-        date_index = data_frame.index
-
-        return data_frame.\
-            groupby([Calendar().get_bus_day_of_month(date_index, cal)]).mean()
+        return self._average_by_seasonality(data_frame, ['bus_day'], cal=cal)
 
     def average_by_cal_day(self, data_frame):
-
-        return data_frame.\
-            groupby(data_frame.index.day).mean()
+        return self._average_by_seasonality(data_frame, ['day'])
 
     def average_by_month_day_hour_min_by_bus_day(self, data_frame, cal = "FX"):
-        date_index = data_frame.index
-
-        return data_frame.\
-            groupby([date_index.month,
-                     Calendar().get_bus_day_of_month(date_index, cal),
-                     date_index.hour, date_index.minute]).mean()
+        return self._average_by_seasonality(data_frame, ['month', 'bus_day', 'hour', 'minute'], cal=cal)
 
     def average_by_month_day_by_bus_day(self, data_frame, cal = "FX"):
-        date_index = data_frame.index
-
-        return data_frame.\
-            groupby([date_index.month,
-                     Calendar().get_bus_day_of_month(date_index, cal)]).mean()
+        return self._average_by_seasonality(data_frame, ['month', 'bus_day'], cal=cal)
 
     def average_by_month_day_by_day(self, data_frame):
-        date_index = data_frame.index
-
-        return data_frame.\
-            groupby([date_index.month, date_index.day]).mean()
+        return self._average_by_seasonality(data_frame, ['month', 'day'])
 
     def group_by_year(self, data_frame):
         date_index = data_frame.index
@@ -1154,11 +1568,24 @@ class Calculations(object):
             groupby([date_index.year])
 
     def average_by_day_hour_min_by_bus_day(self, data_frame):
-        date_index = data_frame.index
+        return self._average_by_seasonality(data_frame, ['bus_day', 'hour', 'minute'])
 
-        return data_frame.\
-            groupby([Calendar().get_bus_day_of_month(date_index),
-                     date_index.hour, date_index.minute]).mean()
+    def _average_by_seasonality(self, data_frame, components, cal = "FX"):
+        """Averages a time series by components of the timestamps with Seasonality (with the same index names as a
+        groupby on the components of the index)
+        """
+        index_name = data_frame.index.name
+
+        data_frame = Seasonality(components, cal=cal).average(data_frame)
+
+        names = [None if c == 'bus_day' else index_name for c in components]
+
+        if len(components) == 1:
+            data_frame.index.name = names[0]
+        else:
+            data_frame.index.names = names
+
+        return data_frame
 
     def remove_NaN_rows(self, data_frame):
         return data_frame.dropna()
@@ -1233,11 +1660,15 @@ class Calculations(object):
         filt_lhs = combined.pop('__y__')
         filt_rhs = combined
 
-        if hasattr(filt_weights, 'to_dense'):
-            filt_weights = filt_weights.to_dense()
+        # to_dense has been removed from newer versions of pandas
+        def to_dense(x):
+            if hasattr(x, 'to_dense'):
+                return x.to_dense()
+
+            return x
 
-        return (filt_lhs.to_dense(), filt_rhs.to_dense(), filt_weights,
-                pre_filt_rhs.to_dense(), index, valid)
+        return (to_dense(filt_lhs), to_dense(filt_rhs), to_dense(filt_weights),
+                to_dense(pre_filt_rhs), index, valid)
 
     def _safe_update(self, d, other):
         """
@@ -1289,4 +1720,4 @@ if __name__ == '__main__':
     print(calc.get_bus_day_of_month(date_range))
 
     foo = pandas.DataFrame(numpy.arange(0.0,13.0))
-    print(calc.rolling_ewma(foo, span=3))
+    print(calc.rolling_ewma(foo, 3))
@@ -0,0 +1,656 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+"""
+Compiled (numba) kernels for rolling statistics, which are called by Calculations. Each kernel works on a 2-D float64
+array (time x columns), skips NaNs (like pandas) and updates running totals as the window moves, so they are O(n) rather
+than O(n x window).
+
+"""
+
+import math
+
+import numpy
+
+from numba import jit, prange
+
+@jit(cache=True, nogil=True)
+def rolling_sum_numba(data, window, min_periods):
+    rows, cols = data.shape
+    output = numpy.empty((rows, cols))
+
+    for j in range(cols):
+        total = 0.0; comp = 0.0; nobs = 0
+
+        for i in range(rows):
+            val = data[i, j]
+
+            # add new observation (with Kahan summation, to avoid drift when removing observations)
+            if val == val:
+                nobs += 1
+                y = val - comp; t = total + y; comp = (t - total) - y; total = t
+
+            # remove observation leaving the window
+            if i >= window:
+                prev = data[i - window, j]
+
+                if prev == prev:
+                    nobs -= 1
+                    y = -prev - comp; t = total + y; comp = (t - total) - y; total = t
+
+            if nobs >= min_periods and nobs > 0:
+                output[i, j] = total
+            else:
+                output[i, j] = numpy.nan
+
+    return output
+
+@jit(cache=True, nogil=True)
+def rolling_count_numba(data, window):
+    rows, cols = data.shape
+    output = numpy.empty((rows, cols))
+
+    for j in range(cols):
+        nobs = 0
+
+        for i in range(rows):
+            if data[i, j] == data[i, j]: nobs += 1
+
+            if i >= window and data[i - window, j] == data[i - window, j]: nobs -= 1
+
+            output[i, j] = nobs
+
+    return output
+
+@jit(cache=True, nogil=True)
+def rolling_mean_numba(data, window, min_periods):
+    output = rolling_sum_numba(data, window, min_periods)
+    count = rolling_count_numba(data, window)
+
+    return output / count
+
+@jit(cache=True, nogil=True)
+def rolling_sparse_average_numba(data, window):
+    # sum of the non-NaN observations, divided by the number of them (only once we have a full window)
+    output = rolling_sum_numba(data, window, 1)
+    count = rolling_count_numba(data, window)
+
+    for i in range(min(window - 1, data.shape[0])):
+        output[i, :] = numpy.nan
+
+    return output / count
+
+@jit(cache=True, nogil=True)
+def rolling_std_numba(data, window, min_periods, ddof):
+    rows, cols = data.shape
+    output = numpy.empty((rows, cols))
+
+    for j in range(cols):
+        mean = 0.0; ssqdm = 0.0; nobs = 0
+
+        for i in range(rows):
+            val = data[i, j]
+
+            # update the mean and sum of squared differences from the mean (Welford's method)
+            if val == val:
+                nobs += 1
+                delta = val - mean
+                mean += delta / nobs
+                ssqdm += ((nobs - 1) * delta * delta) / nobs
+
+            if i >= window:
+                prev = data[i - window, j]
+
+                if prev == prev:
+                    nobs -= 1
+
+                    if nobs > 0:
+                        delta = prev - mean
+                        mean -= delta / nobs
+                        ssqdm -= ((nobs + 1) * delta * delta) / nobs
+                    else:
+                        mean = 0.0; ssqdm = 0.0
+
+            if nobs >= min_periods and nobs > ddof:
+                if nobs == 1 or ssqdm < 0:
+                    output[i, j] = 0.0
+                else:
+                    output[i, j] = math.sqrt(ssqdm / (nobs - ddof))
+            else:
+                output[i, j] = numpy.nan
+
+    return output
+
+@jit(cache=True, nogil=True)
+def rolling_moments_numba(data, window, min_periods, ddof, ann_factor):
+    # fills one buffer with the rolling mean, std, z-score and annualised vol, in a single pass over the data
+    rows, cols = data.shape
+    output = numpy.empty((4, rows, cols))
+
+    for j in range(cols):
+        mean = 0.0; ssqdm = 0.0; nobs = 0
+
+        for i in range(rows):
+            val = data[i, j]
+
+            # update the mean and sum of squared differences from the mean (Welford's method)
+            if val == val:
+                nobs += 1
+                delta = val - mean
+                mean += delta / nobs
+                ssqdm += ((nobs - 1) * delta * delta) / nobs
+
+            if i >= window:
+                prev = data[i - window, j]
+
+                if prev == prev:
+                    nobs -= 1
+
+                    if nobs > 0:
+                        delta = prev - mean
+                        mean -= delta / nobs
+                        ssqdm -= ((nobs + 1) * delta * delta) / nobs
+                    else:
+                        mean = 0.0; ssqdm = 0.0
+
+            if nobs >= min_periods and nobs > 0:
+                output[0, i, j] = mean
+            else:
+                output[0, i, j] = numpy.nan
+
+            std = numpy.nan
+
+            if nobs >= min_periods and nobs > ddof:
+                std = 0.0
+
+                if nobs > 1 and ssqdm > 0:
+                    std = math.sqrt(ssqdm / (nobs - ddof))
+
+            output[1, i, j] = std
+            output[3, i, j] = std * ann_factor
+
+            if std > 0:
+                output[2, i, j] = (val - mean) / std
+            else:
+                output[2, i, j] = numpy.nan
+
+    return output
+
+@jit(cache=True, nogil=True)
+def rolling_z_score_numba(data, window):
+    return rolling_moments_numba(data, window, window, 1, 1.0)[2]
+
+@jit(cache=True, nogil=True)
+def ewma_numba(data, span, min_periods):
+    # same as pandas ewm(span=span, adjust=True, ignore_na=False).mean()
+    rows, cols = data.shape
+    output = numpy.empty((rows, cols))
+
+    alpha = 2.0 / (span + 1.0)
+    old_wt_factor = 1.0 - alpha
+    min_periods = max(min_periods, 1)
+
+    for j in range(cols):
+        weighted_avg = numpy.nan; old_wt = 1.0; nobs = 0
+
+        for i in range(rows):
+            cur = data[i, j]
+            is_observation = cur == cur
+
+            if is_observation: nobs += 1
+
+            if weighted_avg == weighted_avg:
+                old_wt *= old_wt_factor
+
+                if is_observation:
+                    if weighted_avg != cur:
+                        weighted_avg = ((old_wt * weighted_avg) + cur) / (old_wt + 1.0)
+
+                    old_wt += 1.0
+            elif is_observation:
+                weighted_avg = cur
+
+            if nobs >= min_periods:
+                output[i, j] = weighted_avg
+            else:
+                output[i, j] = numpy.nan
+
+    return output
+
+##### indexable skiplist (stored in arrays), for rolling quantiles in O(log window) per update
+# node 0 is the head, and -1 marks the end of each level, widths are the number of nodes skipped by each link
+
+@jit(cache=True, nogil=True)
+def _skiplist_create(size):
+    levels = max(1, int(1 + math.log(max(size, 1)) / math.log(2)))
+
+    value = numpy.zeros(size + 1)
+    nxt = numpy.full((size + 1, levels), -1, dtype=numpy.int64)
+    width = numpy.ones((size + 1, levels), dtype=numpy.int64)
+    node_levels = numpy.zeros(size + 1, dtype=numpy.int64)
+
+    # stack of free nodes
+    free = numpy.arange(size, 0, -1)
+
+    return value, nxt, width, node_levels, free
+
+@jit(cache=True, nogil=True)
+def _skiplist_get(nxt, width, value, rank):
+    # rank is 0 based
+    node = 0; rank = rank + 1
+
+    for level in range(nxt.shape[1] - 1, -1, -1):
+        while nxt[node, level] != -1 and width[node, level] <= rank:
+            rank -= width[node, level]
+            node = nxt[node, level]
+
+    return value[node]
+
+@jit(cache=True, nogil=True)
+def _skiplist_insert(value, nxt, width, node_levels, free, free_no, chain, steps_at_level, val):
+    levels = nxt.shape[1]
+    node = 0
+
+    # find the last node on each level whose next node is above val
+    for level in range(levels - 1, -1, -1):
+        steps_at_level[level] = 0
+
+        while nxt[node, level] != -1 and value[nxt[node, level]] <= val:
+            steps_at_level[level] += width[node, level]
+            node = nxt[node, level]
+
+        chain[level] = node
+
+    # random number of levels for the new node (each level half as likely)
+    d = 1
+
+    while d < levels and numpy.random.random() < 0.5:
+        d += 1
+
+    free_no -= 1
+    new_node = free[free_no]
+
+    value[new_node] = val
+    node_levels[new_node] = d
+
+    steps = 0
+
+    for level in range(d):
+        prev = chain[level]
+
+        nxt[new_node, level] = nxt[prev, level]
+        nxt[prev, level] = new_node
+
+        width[new_node, level] = width[prev, level] - steps
+        width[prev, level] = steps + 1
+
+        steps += steps_at_level[level]
+
+    for level in range(d, levels):
+        chain_node = chain[level]
+        width[chain_node, level] += 1
+
+    return free_no
+
+@jit(cache=True, nogil=True)
+def _skiplist_remove(value, nxt, width, node_levels, free, free_no, chain, val):
+    levels = nxt.shape[1]
+    node = 0
+
+    for level in range(levels - 1, -1, -1):
+        while nxt[node, level] != -1 and value[nxt[node, level]] < val:
+            node = nxt[node, level]
+
+        chain[level] = node
+
+    old_node = nxt[chain[0], 0]
+    d = node_levels[old_node]
+
+    for level in range(d):
+        prev = chain[level]
+
+        width[prev, level] += width[old_node, level] - 1
+        nxt[prev, level] = nxt[old_node, level]
+
+    for level in range(d, levels):
+        chain_node = chain[level]
+        width[chain_node, level] -= 1
+
+    free[free_no] = old_node
+
+    return free_no + 1
+
+@jit(cache=True, nogil=True)
+def rolling_quantile_numba(data, window, min_periods, quantile):
+    # same as pandas rolling(window, min_periods).quantile(quantile) with linear interpolation
+    rows, cols = data.shape
+    output = numpy.empty((rows, cols))
+
+    for j in range(cols):
+        value, nxt, width, node_levels, free = _skiplist_create(window)
+
+        levels = nxt.shape[1]
+        chain = numpy.zeros(levels, dtype=numpy.int64)
+        steps_at_level = numpy.zeros(levels, dtype=numpy.int64)
+
+        free_no = window; nobs = 0
+
+        for i in range(rows):
+            # remove the observation leaving the window first, so the skiplist never holds more than window values
+            if i >= window:
+                prev = data[i - window, j]
+
+                if prev == prev:
+                    free_no = _skiplist_remove(value, nxt, width, node_levels, free, free_no, chain, prev)
+                    nobs -= 1
+
+            val = data[i, j]
+
+            if val == val:
+                free_no = _skiplist_insert(value, nxt, width, node_levels, free, free_no, chain, steps_at_level,
+                                           val)
+                nobs += 1
+
+            if nobs >= min_periods and nobs > 0:
+                idx = quantile * (nobs - 1)
+                lower = int(math.floor(idx))
+
+                lower_val = _skiplist_get(nxt, width, value, lower)
+
+                if lower + 1 < nobs and idx > lower:
+                    upper_val = _skiplist_get(nxt, width, value, lower + 1)
+
+                    output[i, j] = lower_val + (upper_val - lower_val) * (idx - lower)
+                else:
+                    output[i, j] = lower_val
+            else:
+                output[i, j] = numpy.nan
+
+    return output
+
+@jit(cache=True, nogil=True)
+def rolling_cov_corr_numba(x, y, window, min_periods, symmetric, corr):
+    # rolling covariance (or correlation) of every column of x against every column of y, using the observations where
+    # both are non-NaN, keeping running sums for each pair which are updated as the window moves (x and y should be
+    # demeaned beforehand, to avoid losing precision), if symmetric (y is x), only the upper triangle is calculated
+    rows, n = x.shape
+    m = y.shape[1]
+
+    output = numpy.empty((rows, n, m))
+
+    sum_x = numpy.zeros((n, m)); sum_y = numpy.zeros((n, m)); sum_xy = numpy.zeros((n, m))
+    sum_xx = numpy.zeros((n, m)); sum_yy = numpy.zeros((n, m)); nobs = numpy.zeros((n, m), dtype=numpy.int64)
+
+    for t in range(rows):
+        for i in range(n):
+            j_start = 0
+
+            if symmetric: j_start = i
+
+            for j in range(j_start, m):
+                a = x[t, i]; b = y[t, j]
+
+                if a == a and b == b:
+                    nobs[i, j] += 1
+                    sum_x[i, j] += a; sum_y[i, j] += b; sum_xy[i, j] += a * b
+                    sum_xx[i, j] += a * a; sum_yy[i, j] += b * b
+
+                if t >= window:
+                    a = x[t - window, i]; b = y[t - window, j]
+
+                    if a == a and b == b:
+                        nobs[i, j] -= 1
+                        sum_x[i, j] -= a; sum_y[i, j] -= b; sum_xy[i, j] -= a * b
+                        sum_xx[i, j] -= a * a; sum_yy[i, j] -= b * b
+
+                k = nobs[i, j]
+                result = numpy.nan
+
+                if k >= min_periods and k > 1:
+                    cov = (sum_xy[i, j] - sum_x[i, j] * sum_y[i, j] / k) / (k - 1)
+
+                    if corr:
+                        var_x = (sum_xx[i, j] - sum_x[i, j] * sum_x[i, j] / k) / (k - 1)
+                        var_y = (sum_yy[i, j] - sum_y[i, j] * sum_y[i, j] / k) / (k - 1)
+
+                        if var_x > 0 and var_y > 0:
+                            result = max(-1.0, min(1.0, cov / math.sqrt(var_x * var_y)))
+                    else:
+                        result = cov
+
+                output[t, i, j] = result
+
+                if symmetric: output[t, j, i] = result
+
+    return output
+
+##### return statistics
+
+@jit(cache=True, nogil=True)
+def ret_stats_numba(data):
+    # in a single pass over the returns, calculates the number of observations, mean, std (ddof = 1), excess kurtosis
+    # (bias corrected, like pandas) and maximum drawdown of each column, and the cumulative (multiplicative) index
+    rows, cols = data.shape
+    output = numpy.empty((5, cols))
+    index = numpy.empty((rows, cols))
+
+    for j in range(cols):
+        mean = 0.0; m2 = 0.0; m3 = 0.0; m4 = 0.0; nobs = 0
+        level = 1.0; peak = 1.0; max_dd = 0.0
+
+        for i in range(rows):
+            val = data[i, j]
+
+            if val != val:
+                index[i, j] = numpy.nan
+
+                continue
+
+            # update the central moments (online, so we don't need another pass)
+            nobs += 1
+            delta = val - mean
+            delta_n = delta / nobs
+            delta_n2 = delta_n * delta_n
+            term = delta * delta_n * (nobs - 1)
+
+            mean += delta_n
+            m4 += term * delta_n2 * (nobs * nobs - 3 * nobs + 3) + 6 * delta_n2 * m2 - 4 * delta_n * m3
+            m3 += term * delta_n * (nobs - 2) - 3 * delta_n * m2
+            m2 += term
+
+            # update the index and drawdown from the peak so far
+            level = level * (1.0 + val)
+            index[i, j] = level
+
+            if nobs == 1 or level > peak: peak = level
+
+            max_dd = min(max_dd, level / peak - 1.0)
+
+        output[0, j] = nobs
+        output[1, j] = numpy.nan
+        output[2, j] = numpy.nan
+        output[3, j] = numpy.nan
+        output[4, j] = numpy.nan
+
+        if nobs > 0:
+            output[1, j] = mean
+            output[4, j] = max_dd
+
+        if nobs > 1:
+            output[2, j] = math.sqrt(max(m2, 0.0) / (nobs - 1))
+
+        if nobs > 3:
+            if m2 > 0:
+                output[3, j] = (nobs * (nobs + 1) * (nobs - 1) * m4 / (m2 * m2) - 3.0 * (nobs - 1) * (nobs - 1)) \
+                               / ((nobs - 2) * (nobs - 3))
+            else:
+                output[3, j] = 0.0
+
+    return output, index
+
+@jit(cache=True, nogil=True)
+def rolling_ret_stats_numba(data, window, min_periods, ann_factor):
+    # fills one buffer with the rolling annualised return, annualised vol, information ratio, drawdown from the peak of
+    # the index in the window (the peak is tracked with a monotonic queue) and the worst of these drawdowns so far
+    rows, cols = data.shape
+    output = numpy.empty((5, rows, cols))
+
+    # levels of the index, and a queue of the rows of the falling peaks in the window
+    index = numpy.empty(rows)
+    queue = numpy.empty(rows, dtype=numpy.int64)
+
+    sqrt_ann_factor = math.sqrt(ann_factor)
+
+    for j in range(cols):
+        mean = 0.0; ssqdm = 0.0; nobs = 0
+        level = 1.0; head = 0; tail = 0; max_dd = 0.0
+
+        for i in range(rows):
+            val = data[i, j]
+
+            # update the mean and sum of squared differences from the mean (Welford's method)
+            if val == val:
+                nobs += 1
+                delta = val - mean
+                mean += delta / nobs
+                ssqdm += ((nobs - 1) * delta * delta) / nobs
+
+                level = level * (1.0 + val)
+
+                while tail > head and index[queue[tail - 1]] <= level:
+                    tail -= 1
+
+                queue[tail] = i; tail += 1
+
+            index[i] = level
+
+            if i >= window:
+                prev = data[i - window, j]
+
+                if prev == prev:
+                    nobs -= 1
+
+                    if nobs > 0:
+                        delta = prev - mean
+                        mean -= delta / nobs
+                        ssqdm -= ((nobs + 1) * delta * delta) / nobs
+                    else:
+                        mean = 0.0; ssqdm = 0.0
+
+                if tail > head and queue[head] <= i - window:
+                    head += 1
+
+            ann_ret = numpy.nan; ann_vol = numpy.nan; ir = numpy.nan; dd = numpy.nan
+
+            if nobs >= min_periods and nobs > 0:
+                ann_ret = mean * ann_factor
+
+                if nobs > 1:
+                    ann_vol = math.sqrt(max(ssqdm, 0.0) / (nobs - 1)) * sqrt_ann_factor
+
+                    if ann_vol > 0: ir = ann_ret / ann_vol
+
+                if val == val:
+                    dd = level / index[queue[head]] - 1.0
+                    max_dd = min(max_dd, dd)
+
+            output[0, i, j] = ann_ret
+            output[1, i, j] = ann_vol
+            output[2, i, j] = ir
+            output[3, i, j] = dd
+
+            if nobs >= min_periods and nobs > 0:
+                output[4, i, j] = max_dd
+            else:
+                output[4, i, j] = numpy.nan
+
+    return output
+
+##### path dependent stops and take profits
+
+@jit(cache=True, nogil=True)
+def _risk_stop_column(signal, level, stop_loss, take_profit, exit_points, mode, trailing, output, j):
+    # walk through the signal for one column: a new trade starts whenever the signal changes, and we record the entry
+    # level and the stop loss/take profit at that point, if the trade P&L breaches either (or there's an exit point), we
+    # go flat until the signal changes again
+    # mode 0 - P&L is the change in level (eg. price), 1 - P&L is the percentage change in level, 2 - level is the P&L
+    rows = signal.shape[0]
+
+    previous = numpy.nan
+    position = 0.0; entry = numpy.nan; best = numpy.nan; sl = numpy.nan; tp = numpy.nan
+
+    for i in range(rows):
+        s = signal[i, j]
+
+        # new trade (NaN to NaN isn't a change)
+        if s != previous and (s == s or previous == previous):
+            previous = s
+            position = s
+
+            entry = numpy.nan; best = numpy.nan
+            sl = stop_loss[i, j]; tp = take_profit[i, j]
+
+        x = level[i, j]
+
+        if position == position and position != 0:
+            if x == x:
+                if entry != entry:
+                    entry = x; best = x
+
+                # for trailing stops, the P&L from the best level in the trade
+                if position > 0 or mode == 2:
+                    best = max(best, x)
+                else:
+                    best = min(best, x)
+
+                if mode == 0:
+                    pnl = (x - entry) * numpy.sign(position)
+                    pnl_from_best = (x - best) * numpy.sign(position)
+                elif mode == 1:
+                    pnl = (x / entry - 1.0) * numpy.sign(position)
+                    pnl_from_best = (x / best - 1.0) * numpy.sign(position)
+                else:
+                    pnl = x
+                    pnl_from_best = x - best
+
+                if trailing:
+                    stop_pnl = pnl_from_best
+                else:
+                    stop_pnl = pnl
+
+                if stop_pnl < sl or pnl > tp:
+                    position = 0.0
+
+            if exit_points[i, j]:
+                position = 0.0
+
+        output[i, j] = position
+
+@jit(cache=True, nogil=True)
+def risk_stop_numba(signal, level, stop_loss, take_profit, exit_points, mode, trailing):
+    output = numpy.empty(signal.shape)
+
+    for j in range(signal.shape[1]):
+        _risk_stop_column(signal, level, stop_loss, take_profit, exit_points, mode, trailing, output, j)
+
+    return output
+
+@jit(cache=True, nogil=True, parallel=True)
+def risk_stop_parallel_numba(signal, level, stop_loss, take_profit, exit_points, mode, trailing):
+    output = numpy.empty(signal.shape)
+
+    for j in prange(signal.shape[1]):
+        _risk_stop_column(signal, level, stop_loss, take_profit, exit_points, mode, trailing, output, j)
+
+    return output
@@ -0,0 +1,236 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import collections
+
+import numpy
+import pandas
+
+from findatapy.util.dataconstants import DataConstants
+from findatapy.util.loggermanager import LoggerManager
+
+class CutSnapshot(object):
+    """Takes daily snapshots of intraday data at cut times (eg. TOK, LDN, NYC), defined by a timezone and local time.
+
+    The UTC instant of each cut is calculated for every day at once (handling DST), and then we take the last value at or
+    before each instant, using a binary search on the sorted index, for every column at once.
+
+    """
+
+    def __init__(self):
+        self.logger = LoggerManager().getLogger(__name__)
+
+    def get_cut_definition(self, cut):
+        """Gets the timezone and local time of a cut
+
+        Parameters
+        ----------
+        cut : str or tuple
+            name of cut in DataConstants.cut_times eg. 'NYC' or (timezone, local time) eg. ('America/New_York', '10:00')
+
+        Returns
+        -------
+        str, pandas.Timedelta
+        """
+
+        if isinstance(cut, str):
+            if cut not in DataConstants().cut_times:
+                raise Exception("Cut " + cut + " is not defined in DataConstants.cut_times")
+
+            cut = DataConstants().cut_times[cut]
+
+        tz, time = cut
+
+        return tz, pandas.Timedelta(time + ':00' if time.count(':') == 1 else time)
+
+    def get_cut_instants(self, dates, cut):
+        """Calculates the UTC instants of a cut for each date. If the local time doesn't exist (on the day DST starts) we
+        take the next valid time, and if it is ambiguous (on the day DST ends) the first one
+
+        Parameters
+        ----------
+        dates : DatetimeIndex
+            local dates (any time of day is ignored)
+        cut : str or tuple
+            name of cut in DataConstants.cut_times or (timezone, local time)
+
+        Returns
+        -------
+        DatetimeIndex
+            in UTC
+        """
+
+        tz, time = self.get_cut_definition(cut)
+
+        dates = pandas.DatetimeIndex(dates)
+
+        if dates.tz is not None: dates = dates.tz_localize(None)
+
+        local = dates.normalize() + time
+
+        return local.tz_localize(tz, ambiguous=numpy.ones(len(local), dtype=bool),
+                                 nonexistent='shift_forward').tz_convert('UTC')
+
+    def create_cut_instants(self, start_date, finish_date, cut, freq = 'B'):
+        """Calculates the UTC instants of a cut for every day between two dates
+
+        Parameters
+        ----------
+        start_date : str/datetime
+            first local date
+        finish_date : str/datetime
+            last local date
+        cut : str or tuple
+            name of cut in DataConstants.cut_times or (timezone, local time)
+        freq : str
+            'B' for weekdays (default) or 'D' for every day
+
+        Returns
+        -------
+        DatetimeIndex
+            in UTC
+        """
+
+        dates = pandas.date_range(pandas.Timestamp(start_date).normalize(), pandas.Timestamp(finish_date).normalize(),
+                                  freq=freq)
+
+        return self.get_cut_instants(dates, cut)
+
+    def snapshot(self, data_frame, cut, freq = 'B', tolerance = None, date_index = False):
+        """Takes daily snapshots of intraday data at a cut, using the last valid value of each column at or before the
+        cut instant
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            intraday data (naive timestamps are assumed to be UTC)
+        cut : str or tuple
+            name of cut in DataConstants.cut_times or (timezone, local time)
+        freq : str
+            'B' for weekdays (default) or 'D' for every day
+        tolerance : str/Timedelta (optional)
+            maximum age of the last value before the cut, older values are NaN (default: no limit)
+        date_index : bool
+            index the output by local date, rather than the UTC cut instant (default: False)
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        return self.snapshot_cuts(data_frame, [cut], freq=freq, tolerance=tolerance, date_index=date_index)[cut]
+
+    def snapshot_cuts(self, data_frame, cuts = ['TOK', 'LDN', 'NYC'], freq = 'B', tolerance = None, date_index = False):
+        """Takes daily snapshots of intraday data at several cuts
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            intraday data (naive timestamps are assumed to be UTC)
+        cuts : str (list)
+            names of cuts in DataConstants.cut_times (or (timezone, local time) tuples)
+        freq : str
+            'B' for weekdays (default) or 'D' for every day
+        tolerance : str/Timedelta (optional)
+            maximum age of the last value before the cut, older values are NaN (default: no limit)
+        date_index : bool
+            index the output by local date, rather than the UTC cut instant (default: False)
+
+        Returns
+        -------
+        dict
+            DataFrame of snapshots for each cut
+        """
+
+        if isinstance(cuts, (str, tuple)): cuts = [cuts]
+
+        index = pandas.DatetimeIndex(data_frame.index)
+
+        if index.tz is None:
+            index = index.tz_localize('UTC')
+        else:
+            index = index.tz_convert('UTC')
+
+        if not(index.is_monotonic_increasing):
+            order = numpy.argsort(index.values, kind='stable')
+            index = index[order]
+            data_frame = data_frame.iloc[order]
+
+        snapshots = collections.OrderedDict()
+
+        if len(index) == 0:
+            for cut in cuts:
+                snapshots[cut] = pandas.DataFrame(columns=data_frame.columns)
+
+            return snapshots
+
+        times = index.values.astype('datetime64[ns]').astype(numpy.int64)
+        values = numpy.asarray(data_frame.values)
+
+        # last valid row of each column at every row (so NaNs in one column don't hide older values), shared by all the
+        # cuts, if there are no NaNs this is just the row
+        valid = ~pandas.isnull(values)
+
+        if valid.all():
+            last_valid = None
+        else:
+            last_valid = numpy.where(valid, numpy.arange(len(index))[:, numpy.newaxis], -1)
+            last_valid = numpy.maximum.accumulate(last_valid, axis=0)
+
+        columns = numpy.arange(len(data_frame.columns))[numpy.newaxis, :]
+
+        for cut in cuts:
+            tz, time = self.get_cut_definition(cut)
+
+            # cuts on every local day covered by the data (only keeping those inside the data)
+            first = index[0].tz_convert(tz).tz_localize(None)
+            last = index[-1].tz_convert(tz).tz_localize(None)
+
+            dates = pandas.date_range(first.normalize(), last.normalize(), freq=freq)
+            instants = self.get_cut_instants(dates, cut)
+
+            inside = (instants >= index[0]) & (instants <= index[-1])
+            dates = dates[inside]; instants = instants[inside]
+
+            cut_times = instants.values.astype('datetime64[ns]').astype(numpy.int64)
+
+            # last row at or before each cut
+            pos = numpy.searchsorted(times, cut_times, side='right') - 1
+
+            if last_valid is None:
+                rows = numpy.repeat(pos[:, numpy.newaxis], len(data_frame.columns), axis=1)
+            else:
+                rows = last_valid[pos]
+
+            missing = rows < 0
+
+            if tolerance is not None:
+                age = cut_times[:, numpy.newaxis] - times[numpy.maximum(rows, 0)]
+                missing = missing | (age > pandas.Timedelta(tolerance).value)
+
+            output = values[numpy.maximum(rows, 0), columns]
+
+            if missing.any():
+                if output.dtype.kind in 'iub': output = output.astype(numpy.float64)
+
+                output[missing] = numpy.nan
+
+            if date_index:
+                out_index = pandas.DatetimeIndex(dates, name='Date')
+            else:
+                out_index = instants
+
+            snapshots[cut] = pandas.DataFrame(output, index=out_index, columns=data_frame.columns)
+
+        return snapshots
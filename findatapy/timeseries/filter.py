@@ -215,6 +215,88 @@ class Filter(object):
 
         return self.filter_time_series_by_date_offset(start_date, finish_date, data_frame, offset, exclude_start_end = False)
 
+    def extract_event_windows(self, data_frame, event_times, pre, post, freq = '1min', rebase = None,
+                              tolerance = None):
+        """Extracts windows of a time series around many events (eg. economic data releases) at once, sampling on a grid
+        of times relative to each event (using the last value at or before each time)
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            time series (eg. intraday prices), naive timestamps are assumed to be UTC
+        event_times : DatetimeIndex (or list)
+            times of events, naive timestamps are assumed to be UTC
+        pre : str/Timedelta
+            time before each event eg. '30min'
+        post : str/Timedelta
+            time after each event eg. '2h'
+        freq : str/Timedelta
+            spacing of the grid of relative times (default: '1min')
+        rebase : str (optional)
+            'ratio' to divide by the last value before each event, or 'diff' to subtract it (default: None)
+        tolerance : str/Timedelta (optional)
+            maximum age of a value, older values are NaN (default: freq)
+
+        Returns
+        -------
+        numpy.ndarray, TimedeltaIndex
+            (event x relative time x column) array of values and the relative times
+        """
+
+        if rebase not in [None, 'ratio', 'diff']:
+            raise Exception("Rebase " + str(rebase) + " is not recognised, should be 'ratio' or 'diff'")
+
+        freq = pandas.Timedelta(freq)
+
+        if tolerance is None: tolerance = freq
+
+        offsets = pandas.timedelta_range(-pandas.Timedelta(pre), pandas.Timedelta(post), freq=freq)
+
+        index = pandas.DatetimeIndex(data_frame.index)
+        event_times = pandas.DatetimeIndex(event_times)
+
+        index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+        event_times = event_times.tz_localize('UTC') if event_times.tz is None else event_times.tz_convert('UTC')
+
+        if not(index.is_monotonic_increasing):
+            order = np.argsort(index.values, kind='stable')
+            index = index[order]
+            data_frame = data_frame.iloc[order]
+
+        times = index.values.astype('datetime64[ns]').astype(np.int64)
+        values = np.asarray(data_frame.values, dtype=np.float64)
+
+        if len(times) == 0:
+            return np.full((len(event_times), len(offsets), values.shape[1]), np.nan), offsets
+
+        events = event_times.values.astype('datetime64[ns]').astype(np.int64)
+
+        # times of every point in every window (event x relative time) and the last point at or before each
+        grid = events[:, np.newaxis] + offsets.values.astype('timedelta64[ns]').astype(np.int64)[np.newaxis, :]
+
+        pos = np.searchsorted(times, grid, side='right') - 1
+
+        tolerance = pandas.Timedelta(tolerance).value
+
+        missing = (pos < 0) | (grid > times[-1]) | (grid - times[np.maximum(pos, 0)] > tolerance)
+
+        windows = values[np.maximum(pos, 0)]
+        windows[missing] = np.nan
+
+        if rebase is not None:
+            # last value before each event (which is no older than the tolerance)
+            event_pos = np.searchsorted(times, events, side='left') - 1
+
+            base = values[np.maximum(event_pos, 0)]
+            base[(event_pos < 0) | (events - times[np.maximum(event_pos, 0)] > tolerance)] = np.nan
+
+            if rebase == 'ratio':
+                windows = windows / base[:, np.newaxis, :]
+            elif rebase == 'diff':
+                windows = windows - base[:, np.newaxis, :]
+
+        return windows, offsets
+
     def filter_time_series_by_days(self, days, data_frame):
         """Filter time series by start/finish dates
 
@@ -670,6 +752,7 @@ import pandas
 import pandas.tseries.offsets
 
 from findatapy.timeseries.timezone import Timezone
+from findatapy.timeseries.cutsnapshot import CutSnapshot
 
 from pandas.tseries.offsets import BDay
 from pandas.tseries.offsets import CustomBusinessDay
@@ -682,36 +765,100 @@ class Calendar(object):
 
     """
 
+    _bus_day_cache = {} # business days for each calendar and range of years, shared across all instances of object!
+
     def get_business_days_tenor(self, tenor):
-        if tenor == '1W':
-            return 5
-        elif tenor == 'ON':
+        """Gets the (approximate) number of business days in a tenor eg. ON, 3D, 1W, 3M, 1Y
+
+        Parameters
+        ----------
+        tenor : str
+            tenor
+
+        Returns
+        -------
+        int
+            None if the tenor is not recognised
+        """
+        if tenor in ['ON', 'TN']:
             return 1
-        elif tenor == '1M':
-            return 20
-        elif tenor == '3M':
-            return 60
-        elif tenor == '6M':
-            return 120
-        elif tenor == '1Y':
-            return 252
+
+        units = {'D' : 1, 'W' : 5, 'M' : 20, 'Y' : 252}
+
+        try:
+            return int(tenor[:-1]) * units[tenor[-1].upper()]
+        except (ValueError, KeyError, TypeError):
+            return None
 
     def get_dates_from_tenors(self, start, end, calendar, tenor):
         freq = str(self.get_business_days_tenor(tenor)) + "B"
         return pandas.DataFrame(index=pandas.bdate_range(start, end, freq=freq))
 
     def get_expiries_from_dates(self, date_time_index, calendar, tenor):
-        freq = self.get_business_days_tenor(tenor)
+        """Gets the expiry of a tenor for each date (in business days, skipping the holidays of a calendar)
+
+        Parameters
+        ----------
+        date_time_index : DatetimeIndex
+            dates
+        calendar : str
+            business calendar to use eg. 'FX' (or None for weekdays only)
+        tenor : str
+            tenor eg. 1W, 1M
+
+        Returns
+        -------
+        DatetimeIndex
+        """
+        bus_days = self.get_business_days_tenor(tenor)
+
+        if bus_days is None:
+            raise Exception("Tenor " + str(tenor) + " is not recognised")
+
+        date_time_index = pandas.DatetimeIndex(date_time_index)
+
+        if len(date_time_index) == 0:
+            return date_time_index
+
+        # work in local time
+        local = date_time_index.tz_localize(None) if date_time_index.tz is not None else date_time_index
+        dates = local.normalize()
+
+        holidays = self._get_holidays_array(dates.min(), dates.max() + timedelta(days=bus_days * 2 + 14), calendar)
+
+        # dates which aren't business days roll back first, like BDay
+        expiries = numpy.busday_offset(dates.values.astype('datetime64[D]'), bus_days, roll='backward',
+                                       holidays=holidays)
+
+        # keep the time of day
+        expiries = pandas.DatetimeIndex(expiries.astype(local.values.dtype)) + (local - dates)
 
-        return pandas.DatetimeIndex(date_time_index + BDay(freq))
+        if date_time_index.tz is not None:
+            expiries = expiries.tz_localize(date_time_index.tz)
+
+        return expiries
 
     def align_to_NY_cut_in_UTC(self, date_time):
 
-        tstz = Timezone()
-        date_time = tstz.localise_index_as_new_york_time(date_time)
-        date_time.index = date_time.index + timedelta(hours=10)
+        index = pandas.DatetimeIndex(date_time.index)
+
+        # NY 10am on each date (in UTC), taking into account DST
+        cut = numpy.array(CutSnapshot().get_cut_instants(index, 'NYC').tz_localize(None).values)
+
+        # times which aren't midnight are treated as NY times and have 10 hours added (as before)
+        not_midnight = numpy.asarray(index != index.normalize())
+
+        if not_midnight.any():
+            tstz = Timezone()
+
+            shifted = tstz.localise_index_as_new_york_time(pandas.Series(0, index=index[not_midnight])).index \
+                      + timedelta(hours=10)
 
-        return tstz.convert_index_aware_to_UTC_time(date_time)
+            cut[not_midnight] = shifted.tz_convert('UTC').tz_localize(None).values
+
+        date_time.index = pandas.DatetimeIndex(cut).tz_localize('UTC')
+
+        return date_time
 
     def floor_date(self, data_frame):
         data_frame.index = data_frame.index.normalize()
@@ -725,37 +872,62 @@ class Calendar(object):
         """ get_bus_day_of_month(date = list of dates, cal = calendar name)
 
             returns the business day of the month (ie. 3rd Jan, on a Monday,
-            would be the 1st business day of the month
+            would be the 1st business day of the month (dates which aren't business days get the next business day)
         """
-        filter = Filter()
 
         try:
             date = date.normalize() # strip times off the dates - for business dates just want dates!
         except: pass
 
-        start = pandas.to_datetime(datetime.datetime(date.year[0], date.month[0], 1))
-        end = datetime.datetime.today()#pandas.to_datetime(datetime.datetime(date.year[-1], date.month[-1], date.day[-1]))
+        date = pandas.DatetimeIndex(date)
+
+        if date.tz is not None: date = date.tz_localize(None)
+
+        date = date.values.astype('datetime64[D]')
+
+        if len(date) == 0:
+            return numpy.zeros(0)
+
+        bus_dates, work_day_index = self._get_business_days(date.min(), date.max(), cal)
+
+        return work_day_index[bus_dates.searchsorted(date)]
+
+    def _get_business_days(self, start, end, cal):
+        # business days (and business day of month) for whole years (with a month spare at the end, so dates near the end
+        # of the year always have a following business day), which are cached
+        start_year = int(str(start)[0:4]); end_year = int(str(end)[0:4])
+
+        key = (cal, start_year, end_year)
+
+        if key not in Calendar._bus_day_cache:
+            start = numpy.datetime64(str(start_year) + '-01-01')
+            end = numpy.datetime64(str(end_year + 1) + '-02-01')
+
+            holidays = self._get_holidays_array(start, end, cal)
+
+            all_days = numpy.arange(start, end, dtype='datetime64[D]')
+            bus_dates = all_days[numpy.is_busday(all_days, holidays=holidays)]
 
-        holidays = filter.get_holidays(start, end, cal)
+            # count of business days within each month (cumulative count, restarting at each new month)
+            month = bus_dates.astype('datetime64[M]')
 
-        bday = CustomBusinessDay(holidays=holidays, weekmask='Mon Tue Wed Thu Fri')
+            new_month = numpy.ones(len(bus_dates), dtype=bool)
+            new_month[1:] = month[1:] != month[:-1]
 
-        bus_dates = pandas.date_range(start, end, freq=bday)
+            month_start = numpy.nonzero(new_month)[0]
+            work_day_index = numpy.arange(len(bus_dates)) - month_start[numpy.cumsum(new_month) - 1] + 1
 
-        month = bus_dates.month
+            Calendar._bus_day_cache[key] = (bus_dates, work_day_index.astype(numpy.float64))
 
-        work_day_index = numpy.zeros(len(bus_dates))
-        work_day_index[0] = 1
+        return Calendar._bus_day_cache[key]
 
-        for i in range(1, len(bus_dates)):
-            if month[i] == month[i-1]:
-                work_day_index[i] = work_day_index[i-1] + 1
-            else:
-                work_day_index[i] = 1
+    def _get_holidays_array(self, start, end, cal):
+        if cal is None or cal == 'WEEKDAY':
+            return numpy.array([], dtype='datetime64[D]')
 
-        bus_day_of_month = work_day_index[bus_dates.searchsorted(date)]
+        holidays = Filter().get_holidays(pandas.Timestamp(start), pandas.Timestamp(end), cal)
 
-        return bus_day_of_month
+        return pandas.DatetimeIndex(holidays).values.astype('datetime64[D]')
 
     def set_market_holidays(self, holiday_df):
         self.holiday_df = holiday_df
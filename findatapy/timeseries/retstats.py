@@ -13,10 +13,12 @@ __author__ = 'saeedamen' # Saeed Amen
 #
 
 import math
+import numpy
 import pandas
 import collections
 
 from findatapy.timeseries.calculations import Calculations
+from findatapy.timeseries.calculations_numba import ret_stats_numba, rolling_ret_stats_numba
 
 
 class RetStats(object):
@@ -34,6 +36,7 @@ class RetStats(object):
         self._kurtosis = None
         self._dd = None
         self._yoy_rets = None
+        self._dd_episodes = None
 
     def split_into_dict(self):
         """If we have multiple columns in our returns, we can opt to split up the RetStats object into a dictionary of
@@ -47,9 +50,10 @@ class RetStats(object):
 
         ret_stats_dict = collections.OrderedDict()
 
-        for d in self._returns_df.columns:
+        for i in range(0, len(self._returns_df.columns)):
+            d = self._returns_df.columns[i]
 
-            returns_df = pandas.DataFrame(self._returns_df[d])
+            returns_df = self._returns_df.iloc[:, [i]]
 
             # if column is of the form asset / signal, just keep the asset part
             try:
@@ -57,9 +61,19 @@ class RetStats(object):
             except:
                 pass
 
-            returns_df.columns = [d]
+            returns_df = returns_df.set_axis([d], axis=1)
 
-            ret_stats_dict[d] = RetStats(returns_df, self._ann_factor)
+            ret_stats = RetStats(returns_df, self._ann_factor)
+
+            # if we have already calculated the statistics for all the columns, share them rather than recalculating
+            if self._rets is not None:
+                ret_stats._rets, ret_stats._vol, ret_stats._inforatio, ret_stats._kurtosis, ret_stats._dd = \
+                    [x.iloc[[i]].set_axis([d]) for x in [self._rets, self._vol, self._inforatio, self._kurtosis,
+                                                         self._dd]]
+
+                ret_stats._yoy_rets = self._yoy_rets.iloc[:, [i]].set_axis([d], axis=1)
+
+            ret_stats_dict[d] = ret_stats
 
         return ret_stats_dict
 
@@ -99,26 +113,175 @@ class RetStats(object):
         if returns_df is None: returns_df = self._returns_df
         if ann_factor is None: ann_factor = self._ann_factor
 
-        # TODO work on optimizing this method
-        self._rets = returns_df.mean(axis=0) * ann_factor
-        self._vol = returns_df.std(axis=0) * math.sqrt(ann_factor)
-        self._inforatio = self._rets / self._vol
-        self._kurtosis = returns_df.kurtosis(axis=0) / math.sqrt(ann_factor)
+        # calculate the mean, std, kurtosis, drawdown and index in one pass over the returns
+        stats, index = ret_stats_numba(numpy.asfortranarray(returns_df.values, dtype=numpy.float64))
+
+        columns = returns_df.columns
 
-        index_df = (1.0 + returns_df).cumprod()
+        self._rets = pandas.Series(stats[1] * ann_factor, index=columns)
+        self._vol = pandas.Series(stats[2] * math.sqrt(ann_factor), index=columns)
+        self._inforatio = self._rets / self._vol
+        self._kurtosis = pandas.Series(stats[3] / math.sqrt(ann_factor), index=columns)
+        self._dd = pandas.Series(stats[4], index=columns)
 
-        if pandas.__version__ < '0.17':
-            max2here = pandas.expanding_max(index_df)
-        else:
-            max2here = index_df.expanding(min_periods=1).max()
+        index_df = pandas.DataFrame(index, index=returns_df.index, columns=columns)
 
-        dd2here = index_df / max2here - 1
+        try:
+            index_df = index_df.resample('YE').mean()
+        except ValueError:
+            index_df = index_df.resample('A').mean()
 
-        self._dd = dd2here.min()
-        self._yoy_rets = index_df.resample('A').mean().pct_change()
+        self._yoy_rets = index_df / index_df.shift(1) - 1
 
         return self
 
+    def calculate_rolling_ret_stats(self, returns_df = None, ann_factor = None, periods = None, min_periods = None):
+        """Calculates rolling (or expanding) return statistics for an asset's returns, including IR, vol, ret and
+        drawdowns, updating them incrementally as the window moves
+
+        Parameters
+        ----------
+        returns_df : DataFrame
+            asset returns
+        ann_factor : int
+            annualisation factor to use on return statistics
+        periods : int (optional)
+            rolling window (default: None, for expanding statistics)
+        min_periods : int (optional)
+            minimum number of observations (default: periods, or 2 for expanding statistics)
+
+        Returns
+        -------
+        dict
+            DataFrames of 'ann_returns', 'ann_vol', 'inforatio', 'drawdown' (from the peak within the window) and for
+            expanding statistics 'max_drawdown' (worst drawdown so far)
+        """
+
+        if returns_df is None: returns_df = self._returns_df
+        if ann_factor is None: ann_factor = self._ann_factor
+
+        expanding = periods is None
+
+        if expanding:
+            periods = len(returns_df.index)
+
+            if min_periods is None: min_periods = 2
+
+        if min_periods is None: min_periods = periods
+
+        output = rolling_ret_stats_numba(numpy.asfortranarray(returns_df.values, dtype=numpy.float64), periods,
+                                         min_periods, float(ann_factor))
+
+        keys = ['ann_returns', 'ann_vol', 'inforatio', 'drawdown']
+
+        if expanding: keys.append('max_drawdown')
+
+        stats = collections.OrderedDict()
+
+        for i in range(0, len(keys)):
+            stats[keys[i]] = pandas.DataFrame(output[i], index=returns_df.index, columns=returns_df.columns)
+
+        return stats
+
+    def calculate_drawdown_episodes(self, returns_df = None):
+        """Finds every drawdown episode for each asset's returns (from the peak of the index, through the trough, to the
+        recovery of the peak), using vectorised run detection on the drawdown from the running maximum. NaN returns are
+        treated as unchanged prices.
+
+        Parameters
+        ----------
+        returns_df : DataFrame
+            asset returns
+
+        Returns
+        -------
+        DataFrame
+            One row per episode, with 'asset', 'peak', 'trough' and 'recovery' dates (NaT if not recovered yet), 'depth'
+            (drawdown at the trough), 'duration' (periods from peak to recovery), 'periods_to_trough' and
+            'periods_to_recovery' (from the trough)
+        """
+
+        if returns_df is None: returns_df = self._returns_df
+
+        columns = ['asset', 'peak', 'trough', 'recovery', 'depth', 'duration', 'periods_to_trough',
+                   'periods_to_recovery']
+
+        rows = len(returns_df.index)
+
+        index = numpy.cumprod(1.0 + numpy.nan_to_num(returns_df.values.astype(numpy.float64)), axis=0)
+        drawdown = index / numpy.maximum.accumulate(index, axis=0) - 1.0
+
+        # flatten column by column, so each run of underwater points belongs to a single column
+        drawdown = drawdown.T.ravel()
+
+        pos = numpy.nonzero(drawdown < 0)[0]
+
+        if len(pos) == 0:
+            self._dd_episodes = pandas.DataFrame(columns=columns)
+
+            return self._dd_episodes
+
+        values = drawdown[pos]
+
+        # a new run starts whenever the points aren't consecutive or we move to a new column
+        start = numpy.ones(len(pos), dtype=bool)
+        start[1:] = (numpy.diff(pos) != 1) | (numpy.diff(pos // rows) != 0)
+
+        start_loc = numpy.nonzero(start)[0]
+        end_loc = numpy.append(start_loc[1:], len(pos)) - 1
+
+        episode = numpy.cumsum(start) - 1
+
+        depth = numpy.minimum.reduceat(values, start_loc)
+
+        # trough is the first point in each run at the depth
+        at_depth = numpy.nonzero(values == depth[episode])[0]
+        trough_loc = at_depth[numpy.unique(episode[at_depth], return_index=True)[1]]
+
+        col = pos[start_loc] // rows
+        peak = pos[start_loc] % rows - 1
+        trough = pos[trough_loc] % rows
+        recovery = pos[end_loc] % rows + 1
+
+        recovered = recovery < rows
+
+        dates = returns_df.index
+
+        recovery_dates = pandas.Series(pandas.NaT, index=numpy.arange(len(depth)), dtype=dates.dtype)
+        recovery_dates[recovered] = dates[recovery[recovered]]
+
+        recovery = numpy.where(recovered, recovery, numpy.nan)
+
+        self._dd_episodes = pandas.DataFrame({'asset' : numpy.asarray(returns_df.columns)[col],
+                                              'peak' : dates[peak], 'trough' : dates[trough],
+                                              'recovery' : recovery_dates.values, 'depth' : depth,
+                                              'duration' : recovery - peak, 'periods_to_trough' : trough - peak,
+                                              'periods_to_recovery' : recovery - trough}, columns=columns)
+
+        return self._dd_episodes
+
+    def top_drawdowns(self, n = 5, returns_df = None):
+        """Gets the deepest drawdown episodes for each asset
+
+        Parameters
+        ----------
+        n : int
+            number of episodes for each asset
+        returns_df : DataFrame (optional)
+            asset returns (default: use episodes already calculated for our returns)
+
+        Returns
+        -------
+        DataFrame
+        """
+
+        if returns_df is not None or self._dd_episodes is None:
+            self.calculate_drawdown_episodes(returns_df)
+
+        episodes = self._dd_episodes.sort_values(['depth'], kind='stable')
+
+        return episodes.groupby('asset', sort=False).head(n).sort_values(['asset', 'depth'], kind='stable')
+
     def ann_returns(self):
         """Gets annualised returns
 
@@ -200,10 +363,10 @@ class RetStats(object):
         stat_list = []
 
         for i in range(0, len(self._rets.index)):
-            stat_list.append(self._rets.index[i] + " Ret = " + str(round(self._rets[i] * 100, 1))
-                             + "% Vol = " + str(round(self._vol[i] * 100, 1))
-                             + "% IR = " + str(round(self._inforatio[i], 2))
-                             + " Dr = " + str(round(self._dd[i] * 100, 1))
-                             + "% Kurt = " + str(round(self._kurtosis[i], 2)))
+            stat_list.append(self._rets.index[i] + " Ret = " + str(round(self._rets.iloc[i] * 100, 1))
+                             + "% Vol = " + str(round(self._vol.iloc[i] * 100, 1))
+                             + "% IR = " + str(round(self._inforatio.iloc[i], 2))
+                             + " Dr = " + str(round(self._dd.iloc[i] * 100, 1))
+                             + "% Kurt = " + str(round(self._kurtosis.iloc[i], 2)))
 
         return stat_list
\ No newline at end of file
@@ -0,0 +1,263 @@
+__author__ = 'saeedamen' # Saeed Amen
+
+#
+# Copyright 2016 Cuemacro
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#
+# See the License for the specific language governing permissions and limitations under the License.
+#
+
+import numpy
+import pandas
+
+from findatapy.timeseries.filter import Calendar
+from findatapy.util.loggermanager import LoggerManager
+
+# number of possible values of each component of the group key (year is stored as is)
+_radix = {'year' : 10000, 'month' : 13, 'day' : 32, 'bus_day' : 32, 'dayofweek' : 7, 'hour' : 24, 'minute' : 60}
+
+class Seasonality(object):
+    """Calculates seasonal averages of time series (eg. by hour/minute of day, by month and business day of month). The
+    components of each timestamp are encoded into a single integer key, and the sums and counts for each key are
+    accumulated with bincount. Data can be accumulated in chunks (eg. one month of a cache at a time), so we don't need
+    to load long intraday histories into memory at once.
+
+    """
+
+    def __init__(self, components = ['hour', 'minute'], cal = 'FX'):
+        """
+        Parameters
+        ----------
+        components : str (list)
+            components of the timestamps to group by, 'year', 'month', 'day' (of month), 'bus_day' (of month),
+            'dayofweek', 'hour' and 'minute'
+        cal : str
+            business calendar to use for 'bus_day'
+        """
+        self.logger = LoggerManager().getLogger(__name__)
+
+        if isinstance(components, str): components = [components]
+
+        for c in components:
+            if c not in _radix:
+                raise Exception("Seasonality component " + c + " is not recognised")
+
+        self._components = list(components)
+        self._cal = cal
+
+        self.reset()
+
+    def reset(self):
+        """Clears the accumulated sums and counts
+        """
+        self._keys = numpy.zeros(0, dtype=numpy.int64)
+        self._sums = None
+        self._counts = None
+        self._columns = None
+
+    def encode_keys(self, date_index):
+        """Encodes the components of each timestamp into a single integer key
+
+        Parameters
+        ----------
+        date_index : DatetimeIndex
+            timestamps
+
+        Returns
+        -------
+        numpy.ndarray (int64)
+        """
+        keys = numpy.zeros(len(date_index), dtype=numpy.int64)
+
+        for c in self._components:
+            if c == 'bus_day':
+                values = Calendar().get_bus_day_of_month(date_index, self._cal)
+            else:
+                values = getattr(date_index, c)
+
+            keys = keys * _radix[c] + numpy.asarray(values, dtype=numpy.int64)
+
+        return keys
+
+    def decode_keys(self, keys):
+        """Decodes integer keys back into their components
+
+        Parameters
+        ----------
+        keys : numpy.ndarray (int64)
+            keys created by encode_keys
+
+        Returns
+        -------
+        Index or MultiIndex
+        """
+        levels = []
+
+        for c in reversed(self._components):
+            levels.insert(0, keys % _radix[c])
+            keys = keys // _radix[c]
+
+        if len(levels) == 1:
+            return pandas.Index(levels[0], name=self._components[0])
+
+        return pandas.MultiIndex.from_arrays(levels, names=self._components)
+
+    def accumulate(self, data_frame):
+        """Adds the sums and counts (ignoring NaNs) of a chunk of data to those for each key
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            time series (with the same columns as any earlier chunks)
+        """
+        if data_frame is None:
+            return
+
+        if self._columns is None:
+            self._columns = data_frame.columns
+        elif not(data_frame.columns.equals(self._columns)):
+            data_frame = data_frame.reindex(columns=self._columns)
+
+        if len(data_frame.index) == 0:
+            return
+
+        keys, inverse = numpy.unique(self.encode_keys(pandas.DatetimeIndex(data_frame.index)), return_inverse=True)
+
+        values = numpy.asarray(data_frame.values, dtype=numpy.float64)
+        valid = ~numpy.isnan(values)
+        values = numpy.where(valid, values, 0)
+
+        sums = numpy.empty((len(keys), values.shape[1]))
+        counts = numpy.empty((len(keys), values.shape[1]))
+
+        for j in range(0, values.shape[1]):
+            sums[:, j] = numpy.bincount(inverse, weights=values[:, j], minlength=len(keys))
+            counts[:, j] = numpy.bincount(inverse, weights=valid[:, j], minlength=len(keys))
+
+        if self._sums is None:
+            self._keys, self._sums, self._counts = keys, sums, counts
+
+            return
+
+        # merge with the keys we have already seen
+        all_keys = numpy.union1d(self._keys, keys)
+
+        all_sums = numpy.zeros((len(all_keys), values.shape[1])); all_counts = numpy.zeros(all_sums.shape)
+
+        old = numpy.searchsorted(all_keys, self._keys); new = numpy.searchsorted(all_keys, keys)
+
+        all_sums[old] += self._sums; all_counts[old] += self._counts
+        all_sums[new] += sums; all_counts[new] += counts
+
+        self._keys, self._sums, self._counts = all_keys, all_sums, all_counts
+
+    def accumulate_cache(self, fname, engine = 'columnar', start_date = None, finish_date = None, chunk_freq = 'MS'):
+        """Accumulates data from a cache on disk, one chunk of dates at a time
+
+        Parameters
+        ----------
+        fname : str
+            cache to be read
+        engine : str
+            'columnar', 'tick', 'arctic' or 'partitioned' (eg. 'partitioned_columnar') which read only the chunk's
+            dates (other engines are read at once)
+        start_date : str/datetime
+            start date of the data to use
+        finish_date : str/datetime
+            finish date of the data to use
+        chunk_freq : str
+            frequency of chunks (default: 'MS', monthly)
+        """
+        from findatapy.market.ioengine import IOEngine
+
+        io_engine = IOEngine()
+
+        def read(start, finish):
+            return io_engine.read_time_series_cache_from_disk(fname, engine=engine, start_date=start,
+                                                              finish_date=finish)
+
+        if not(engine in ['columnar', 'tick', 'arctic'] or engine.startswith('partitioned')) \
+                or start_date is None or finish_date is None:
+            self.logger.info("Reading all of " + fname + " at once")
+
+            data_frame = read(start_date, finish_date)
+
+            if data_frame is not None and (start_date is not None or finish_date is not None):
+                data_frame = data_frame.loc[start_date:finish_date]
+
+            self.accumulate(data_frame)
+
+            return
+
+        start_date = pandas.Timestamp(start_date); finish_date = pandas.Timestamp(finish_date)
+
+        boundaries = pandas.date_range(start_date, finish_date, freq=chunk_freq)
+        boundaries = [start_date] + [b for b in boundaries if b > start_date] + [finish_date + pandas.Timedelta(1)]
+
+        for i in range(0, len(boundaries) - 1):
+            # finish date is inclusive, so stop just before the next chunk
+            self.accumulate(read(boundaries[i], boundaries[i + 1] - pandas.Timedelta(1)))
+
+    def get_sum(self):
+        """Gets the sum of each column for every key
+
+        Returns
+        -------
+        DataFrame
+        """
+        return self._to_frame(self._sums)
+
+    def get_count(self):
+        """Gets the number of (non-NaN) observations of each column for every key
+
+        Returns
+        -------
+        DataFrame
+        """
+        return self._to_frame(self._counts)
+
+    def get_mean(self):
+        """Gets the mean of each column for every key
+
+        Returns
+        -------
+        DataFrame
+        """
+        if self._sums is None:
+            return self._to_frame(None)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self._to_frame(self._sums / self._counts)
+
+    def average(self, data_frame):
+        """Calculates the seasonal average of a time series (in memory)
+
+        Parameters
+        ----------
+        data_frame : DataFrame
+            time series
+
+        Returns
+        -------
+        DataFrame
+        """
+        self.reset()
+        self.accumulate(data_frame)
+
+        return self.get_mean()
+
+    def _to_frame(self, values):
+        # empty (but with a level for each component and the columns we've seen)
+        if values is None:
+            columns = self._columns if self._columns is not None else []
+
+            values = numpy.zeros((0, len(columns)))
+
+            return pandas.DataFrame(values, index=self.decode_keys(self._keys), columns=columns)
+
+        return pandas.DataFrame(values, index=self.decode_keys(self._keys), columns=self._columns)
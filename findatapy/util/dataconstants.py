@@ -40,6 +40,42 @@ class DataConstants(object):
     db_cache_port = '6379'
     write_cache_engine = 'redis'  # 'redis' or 'no_cache' means we don't use cache
 
+    ###### COMPRESSION FOR CACHES
+    # codec, level and shuffle filter used by each engine, codecs are 'blosc' (or a blosc compressor eg. 'blosc:lz4',
+    # 'blosc:zstd'), 'zlib' or 'gorilla' (columnar/tick only), shuffle is 'byte', 'bit' or None (Redis only uses the codec)
+    # lower levels are often much quicker to write, with little loss in compression (see CompressionBenchmark)
+    cache_compression = {'hdf5'     : {'codec' : 'blosc', 'level' : 9, 'shuffle' : 'byte'},
+                         'columnar' : {'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : 'byte'},
+                         'tick'     : {'codec' : 'gorilla', 'level' : None, 'shuffle' : None},
+                         'redis'    : {'codec' : 'blosc', 'level' : None, 'shuffle' : None}}
+
+    # override compression for particular categories and engines eg.
+    # {'fx' : {'hdf5' : {'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : 'byte'}}}
+    cache_compression_categories = {}
+
+    # number of values in each block of the 'gorilla' codec (each block has its own bit width)
+    tick_codec_block_size = 1024
+
+    ###### FOR PARTITIONED CACHES ON DISK
+    # intraday caches can be split into ticker/year/month partitions, so reads only touch the partitions which overlap
+    # with the requested dates (loading them in parallel) and writes only rewrite the affected partitions (use engine
+    # 'partitioned' or eg. 'partitioned_columnar' in IOEngine), HDF5 isn't thread safe, so HDF5 partitions are only
+    # loaded in parallel with 'multiprocessing'
+    io_thread_technique = "thread"
+    io_thread_no = 4
+
+    # columnar engine: number of rows in each compressed chunk, and fields (eg. 'close') which are stored uncompressed
+    # so they can be memory mapped when reading
+    columnar_chunk_size = 100000
+    columnar_mmap_fields = []
+
+    ###### CUTS FOR SNAPSHOTS OF INTRADAY DATA
+    # timezone and local time (HH:MM) of each cut (see CutSnapshot), taken each local business day (other cuts can be
+    # added in the same form)
+    cut_times = {'TOK' : ('Asia/Tokyo', '15:00'),
+                 'LDN' : ('Europe/London', '16:00'),
+                 'NYC' : ('America/New_York', '10:00')}
+
     ###### FOR ALIAS TICKERS
     # config file for time series categories
     config_root_folder = root_folder
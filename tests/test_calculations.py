@@ -0,0 +1,326 @@
+import pytest
+import numpy
+import pandas
+
+from findatapy.timeseries import Calculations, RetStats, Seasonality
+
+def test_rolling_numba():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    data = numpy.random.randn(500, 5)
+    data[numpy.random.rand(500, 5) < 0.2] = numpy.nan
+
+    df = pandas.DataFrame(index=pandas.date_range('01 Jan 2017', periods=500), data=data)
+
+    def assert_equal(df1, df2):
+        assert numpy.allclose(df1.values, df2.values, equal_nan=True)
+
+    assert_equal(calculations.rolling_average(df, 20), df.rolling(20).mean())
+    assert_equal(calculations.rolling_sum(df, 20), df.rolling(20).sum())
+    assert_equal(calculations.rolling_volatility(df, 20, obs_in_year=1), df.rolling(20).std())
+    assert_equal(calculations.rolling_z_score(df, 20), (df - df.rolling(20).mean()) / df.rolling(20).std())
+    assert_equal(calculations.rolling_ewma(df, 20), df.ewm(span=20).mean())
+    assert_equal(calculations.rolling_sparse_sum(df, 20), df.rolling(20, min_periods=1).sum())
+    assert_equal(calculations.rolling_sparse_average(df, 20),
+                 df.rolling(20, min_periods=1).sum() / df.rolling(20).count())
+
+    # also works with Series
+    assert_equal(calculations.rolling_average(df[0], 20).to_frame(), df[[0]].rolling(20).mean())
+
+def test_rolling_moments():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    data = numpy.random.randn(500, 5)
+    data[numpy.random.rand(500, 5) < 0.2] = numpy.nan
+
+    df = pandas.DataFrame(index=pandas.date_range('01 Jan 2017', periods=500), data=data)
+
+    moments = calculations.rolling_moments(df, 20, obs_in_year=252)
+
+    rolling = df.rolling(20)
+
+    assert numpy.allclose(moments['mean'].values, rolling.mean().values, equal_nan=True)
+    assert numpy.allclose(moments['std'].values, rolling.std().values, equal_nan=True)
+    assert numpy.allclose(moments['z_score'].values, ((df - rolling.mean()) / rolling.std()).values, equal_nan=True)
+    assert numpy.allclose(moments['vol'].values, (rolling.std() * numpy.sqrt(252)).values, equal_nan=True)
+
+    # Series in, Series out
+    moments = calculations.rolling_moments(df[2], 20)
+
+    assert isinstance(moments['std'], pandas.Series) and moments['std'].name == 2
+    assert numpy.allclose(moments['std'].values, rolling.std()[2].values, equal_nan=True)
+
+def test_rolling_quantile():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    # rounded, so there are many duplicate values
+    data = numpy.round(numpy.random.randn(500, 5), 1)
+    data[numpy.random.rand(500, 5) < 0.2] = numpy.nan
+
+    df = pandas.DataFrame(index=pandas.date_range('01 Jan 2017', periods=500), data=data)
+
+    assert numpy.allclose(calculations.rolling_median(df, 20).values, df.rolling(20).median().values, equal_nan=True)
+
+    for window in [1, 2, 7, 50]:
+        for quantile in [0, 0.1, 0.75, 1]:
+            assert numpy.allclose(calculations.rolling_quantile(df, window, quantile, min_periods=1).values,
+                                  df.rolling(window, min_periods=1).quantile(quantile).values, equal_nan=True)
+
+def test_rolling_corr_matrix():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    # prices, so precision matters
+    data = 100 + numpy.random.randn(500, 4).cumsum(axis=0)
+    data[numpy.random.rand(500, 4) < 0.1] = numpy.nan
+
+    df = pandas.DataFrame(index=pandas.date_range('01 Jan 2017', periods=500), columns=['a', 'b', 'c', 'd'], data=data)
+
+    corr, labels = calculations.rolling_corr_matrix(df, 20)
+
+    expected = df.rolling(20).corr(pairwise=True)
+
+    assert corr.shape == (500, 4, 4)
+    assert numpy.allclose(corr.reshape(500, -1), expected.values.reshape(500, -1), equal_nan=True)
+
+    cov, labels = calculations.rolling_corr_matrix(df, 20, cov=True, upper_triangle=True)
+
+    assert labels == ['a v b', 'a v c', 'a v d', 'b v c', 'b v d', 'c v d']
+    assert numpy.allclose(cov[:, 4], df['b'].rolling(20).cov(df['d']).values, equal_nan=True)
+
+    df_corr = calculations.rolling_corr(df[['a']], 20, data_frame2=df[['b', 'c']])
+
+    assert list(df_corr.columns) == ['a v b', 'a v c']
+    assert numpy.allclose(df_corr['a v c'].values, df['a'].rolling(20).corr(df['c']).values, equal_nan=True)
+
+def test_trade_segments():
+    calculations = Calculations()
+
+    index = pandas.date_range('01 Jan 2017', periods=8)
+
+    signal = pandas.DataFrame(index=index, columns=['EURUSD'], data=[1, 1, 1, -1, -1, 0, 0, 1])
+    returns = pandas.DataFrame(index=index, columns=['EURUSD'], data=[0.01, 0.02, -0.01, 0.01, 0.02, 0.03, 0.01, 0.02])
+
+    # signal applies to the next period's returns, and cumulative returns reset at every new trade
+    cum_rets = calculations.calculate_cum_rets_trades(signal, returns)
+
+    assert numpy.allclose(cum_rets['EURUSD'].values, [numpy.nan, numpy.nan, -0.01, 0, 0.02, 0.05, 0.01, 0.03],
+                          equal_nan=True)
+
+    duration = calculations.calculate_trade_duration(signal)
+
+    assert numpy.allclose(duration['EURUSD'].values, [numpy.nan, numpy.nan, 1, 2, 1, 2, 1, 2], equal_nan=True)
+
+    trade_gains = calculations.calculate_individual_trade_gains(signal, returns)
+    cumulative = calculations.create_mult_index(returns)['EURUSD']
+
+    assert numpy.isclose(trade_gains['EURUSD'].iloc[5], cumulative.iloc[5] / cumulative.iloc[3] - 1)
+    assert trade_gains['EURUSD'].notnull().sum() == 2
+
+def test_risk_stop_path_signals():
+    calculations = Calculations()
+
+    index = pandas.date_range('01 Jan 2017', periods=8)
+
+    signal = pandas.DataFrame(index=index, columns=['EURUSD'], data=[1, 1, 1, 1, 1, -1, -1, -1])
+    price = pandas.DataFrame(index=index, columns=['EURUSD'], data=[100, 103, 101, 104, 104, 104, 103, 107])
+
+    # fixed stop at -2% from the entry price isn't hit on the long, but is hit on the short at the end
+    fixed = calculations.calculate_risk_stop_path_signals(signal, price, -0.02, 0.1)
+
+    assert list(fixed['EURUSD'].values) == [1, 1, 1, 1, 1, -1, -1, 0]
+
+    # trailing stop at -1.5% from the best price is hit on the long (and we don't reenter until the signal changes)
+    trailing = calculations.calculate_risk_stop_path_signals(signal, price, -0.015, 0.1, trailing=True, parallel=True)
+
+    assert list(trailing['EURUSD'].values) == [1, 1, 0, 0, 0, -1, -1, 0]
+
+    # take profit in price amounts
+    take_profit = calculations.calculate_risk_stop_path_signals(signal, price, -10, 3.5, percentage=False)
+
+    assert list(take_profit['EURUSD'].values) == [1, 1, 1, 0, 0, -1, -1, -1]
+
+def test_signal_returns_with_tc_batch():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    index = pandas.bdate_range('01 Jan 2017', periods=300)
+    returns = pandas.DataFrame(index=index, columns=['EURUSD', 'USDJPY'], data=numpy.random.randn(300, 2) * 0.01)
+
+    signals = [numpy.sign(returns.rolling(window).mean()) for window in [5, 10, 20]]
+
+    # small chunks, so we test chunking
+    stats = calculations.calculate_signal_returns_with_tc_batch(signals, returns, 0.0002, chunk_size=2,
+                                                                return_returns=True)
+
+    for i in range(0, len(signals)):
+        strategy_returns = calculations.calculate_signal_returns_with_tc(signals[i], returns, 0.0002)
+
+        assert numpy.allclose(stats['returns'][i], strategy_returns.values, equal_nan=True)
+        assert numpy.allclose(stats['ann_returns'].iloc[i].values, strategy_returns.mean().values * 252)
+        assert numpy.allclose(stats['ann_vol'].iloc[i].values, strategy_returns.std().values * numpy.sqrt(252))
+
+        index_df = (1 + strategy_returns).cumprod()
+
+        assert numpy.allclose(stats['max_drawdown'].iloc[i].values, (index_df / index_df.cummax() - 1).min().values)
+
+def test_linear_regression():
+    calculations = Calculations()
+
+    numpy.random.seed(0)
+
+    index = pandas.bdate_range('01 Jan 2017', periods=200)
+    df_x = pandas.DataFrame(index=index, columns=['x1', 'x2'], data=100 + numpy.random.randn(200, 2).cumsum(axis=0))
+    df_y = pandas.DataFrame(index=index, columns=['y1', 'y2'], data=5 + 0.5 * df_x.values + numpy.random.randn(200, 2))
+    df_y.iloc[10:15, 0] = numpy.nan
+
+    batch = calculations.linear_regression_batch(df_y, df_x, ['y1', 'y2'], ['x1', 'x2'])
+
+    for i in range(0, 2):
+        data = pandas.concat([df_x.iloc[:, i], df_y.iloc[:, i]], axis=1).dropna().values
+
+        assert numpy.allclose(batch[['beta', 'beta_intercept']].iloc[i].values.astype(float),
+                              numpy.polyfit(data[:, 0], data[:, 1], 1))
+        assert numpy.isclose(batch['r2'].iloc[i], numpy.corrcoef(data[:, 0], data[:, 1])[0, 1] ** 2)
+
+    # rolling regression against a single x variable
+    rolling = calculations.rolling_linear_regression(df_y, df_x['x1'], periods=50)
+
+    assert numpy.isnan(rolling['beta']['y2'].iloc[48])
+    assert numpy.allclose(rolling['beta']['y2'].iloc[120],
+                          numpy.polyfit(df_x['x1'].values[71:121], df_y['y2'].values[71:121], 1)[0])
+
+    ols = calculations.linear_regression_single_vars(df_y, df_x, ['y1', 'y2'], ['x1', 'x2'], use_stats_models=False)
+
+    assert numpy.allclose(calculations.strip_linear_regression_output(['a', 'b'], ols, 'beta')['beta'].values,
+                          batch['beta'].values)
+
+    # statsmodels by default
+    ols = calculations.linear_regression_single_vars(df_y, df_x, ['y1', 'y2'], ['x1', 'x2'])
+
+    assert numpy.allclose([o.params[1] for o in ols], batch['beta'].values.astype(float))
+
+def test_ret_stats():
+    numpy.random.seed(0)
+
+    index = pandas.bdate_range('01 Jan 2015', periods=1000)
+    returns = pandas.DataFrame(index=index, columns=['EURUSD', 'USDJPY'], data=numpy.random.randn(1000, 2) * 0.01)
+    returns.iloc[5:10, 1] = numpy.nan
+
+    ret_stats = RetStats(returns, 252).calculate_ret_stats()
+
+    index_df = (1 + returns).cumprod()
+    drawdown = index_df / index_df.expanding(min_periods=1).max() - 1
+
+    assert numpy.allclose(ret_stats.ann_returns().values, returns.mean().values * 252)
+    assert numpy.allclose(ret_stats.ann_vol().values, returns.std().values * numpy.sqrt(252))
+    assert numpy.allclose(ret_stats.kurtosis().values, returns.kurtosis().values / numpy.sqrt(252))
+    assert numpy.allclose(ret_stats.drawdowns().values, drawdown.min().values)
+
+    assert ret_stats.split_into_dict()['USDJPY'].inforatio().iloc[0] == ret_stats.inforatio().iloc[1]
+
+    rolling = ret_stats.calculate_rolling_ret_stats(periods=50)
+
+    assert numpy.allclose(rolling['ann_vol'].values, returns.rolling(50).std().values * numpy.sqrt(252), equal_nan=True)
+    assert numpy.allclose(rolling['drawdown']['EURUSD'].values[49:],
+                          (index_df / index_df.rolling(50).max() - 1)['EURUSD'].values[49:])
+
+    expanding = ret_stats.calculate_rolling_ret_stats()
+
+    assert numpy.allclose(expanding['max_drawdown'].values[-1], drawdown.min().values)
+
+def test_drawdown_episodes():
+    index = pandas.bdate_range('02 Jan 2017', periods=8)
+    returns = pandas.DataFrame(index=index, data={'EURUSD' : [0.1, -0.1, 0.05, 0.1, 0.0, -0.2, 0.1, 0.05],
+                                                  'USDJPY' : [numpy.nan, 0.01, 0.01, 0.01, 0.01, 0.01, 0.01, 0.01]})
+
+    ret_stats = RetStats(returns, 252)
+
+    episodes = ret_stats.calculate_drawdown_episodes()
+
+    assert list(episodes['asset']) == ['EURUSD', 'EURUSD']
+    assert list(episodes['peak']) == [index[0], index[4]]
+    assert list(episodes['trough']) == [index[1], index[5]]
+    assert episodes['recovery'].iloc[0] == index[3] and pandas.isnull(episodes['recovery'].iloc[1])
+    assert numpy.allclose(episodes['depth'].values, [-0.1, -0.2])
+    assert episodes['duration'].iloc[0] == 3
+
+    assert list(ret_stats.top_drawdowns(1)['peak']) == [index[4]]
+
+def test_seasonality(tmp_path):
+    from findatapy.market import IOEngine
+
+    numpy.random.seed(0)
+
+    index = pandas.date_range('01 Jan 2017', '31 Mar 2017 23:45', freq='15min')
+    df = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.random.randn(len(index), 1))
+    df.iloc[::5] = numpy.nan
+
+    expected = df.groupby([index.month, index.hour, index.minute]).mean()
+
+    seasonality = Seasonality(['month', 'hour', 'minute'])
+
+    assert numpy.allclose(seasonality.average(df).values, expected.values)
+
+    # accumulate a cache on disk one month at a time
+    fname = str(tmp_path / 'backtest.fx.dukascopy.intraday.NYC.EURUSD')
+
+    IOEngine().write_time_series_cache_to_disk(fname, df, engine='columnar')
+
+    seasonality.reset()
+    seasonality.accumulate_cache(fname, engine='columnar', start_date='01 Jan 2017', finish_date='31 Mar 2017 23:45')
+
+    assert numpy.allclose(seasonality.get_mean().values, expected.values, atol=1e-6)
+    assert seasonality.get_count().values.sum() == df.count().sum()
+
+    # empty input keeps the columns (and a level for each component) like groupby
+    for average in [Calculations().average_by_hour_min_of_day, Calculations().average_by_month]:
+        expected = average(df).iloc[0:0]
+        empty = average(df.iloc[0:0])
+
+        assert empty.empty and list(empty.columns) == list(df.columns)
+        assert empty.index.nlevels == expected.index.nlevels
+
+def test_join_left_fill_right_asof():
+    calculations = Calculations()
+
+    index = pandas.date_range('02 Jan 2017', '06 Jan 2017', freq='1h')
+    df_left = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.arange(len(index), dtype='float64'))
+
+    signal_index = pandas.DatetimeIndex(['01 Jan 2017 22:00', '03 Jan 2017 22:00', '04 Jan 2017 22:00'])
+    df_right = pandas.DataFrame(index=signal_index, data={'EURUSD.signal' : [1, -1, 1],
+                                                          'USDJPY.signal' : [1, numpy.nan, -1]})
+
+    # same as filling down the union of the indices
+    df_union = df_left.align(df_right, join='outer', axis=0)[1].ffill()
+
+    assert calculations.join_left_fill_right_asof(df_left, df_right)[1].equals(df_union.loc[index])
+
+    # USDJPY signal only lasts an hour, and nothing is more than a day old
+    df_right = calculations.join_left_fill_right_asof(df_left, df_right, tolerance='1D',
+                                                      column_tolerance={'USDJPY.signal' : '1h'})[1]
+
+    assert df_right['EURUSD.signal'].isnull().sum() == 23 + 2
+    assert df_right['USDJPY.signal'].count() == 2
+
+    # mixed dtypes (eg. bool and str) keep the same dtypes as filling down the union of the indices
+    df_right = pandas.DataFrame(index=signal_index, data={'EURUSD.signal' : [1.0, -1.0, 1.0],
+                                                          'EURUSD.long' : [True, False, True],
+                                                          'EURUSD.regime' : ['risk-on', 'risk-off', 'risk-on']})
+
+    df_union = df_left.align(df_right, join='outer', axis=0)[1].ffill()
+    df_asof = calculations.join_left_fill_right_asof(df_left, df_right)[1]
+
+    assert df_asof.equals(df_union.loc[index])
+    assert df_asof['EURUSD.signal'].dtype == numpy.float64 and df_asof['EURUSD.long'].iloc[-1] is True
+
+if __name__ == '__main__':
+    pytest.main()
@@ -1,7 +1,8 @@
 import pytest
+import numpy
 import pandas
 
-from findatapy.timeseries import Filter
+from findatapy.timeseries import Filter, Calendar, CutSnapshot
 
 def test_filtering_by_dates():
     filter = Filter()
@@ -17,5 +18,83 @@ def test_filtering_by_dates():
     assert df.index[0] == pandas.to_datetime(start_date)
     assert df.index[-1]== pandas.to_datetime(finish_date)
 
+def test_cut_snapshot():
+    cut_snapshot = CutSnapshot()
+
+    # NY 10am is 15:00 UTC before DST starts (12 Mar 2017) and 14:00 UTC after
+    instants = cut_snapshot.create_cut_instants('10 Mar 2017', '14 Mar 2017', 'NYC')
+
+    assert list(instants.hour) == [15, 14, 14]
+
+    index = pandas.date_range('09 Mar 2017', '15 Mar 2017', freq='1min', tz='UTC')
+    df = pandas.DataFrame(index=index, data={'EURUSD.close' : numpy.arange(len(index), dtype='float64'),
+                                             'USDJPY.close' : numpy.arange(len(index), dtype='float64')})
+
+    # NaN at the cut, so we should take the previous value
+    df.loc[instants[1], 'USDJPY.close'] = numpy.nan
+
+    snapshots = cut_snapshot.snapshot_cuts(df, ['NYC', 'TOK'])
+
+    assert snapshots['NYC'].index.equals(cut_snapshot.create_cut_instants('09 Mar 2017', '14 Mar 2017', 'NYC'))
+    assert numpy.array_equal(snapshots['NYC']['EURUSD.close'].values, index.get_indexer(snapshots['NYC'].index))
+    assert snapshots['NYC'].loc[instants[1], 'USDJPY.close'] == index.get_loc(instants[1]) - 1
+    assert list(snapshots['TOK'].index.hour) == [6] * 4
+
+    # dates are aligned to NY 10am (also on the day DST starts), other times are NY times with 10 hours added
+    df = pandas.DataFrame(index=pandas.DatetimeIndex(['10 Mar 2017', '12 Mar 2017', '13 Mar 2017', '10 Mar 2017 05:00']),
+                          data={'EURUSD.close' : [1.0, 2.0, 3.0, 4.0]})
+
+    assert list(Calendar().align_to_NY_cut_in_UTC(df).index.hour) == [15, 14, 14, 20]
+
+def test_calendar():
+    calendar = Calendar()
+
+    # 2 Jan 2017 is the 1st business day (1 Jan is a holiday), weekend dates get the next business day
+    dates = pandas.DatetimeIndex(['02 Jan 2017', '03 Jan 2017', '07 Jan 2017', '31 Jan 2017', '01 Feb 2017'])
+
+    assert list(calendar.get_bus_day_of_month(dates, 'FX')) == [1, 2, 6, 22, 1]
+
+    # 1W expiry skips Christmas and New Year
+    expiries = calendar.get_expiries_from_dates(pandas.DatetimeIndex(['22 Dec 2017 10:00', '23 Dec 2017 10:00']), 'FX',
+                                                '1W')
+
+    assert list(expiries) == [pandas.Timestamp('02 Jan 2018 10:00'), pandas.Timestamp('02 Jan 2018 10:00')]
+
+    assert calendar.get_business_days_tenor('3M') == 60 and calendar.get_business_days_tenor('2W') == 10
+    assert calendar.get_business_days_tenor('BROKEN') is None
+
+def test_extract_event_windows():
+    filter = Filter()
+
+    index = pandas.date_range('01 Mar 2017', '10 Mar 2017', freq='1min')
+    df = pandas.DataFrame(index=index, data={'EURUSD.close' : numpy.arange(len(index), dtype='float64'),
+                                             'USDJPY.close' : -numpy.arange(len(index), dtype='float64')})
+
+    # second event is right at the end of the data, so the post event window is NaN
+    events = pandas.DatetimeIndex(['03 Mar 2017 13:30', '10 Mar 2017 00:00'])
+
+    windows, offsets = filter.extract_event_windows(df, events, '5min', '10min', rebase='diff')
+
+    assert windows.shape == (2, 16, 2) and offsets[5] == pandas.Timedelta(0)
+
+    # rebased to the price a minute before the event
+    assert numpy.array_equal(windows[0, :, 0], numpy.arange(-4, 12))
+    assert numpy.array_equal(windows[0, :, 1], -numpy.arange(-4, 12))
+    assert numpy.isnan(windows[1, 6:, :]).all() and windows[1, 5, 0] == 1
+
+    # no prices for the 90 minutes before the first event, so we can't rebase unless we allow older prices
+    df = df.drop(pandas.date_range('03 Mar 2017 12:00', '03 Mar 2017 13:29', freq='1min'))
+
+    windows, offsets = filter.extract_event_windows(df, events, '5min', '10min', rebase='diff')
+
+    assert numpy.isnan(windows[0]).all()
+
+    windows, offsets = filter.extract_event_windows(df, events, '5min', '10min', rebase='diff', tolerance='2h')
+
+    assert windows[0, 5, 0] == index.get_loc(pandas.Timestamp('03 Mar 2017 13:30')) - df.loc['03 Mar 2017 11:59'].iloc[0]
+
+    with pytest.raises(Exception):
+        filter.extract_event_windows(df, events, '5min', '10min', rebase='log')
+
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file
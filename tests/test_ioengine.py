@@ -0,0 +1,244 @@
+import pytest
+import threading
+import numpy
+import pandas
+
+from findatapy.market import IOEngine
+from findatapy.market.columnarstore import ColumnarStore
+from findatapy.market.tickcodec import TickCodec
+from findatapy.market.compressionbenchmark import CompressionBenchmark
+from findatapy.util import DataConstants
+
+def test_hdf5_append_upsert(tmp_path):
+    io_engine = IOEngine()
+
+    fname = str(tmp_path / 'backtest.fx.dukascopy.intraday.NYC.EURUSD')
+
+    index = pandas.date_range('01 Jan 2017', periods=100, freq='1min')
+    df = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.arange(100.0))
+
+    assert io_engine.write_time_series_cache_to_disk(fname, df.iloc[0:60], engine='hdf5_table', append_data=True) == (60, 0)
+
+    # overlaps the last 10 rows on disk
+    assert io_engine.write_time_series_cache_to_disk(fname, df.iloc[50:] * 2, engine='hdf5_table', append_data=True) == (50, 10)
+
+    # overlaps rows in the middle of the stored data
+    assert io_engine.write_time_series_cache_to_disk(fname, df.iloc[10:20] * 3, engine='hdf5_table', append_data=True) == (10, 10)
+
+    df_read = io_engine.read_time_series_cache_from_disk(fname)
+
+    expected = df.copy()
+    expected.iloc[50:] = expected.iloc[50:] * 2
+    expected.iloc[10:20] = expected.iloc[10:20] * 3
+
+    assert df_read.index.equals(expected.index)
+    assert numpy.allclose(df_read.values, expected.values)
+
+def test_partitioned_cache(tmp_path, monkeypatch):
+    io_engine = IOEngine()
+
+    # record the threads each partition is read in
+    threads = []
+    read_partition = IOEngine._read_partition
+
+    def _read_partition(self, fname, partition, entry):
+        threads.append(threading.get_ident())
+
+        return read_partition(self, fname, partition, entry)
+
+    monkeypatch.setattr(IOEngine, '_read_partition', _read_partition)
+
+    fname = str(tmp_path / 'backtest.fx.dukascopy.intraday.NYC.EURUSD')
+
+    index = pandas.date_range('25 Jan 2017', '10 Apr 2017', freq='1h', tz='UTC')
+    df = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.arange(len(index), dtype='float32'))
+
+    assert io_engine.write_time_series_cache_to_disk_partitioned(fname, df) == ['2017/01', '2017/02', '2017/03', '2017/04']
+
+    # only rewrites the March partition, keeping the existing rows outside the new dates
+    df_new = df.loc['10 Mar 2017':'12 Mar 2017'] * 2
+
+    assert io_engine.write_time_series_cache_to_disk_partitioned(fname, df_new) == ['2017/03']
+
+    manifest = io_engine.read_partition_manifest(fname)
+
+    assert sum(x['rows'] for x in manifest['partitions'].values()) == len(index)
+
+    df_read = io_engine.read_time_series_cache_from_disk_partitioned(fname, start_date='01 Mar 2017', finish_date='15 Mar 2017')
+
+    expected = df.loc['01 Mar 2017':'15 Mar 2017 00:00'].copy()
+    expected.loc[df_new.index] = df_new
+
+    assert df_read.index.equals(expected.index)
+    assert numpy.allclose(df_read.values, expected.values)
+
+    # HDF5 isn't thread safe, so HDF5 partitions are read serially
+    assert threads == [threading.get_ident()]
+
+    # through the cache engine names, a fresh write replaces all the partitions, appends only the overlapping ones
+    io_engine.write_time_series_cache_to_disk(fname, df.loc['01 Feb 2017':'28 Feb 2017'], engine='partitioned_columnar')
+
+    assert list(io_engine.read_partition_manifest(fname)['partitions'].keys()) == ['2017/02']
+
+    assert io_engine.write_time_series_cache_to_disk(fname, df_new, engine='partitioned_columnar',
+                                                     append_data=True) == ['2017/03']
+
+    del threads[:]
+
+    df_read = io_engine.read_time_series_cache_from_disk(fname, engine='partitioned', start_date='27 Feb 2017')
+
+    assert df_read.index.equals(df.loc['27 Feb 2017':'28 Feb 2017'].index.append(df_new.index))
+
+    # columnar partitions are read in parallel
+    assert len(threads) == 2 and threading.get_ident() not in threads
+
+    io_engine.remove_time_series_cache_on_disk(fname, engine='partitioned')
+
+    assert io_engine.read_time_series_cache_from_disk(fname, engine='partitioned') is None
+
+def test_columnar_store_append(tmp_path):
+    path = str(tmp_path / 'backtest.fx.dukascopy.tick.NYC.EURUSD.columnar')
+
+    # small chunks, so we test sealing chunks, with bid stored uncompressed (memory mapped)
+    columnar_store = ColumnarStore(chunk_size=7, mmap_fields=['bid'])
+
+    index = pandas.date_range('01 Jan 2017', periods=50, freq='1s', tz='UTC')
+    df = pandas.DataFrame(index=index, data={'EURUSD.bid' : numpy.arange(50.0), 'EURUSD.ask' : numpy.arange(50.0) + 1})
+
+    assert columnar_store.write(path, df.iloc[0:20]) == (20, 0)
+    assert columnar_store.write(path, df.iloc[20:33], append_data=True) == (13, 0)
+    assert columnar_store.write(path, df.iloc[30:50] * 2, append_data=True) == (20, 3)
+
+    expected = df.copy()
+    expected.iloc[30:50] = expected.iloc[30:50] * 2
+
+    df_read = columnar_store.read(path)
+
+    assert df_read.index.equals(expected.index)
+    assert numpy.allclose(df_read.values, expected.values)
+
+    # only reads the chunks between the dates
+    df_read = columnar_store.read(path, start_date='01 Jan 2017 00:00:10', finish_date='01 Jan 2017 00:00:12')
+
+    assert numpy.allclose(df_read.values, expected.iloc[10:13].values)
+
+    index_read, bid_read = columnar_store.read_column(path, 'EURUSD.bid', start_date='01 Jan 2017 00:00:40')
+
+    assert numpy.allclose(bid_read, expected['EURUSD.bid'].values[40:])
+
+def test_tick_codec(tmp_path, monkeypatch):
+    tick_codec = TickCodec(block_size=16)
+
+    random_state = numpy.random.RandomState(0)
+
+    # irregular tick timestamps, prices which are often unchanged and NaNs
+    index = pandas.Timestamp('01 Jan 2017').value + numpy.cumsum(random_state.randint(0, 500, 1000)) * 1000000
+    bid = numpy.round(1.1 + numpy.cumsum(random_state.choice([-1, 0, 0, 1], 1000)) * 0.00001, 5)
+    bid[[5, 500]] = numpy.nan
+
+    for arr in [index, bid, bid.astype('float32'), numpy.array([7], dtype='int64'), numpy.zeros(0)]:
+        decoded = tick_codec.decode(tick_codec.encode(arr), arr.dtype)
+
+        assert decoded.dtype == arr.dtype and decoded.tobytes() == arr.tobytes()
+
+    assert len(tick_codec.encode(bid)) < bid.nbytes / 2
+
+    io_engine = IOEngine()
+
+    fname = str(tmp_path / 'backtest.fx.dukascopy.tick.NYC.EURUSD')
+
+    df = pandas.DataFrame(index=pandas.DatetimeIndex(index.astype('datetime64[ns]')).tz_localize('UTC'),
+                          data={'EURUSD.bid' : bid, 'EURUSD.ask' : bid + 0.00002})
+
+    # small chunks, so the rows are stored in sealed (encoded) chunks
+    columnar_store = ColumnarStore(chunk_size=64, compression=io_engine.get_compression('tick'))
+
+    assert columnar_store.write(io_engine.get_tick_filename(fname), df) == (1000, 0)
+
+    df_read = io_engine.read_time_series_cache_from_disk(fname, engine='tick')
+
+    assert df_read.equals(df)
+
+    # write/read through IOEngine, with small chunks, so most rows are in sealed (encoded) chunks
+    monkeypatch.setattr(DataConstants, 'columnar_chunk_size', 64)
+
+    io_engine.remove_time_series_cache_on_disk(fname, engine='tick')
+
+    assert io_engine.write_time_series_cache_to_disk(fname, df.iloc[0:600], engine='tick') == (600, 0)
+    assert io_engine.write_time_series_cache_to_disk(fname, df.iloc[500:], engine='tick', append_data=True) == (500, 100)
+
+    assert io_engine.read_time_series_cache_from_disk(fname, engine='tick').equals(df)
+
+    df_read = io_engine.read_time_series_cache_from_disk(fname, engine='tick', start_date=df.index[100],
+                                                         finish_date=df.index[199])
+
+    assert df_read.equals(df.iloc[100:200])
+
+def test_hdf5_compression(tmp_path, monkeypatch):
+    tables = pytest.importorskip('tables')
+
+    io_engine = IOEngine()
+
+    fname = str(tmp_path / 'backtest.fx.dukascopy.daily.NYC.EURUSD')
+
+    # override the compression for the fx category
+    monkeypatch.setattr(DataConstants, 'cache_compression_categories',
+                        {'fx' : {'hdf5' : {'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : 'bit'}}})
+
+    assert io_engine.get_compression('hdf5_table', fname) == {'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : 'bit'}
+    assert io_engine.get_compression('hdf5_table', fname.replace('.fx.', '.equities.'))['shuffle'] == 'byte'
+
+    index = pandas.date_range('01 Jan 2017', periods=1000, freq='1min')
+    df = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.arange(1000.0))
+
+    for engine in ['hdf5_fixed', 'hdf5_table']:
+        for shuffle in ['byte', 'bit', None]:
+            io_engine.write_time_series_cache_to_disk(fname, df, engine=engine,
+                                                      compression={'codec' : 'blosc:lz4', 'level' : 5, 'shuffle' : shuffle})
+
+            with tables.open_file(io_engine.get_h5_filename(fname)) as h5_file:
+                for node in h5_file.walk_nodes('/', 'Leaf'):
+                    assert node.filters.complib == 'blosc:lz4' and node.filters.complevel == 5
+                    assert node.filters.shuffle == (shuffle == 'byte') and node.filters.bitshuffle == (shuffle == 'bit')
+
+            assert io_engine.read_time_series_cache_from_disk(fname, engine=engine).equals(df)
+
+def test_compression_benchmark():
+    pytest.importorskip('tables')
+
+    compression_benchmark = CompressionBenchmark()
+
+    candidates = compression_benchmark.get_candidates(codecs=['blosc:lz4', 'zlib'], levels=[1], shuffles=['byte', None])
+
+    assert len(candidates) == 4
+
+    index = pandas.date_range('01 Jan 2017', periods=10000, freq='1min')
+    df = pandas.DataFrame(index=index, columns=['EURUSD.close'], data=numpy.round(1.1 + numpy.arange(10000) * 1e-5, 5))
+
+    results = compression_benchmark.benchmark(df, engine='hdf5_fixed', candidates=candidates, repeats=1)
+
+    assert len(results.index) == 4 and (results['ratio'] > 0).all()
+
+    # the quickest setting, out of those which compress almost as well as the best
+    results = pandas.DataFrame([['zlib', 9, 'byte', 10.0, 10.0, 10.0, 1.0],
+                                ['blosc:lz4', 1, 'byte', 100.0, 200.0, 9.5, 1.0],
+                                ['blosc:lz4', 5, 'bit', 1000.0, 1000.0, 5.0, 2.0]], columns=results.columns)
+
+    assert compression_benchmark.recommend(results) == {'codec' : 'blosc:lz4', 'level' : 1, 'shuffle' : 'byte'}
+
+    # gorilla (which has no level or shuffle filter) is also tested for the tick engine
+    assert {'codec' : 'gorilla', 'level' : None, 'shuffle' : None} in compression_benchmark.get_candidates(engine='tick')
+
+    results = compression_benchmark.benchmark(df, engine='tick', candidates=[{'codec' : 'gorilla', 'level' : None,
+                                                                              'shuffle' : None}], repeats=1)
+
+    assert compression_benchmark.recommend(results) == {'codec' : 'gorilla', 'level' : None, 'shuffle' : None}
+
+    # mixed with other codecs, where pandas stores the missing level as NaN
+    results = pandas.DataFrame([['blosc:lz4', 5, 'byte', 100.0, 200.0, 2.0, 1.0],
+                                ['gorilla', None, None, 200.0, 300.0, 3.0, 0.5]], columns=results.columns)
+
+    assert compression_benchmark.recommend(results) == {'codec' : 'gorilla', 'level' : None, 'shuffle' : None}
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,157 @@
+import pytest
+import threading
+import numpy
+import pandas
+
+from findatapy.market import Market, MarketDataRequest, FXCrossFactory, FXVolFactory
+from findatapy.market.fxclsvolume import FXCLSVolume
+from findatapy.market.indices.indicesfx import IndicesFX
+from findatapy.util import DataConstants
+
+class MockMarketDataGenerator(object):
+    """Returns canned time series for each ticker (or made up ones for other tickers), recording the requests it has
+    been given and the threads they were run in
+    """
+
+    def __init__(self, data = {}):
+        self.data = data
+        self.requests = []
+        self.threads = []
+
+    def fetch_market_data(self, market_data_request):
+        self.requests.append(market_data_request)
+        self.threads.append(threading.get_ident())
+
+        tickers = market_data_request.tickers
+
+        if isinstance(tickers, str): tickers = [tickers]
+
+        index = pandas.bdate_range(market_data_request.start_date, market_data_request.finish_date)
+
+        return pandas.concat([self.data[t].rename(t + '.close') if t in self.data else
+            pandas.Series(numpy.arange(len(index)) + float(sum(map(ord, t + f))), index=index, name=t + '.' + f)
+                for t in tickers for f in market_data_request.fields], axis=1)
+
+def test_plan_usd_legs():
+    fx_cross_factory = FXCrossFactory()
+
+    cross = ['EURUSD', 'USDJPY', 'GBPJPY', 'EURGBP', 'USDUSD']
+
+    # each leg is only downloaded once, in market convention for spot
+    assert fx_cross_factory._plan_usd_legs(cross, 'spot') == ['EURUSD', 'USDJPY', 'GBPUSD', 'USDUSD']
+    assert fx_cross_factory._plan_usd_legs(cross, 'tot') == ['EURUSD', 'JPYUSD', 'GBPUSD', 'USDUSD']
+
+    assert fx_cross_factory._plan_usd_legs(['USDUSD'], 'spot') == ['USDUSD']
+    assert fx_cross_factory._plan_usd_legs(['EURGBP'], 'tot') == ['EURUSD', 'GBPUSD']
+
+def test_fx_cross_tot_different_start_dates():
+    index = pandas.bdate_range('02 Jan 2017', periods=8)
+
+    # GBP leg starts later than the JPY leg
+    jpy = pandas.Series([100, 101, 102, 101, 103, 104, 102, 101.0], index=index)
+    gbp = pandas.Series([numpy.nan] * 3 + [100, 102, 101, 103, 104.0], index=index)
+
+    market_data_generator = MockMarketDataGenerator({'JPYUSD' : jpy, 'GBPUSD' : gbp})
+
+    df = FXCrossFactory(market_data_generator=market_data_generator).get_fx_cross(
+        index[0], index[-1], 'GBPJPY', freq='daily', type='tot')
+
+    # both legs are downloaded in a single request
+    assert len(market_data_generator.requests) == 1
+
+    expected = 100.0 * ((1 + gbp.pct_change()) - (jpy.pct_change())).iloc[4:].cumprod()
+    expected = pandas.concat([pandas.Series([100.0], index=index[3:4]), expected])
+
+    assert df.index.equals(index[3:])
+    assert numpy.allclose(df['GBPJPY-tot.close'].values, expected.values)
+
+def test_fetch_fx_vol_market(monkeypatch):
+    md_request = MarketDataRequest(start_date='02 Jan 2017', finish_date='13 Jan 2017', category='fx-vol-market',
+                                   tickers=['EURUSD', 'USDJPY'], data_source='bloomberg', freq='daily', cut='NYC')
+
+    # downloads from the data vendor run concurrently
+    market_data_generator = MockMarketDataGenerator()
+    df = Market(market_data_generator=market_data_generator)._fetch_fx_vol_market(md_request)
+
+    assert threading.get_ident() not in market_data_generator.threads
+
+    # same output as fetching serially
+    monkeypatch.setattr(DataConstants, 'market_thread_no', {'other' : 0})
+
+    market_data_generator = MockMarketDataGenerator()
+    df_serial = Market(market_data_generator=market_data_generator)._fetch_fx_vol_market(md_request)
+
+    assert set(market_data_generator.threads) == {threading.get_ident()}
+    assert df.equals(df_serial)
+    assert 'EURUSD.close' in df.columns and 'USDJPY.close' in df.columns and 'JPY3M.close' in df.columns
+
+    monkeypatch.undo()
+
+    # requests which read from the cache are never run in threads
+    md_request.cache_algo = 'cache_algo_return'
+
+    market_data_generator = MockMarketDataGenerator()
+    df_cache = Market(market_data_generator=market_data_generator)._fetch_fx_vol_market(md_request)
+
+    assert set(market_data_generator.threads) == {threading.get_ident()}
+    assert df_cache.equals(df)
+
+def test_extract_vol_surface_cube():
+    index = pandas.bdate_range('02 Jan 2017', periods=3)
+
+    quotes = {'V' : 10.0, '25R' : -1.0, '10R' : -2.0, '25B' : 0.2, '10B' : 0.6}
+
+    # no 10 delta risk reversal quote for 3M
+    df = pandas.DataFrame(index=index, data={'EURUSD' + pt + tn + '.close' : quotes[pt] + i
+                          for i, tn in enumerate(['1M', '3M']) for pt in quotes if pt + tn != '10R3M'})
+
+    cube, strikes, tenors = FXVolFactory().extract_vol_surface_cube(df, 'EURUSD', tenor=['1M', '3M', '1Y'])
+
+    assert cube.shape == (3, 5, 3)
+    assert strikes == ['10DP', '25DP', 'ATM', '25DC', '10DC'] and tenors == ['1M', '3M', '1Y']
+
+    # ATM -/+ half the risk reversal plus the butterfly
+    assert numpy.allclose(cube[0, :, 0], [10 + 1 + 0.6, 10 + 0.5 + 0.2, 10, 10 - 0.5 + 0.2, 10 - 1 + 0.6])
+    assert numpy.allclose(cube[0, 1:4, 1], [11 + 0 + 1.2, 11, 11 - 0 + 1.2])
+
+    # missing quotes/tenors are NaN
+    assert numpy.isnan(cube[:, [0, 4], 1]).all() and numpy.isnan(cube[:, :, 2]).all()
+
+def test_fx_cls_volume():
+    market_data_generator = MockMarketDataGenerator()
+
+    df = FXCLSVolume(market_data_generator=market_data_generator).get_fx_volume('02 Jan 2017', '04 Jan 2017',
+                                                                                ['EURUSD', 'USDJPY'])
+
+    df_daily = market_data_generator.fetch_market_data(market_data_generator.requests[0])
+
+    # one row for every hour of each day
+    assert df.index.name == 'Date' and str(df.index.tz) == 'UTC'
+    assert df.index.equals(pandas.date_range('02 Jan 2017', periods=3 * 24, freq='1h', tz='UTC', name='Date'))
+    assert list(df.columns) == ['EURUSD.volume', 'USDJPY.volume']
+
+    for t in ['EURUSD', 'USDJPY']:
+        for d in range(0, 3):
+            assert numpy.array_equal(df[t + '.volume'].values[d * 24:(d + 1) * 24],
+                                     [df_daily[t + '.' + str(h) + 'h'].iloc[d] for h in range(0, 24)])
+
+def test_create_total_return_index():
+    # Thursday, Friday and then Monday after the weekend
+    index = pandas.DatetimeIndex(['05 Jan 2017', '06 Jan 2017', '09 Jan 2017'])
+
+    spot_df = pandas.DataFrame(index=index, data={'AUDJPY.close' : [80.0, 81.0, 80.5]})
+
+    # no deposits on Friday, so should use Thursday's
+    deposit_df = pandas.DataFrame(index=index[[0, 2]], data={'AUDON.close' : [1.5, 1.6], 'JPYON.close' : [-0.1, -0.1]})
+
+    df = IndicesFX().create_total_return_index('AUDJPY', 'ON', spot_df, deposit_df)
+
+    # AUD deposits accrue on ACT/365, JPY on ACT/360
+    friday = 100.0 * (1 + (1 + 0.015 * 1 / 365.0) * (81.0 / 80.0) - (1 - 0.001 * 1 / 360.0))
+    monday = friday * (1 + (1 + 0.016 * 3 / 365.0) * (80.5 / 81.0) - (1 - 0.001 * 3 / 360.0))
+
+    assert df.index.equals(index) and list(df.columns) == ['AUDJPY.close']
+    assert numpy.allclose(df['AUDJPY.close'].values, [100.0, friday, monday])
+
+if __name__ == '__main__':
+    pytest.main()